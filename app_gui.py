@@ -2,9 +2,20 @@ import customtkinter as ctk
 from tkinter import filedialog, messagebox, colorchooser
 import os
 from src import transformer
+from src import instrument
+from src.jobs import JobRunner
+from src.stage_memo import StageMemo
+from src.viewport import ImagePyramid, centered_offset, zoom_about
 from argparse import Namespace 
 from PIL import ImageTk, Image
 import json
+import logging
+import multiprocessing
+
+PREVIEW_CANVAS_SIZE = (980, 720)
+PREVIEW_SETTLE_MS = 150
+# Bộ nhớ tối đa cho ảnh trung gian giữ lại giữa các lần xem trước.
+PREVIEW_MEMO_MB = 256
 
 class ImageTransformerApp(ctk.CTk): 
     def __init__(self):
@@ -23,8 +34,13 @@ class ImageTransformerApp(ctk.CTk):
         self.selected_border_color = "#000000"
         self.selected_shadow_color = "#000000"
         self.preview_image: Image.Image | None = None
+        self.preview_args: Namespace | None = None
         self.preview_window: ctk.CTkToplevel | None = None
+        self.jobs = JobRunner(self.after, on_finished=self.on_job_finished)
+        self.stage_memo = StageMemo(max_bytes=PREVIEW_MEMO_MB << 20)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
         self.create_settings_menu()
+        self.create_status_bar()
         self.tab_view = ctk.CTkTabview(self, width=880)
         self.tab_view.pack(padx=10, pady=10, fill="both", expand=True)
         self.tab_view.add("Bộ lọc & Hiệu ứng")
@@ -71,22 +87,94 @@ class ImageTransformerApp(ctk.CTk):
         )
         self.optionmenu_theme.set("Dark")
         self.optionmenu_theme.grid(row=0, column=1, padx=(0, 20), pady=5, sticky="w")
+        self.btn_save_preset = ctk.CTkButton(self.settings_frame, text="Lưu preset", width=100,
+                                             command=self.run_save_preset)
+        self.btn_save_preset.grid(row=0, column=3, padx=10, pady=5, sticky="e")
         self.settings_frame.grid_columnconfigure(2, weight=1)
 
+    def create_status_bar(self):
+        self.status_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.status_frame.pack(side="bottom", fill="x", padx=20, pady=(0, 10))
+        self.status_frame.grid_columnconfigure(1, weight=1)
+        self.label_status = ctk.CTkLabel(self.status_frame, text="Sẵn sàng", anchor="w", width=260)
+        self.label_status.grid(row=0, column=0, padx=10, sticky="w")
+        self.progress_bar = ctk.CTkProgressBar(self.status_frame)
+        self.progress_bar.set(0)
+        self.progress_bar.grid(row=0, column=1, padx=10, sticky="ew")
+        self.btn_cancel_job = ctk.CTkButton(self.status_frame, text="Hủy", width=80, state="disabled",
+                                            command=self.cancel_jobs)
+        self.btn_cancel_job.grid(row=0, column=2, padx=10)
+
+    def start_job_status(self, message: str):
+        self.label_status.configure(text=message)
+        self.btn_cancel_job.configure(state="normal")
+        self.progress_bar.configure(mode="indeterminate")
+        self.progress_bar.start()
+
+    def on_job_progress(self, job, done, total, message):
+        if total:
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate")
+            self.progress_bar.set(done / total)
+            self.label_status.configure(text=f"{message or job.kind}: {done}/{total}")
+        elif message:
+            self.label_status.configure(text=f"Đang xử lý: {message}")
+
+    def on_job_finished(self, job, outcome: str):
+        if self.jobs.is_busy():
+            return
+        self.progress_bar.stop()
+        self.progress_bar.configure(mode="determinate")
+        self.progress_bar.set(1 if outcome == 'done' else 0)
+        self.btn_cancel_job.configure(state="disabled")
+        self.label_status.configure(text="Đã hủy" if outcome == 'cancelled' else "Sẵn sàng")
+
+    def on_job_error(self, job, error: Exception):
+        messagebox.showerror("Lỗi hệ thống", f"Có lỗi xảy ra: {error}")
+        print(f"Chi tiết lỗi: {error}")
+
+    def cancel_jobs(self):
+        self.jobs.cancel()
+        self.label_status.configure(text="Đang hủy...")
+
+    def on_close(self):
+        self.jobs.shutdown()
+        self.destroy()
+
     def change_appearance_mode_event(self, new_mode: str):
         ctk.set_appearance_mode(new_mode)
         self.current_theme = new_mode
 
+    def run_save_preset(self):
+        args = self.gather_all_args(require_input=False)
+        if args is None:
+            return
+        preset_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            title="Lưu Preset",
+            filetypes=(("Preset JSON", "*.json"), ("All files", "*.*"))
+        )
+        if not preset_path:
+            return
+        if transformer.save_preset(args, preset_path):
+            messagebox.showinfo("Thành công", f"Đã lưu preset tại:\n{preset_path}")
+        else:
+            messagebox.showerror("Lỗi", "Lưu preset thất bại. Kiểm tra console.")
+
     def browse_file(self, file_type="image"):
         if file_type == "image":
-            filetypes = (("Image files", "*.jpg *.jpeg *.png *.webp"), ("All files", "*.*"))
+            filetypes = (("Image files", "*.jpg *.jpeg *.png *.webp"), ("PDF files", "*.pdf"), ("All files", "*.*"))
             title = "Chọn File Ảnh Đầu Vào"
         elif file_type == "pdf":
             filetypes = (("PDF files", "*.pdf"), ("All files", "*.*"))
             title = "Chọn File PDF Đầu Vào"
+        elif file_type == "cube":
+            filetypes = (("LUT files", "*.cube"), ("All files", "*.*"))
+            title = "Chọn File LUT"
         file_path = filedialog.askopenfilename(title=title, filetypes=filetypes)
         if file_path:
             self.preview_image = None
+            self.preview_args = None
         return file_path
     
     def browse_save_location(self, entry_widget, default_ext=".jpg"):
@@ -138,6 +226,14 @@ class ImageTransformerApp(ctk.CTk):
         self.slider_temperature.set(1.0)
         self.slider_temperature.grid(row=5, column=1, padx=10, pady=5, sticky="ew")
         
+        ctk.CTkLabel(frame_basic, text="LUT màu (.cube):").grid(row=6, column=0, padx=10, pady=5, sticky="w")
+        self.entry_lut_path = ctk.CTkEntry(frame_basic, placeholder_text="Đường dẫn file .cube...")
+        self.entry_lut_path.grid(row=6, column=1, padx=10, pady=5, sticky="ew")
+        btn_browse_lut = ctk.CTkButton(frame_basic, text="Duyệt", width=80,
+                                       command=lambda: (self.entry_lut_path.delete(0, "end"),
+                                                        self.entry_lut_path.insert(0, self.browse_file("cube"))))
+        btn_browse_lut.grid(row=6, column=2, padx=10, pady=5)
+        
         frame_artistic = ctk.CTkFrame(scroll)
         frame_artistic.pack(fill="x", padx=10, pady=10)
         
@@ -161,6 +257,11 @@ class ImageTransformerApp(ctk.CTk):
         self.slider_motion_angle.set(0)
         self.slider_motion_angle.grid(row=3, column=2, padx=10, pady=5, sticky="ew")
 
+        ctk.CTkLabel(frame_artistic, text="Độ dài Motion Blur (3-151):").grid(row=4, column=1, padx=10, pady=5, sticky="w")
+        self.slider_motion_size = ctk.CTkSlider(frame_artistic, from_=3, to=151, number_of_steps=74)
+        self.slider_motion_size.set(15)
+        self.slider_motion_size.grid(row=4, column=2, padx=10, pady=5, sticky="ew")
+
         self.var_grayscale_f = ctk.BooleanVar(value=False)
         self.check_grayscale_f = ctk.CTkCheckBox(frame_artistic, text="Đen Trắng", variable=self.var_grayscale_f)
         self.check_grayscale_f.grid(row=5, column=0, padx=10, pady=5, sticky="w")
@@ -495,9 +596,13 @@ class ImageTransformerApp(ctk.CTk):
         self.entry_pdf_dpi.insert(0, "300")
         self.entry_pdf_dpi.grid(row=3, column=1, padx=10, pady=5, sticky="w")
         
+        ctk.CTkLabel(frame_pdf, text="Trang:").grid(row=4, column=0, padx=10, pady=5, sticky="w")
+        self.entry_pdf_pages = ctk.CTkEntry(frame_pdf, width=300, placeholder_text="Tất cả (vd: 1-5,8,10-)")
+        self.entry_pdf_pages.grid(row=4, column=1, padx=10, pady=5, sticky="ew")
+        
         btn_run_pdf = ctk.CTkButton(frame_pdf, text="CHUYỂN ĐỔI PDF", height=40,
                                     command=self.run_pdf_to_jpg)
-        btn_run_pdf.grid(row=4, column=0, columnspan=3, padx=10, pady=10, sticky="ew")
+        btn_run_pdf.grid(row=5, column=0, columnspan=3, padx=10, pady=10, sticky="ew")
 
     def run_format_conversion(self):
         input_path = self.entry_format_input.get()
@@ -508,28 +613,41 @@ class ImageTransformerApp(ctk.CTk):
             messagebox.showerror("Lỗi", "Vui lòng điền đầy đủ thông tin!")
             return
         
-        try:
+        def convert(job):
             img = transformer.open_image(input_path)
-            if img and transformer.save_image(img, output_path, quality):
+            job.check()
+            return bool(img) and transformer.save_image(img, output_path, quality)
+
+        def done(job, success):
+            if success:
                 messagebox.showinfo("Thành công", f"Đã chuyển đổi thành công!\nLưu tại: {output_path}")
-        except Exception as e:
-            messagebox.showerror("Lỗi", f"Có lỗi xảy ra: {e}")
+
+        self.start_job_status("Đang chuyển đổi định dạng...")
+        self.jobs.submit('convert', convert, on_done=done, on_error=self.on_job_error,
+                         on_progress=self.on_job_progress)
 
     def run_pdf_to_jpg(self):
         input_path = self.entry_pdf_input.get()
         output_folder = self.entry_pdf_output.get()
         dpi = self.entry_pdf_dpi.get()
+        pages = self.entry_pdf_pages.get().strip() or None
         
         if not input_path or not output_folder or not dpi.isdigit():
             messagebox.showerror("Lỗi", "Vui lòng điền đầy đủ thông tin hợp lệ!")
             return
         
-        try:
-            success = transformer.process_pdf_to_jpg(input_path, output_folder, int(dpi))
+        def convert(job):
+            return transformer.process_pdf_to_jpg(input_path, output_folder, int(dpi),
+                                                  progress=lambda done, total: job.progress(done, total, "PDF"),
+                                                  pages=pages)
+
+        def done(job, success):
             if success:
                 messagebox.showinfo("Thành công", f"Đã chuyển đổi PDF thành công!\nLưu tại: {output_folder}")
-        except Exception as e:
-            messagebox.showerror("Lỗi", f"Có lỗi xảy ra: {e}")
+
+        self.start_job_status("Đang chuyển đổi PDF...")
+        self.jobs.submit('pdf', convert, on_done=done, on_error=self.on_job_error,
+                         on_progress=self.on_job_progress)
 
     def setup_info_tab(self):
         tab = self.tab_view.tab("Trích xuất thông tin hình ảnh")
@@ -625,11 +743,11 @@ class ImageTransformerApp(ctk.CTk):
                                 font=ctk.CTkFont(size=14, weight="bold"))
         btn_save.grid(row=0, column=1, padx=5, pady=0, sticky="ew")
 
-    def gather_all_args(self) -> Namespace | None:
+    def gather_all_args(self, require_input: bool = True) -> Namespace | None:
         input_file = self.entry_input.get()
         output_file = self.entry_output.get()
         
-        if not input_file:
+        if require_input and not input_file:
             messagebox.showerror("Lỗi", "Vui lòng chọn File Đầu Vào.")
             return None
         
@@ -640,12 +758,14 @@ class ImageTransformerApp(ctk.CTk):
         contrast_val = round(self.slider_contrast_f.get(), 2) if hasattr(self, 'slider_contrast_f') else 1.0
         saturation_val = round(self.slider_saturation.get(), 2) if hasattr(self, 'slider_saturation') else 1.0
         temperature_val = round(self.slider_temperature.get(), 2) if hasattr(self, 'slider_temperature') else 1.0
+        lut_path_val = self.entry_lut_path.get() if hasattr(self, 'entry_lut_path') else ""
         
         artistic_filter_val = self.optionmenu_artistic.get() if hasattr(self, 'optionmenu_artistic') else "None"
         filter_val = self.optionmenu_filter_f.get() if hasattr(self, 'optionmenu_filter_f') and self.optionmenu_filter_f.get() != "None" else None
         
         motion_blur_val = self.var_motion_blur.get() if hasattr(self, 'var_motion_blur') else False
         motion_angle_val = int(self.slider_motion_angle.get()) if hasattr(self, 'slider_motion_angle') else 0
+        motion_size_val = int(self.slider_motion_size.get()) if hasattr(self, 'slider_motion_size') else 15
         
         grayscale_val = self.var_grayscale_f.get() if hasattr(self, 'var_grayscale_f') else False
         invert_val = self.var_invert_f.get() if hasattr(self, 'var_invert_f') else False
@@ -697,12 +817,14 @@ class ImageTransformerApp(ctk.CTk):
             contrast=contrast_val,
             saturation=saturation_val,
             temperature=temperature_val,
+            lut_path=lut_path_val,
             
             artistic_filter=artistic_filter_val,
             filter=filter_val,
             
             motion_blur=motion_blur_val,
             motion_blur_angle=motion_angle_val,
+            motion_blur_size=motion_size_val,
             
             grayscale=grayscale_val,
             invert=invert_val,
@@ -749,21 +871,34 @@ class ImageTransformerApp(ctk.CTk):
             return
         
         print("Bắt đầu xử lý xem trước...")
-        try:
-            img_result = transformer.get_processed_image(args)
+        preview_size = self.get_preview_canvas_size()
+
+        def render(job):
+            return transformer.get_processed_image(args, preview_size=preview_size, progress=job.stage,
+                                                   memo=self.stage_memo)
+
+        def done(job, img_result):
             if img_result:
                 self.preview_image = img_result
+                self.preview_args = args
                 self.show_preview_window(self.preview_image)
             else:
                 messagebox.showerror("Lỗi", "Không thể xử lý ảnh. Kiểm tra console.")
-        except Exception as e:
-            messagebox.showerror("Lỗi hệ thống", f"Có lỗi khi xử lý ảnh: {e}")
-            print(f"Chi tiết lỗi: {e}")
-            import traceback
-            traceback.print_exc()
+
+        # Yêu cầu xem trước mới sẽ hủy yêu cầu cũ đang chạy.
+        self.start_job_status("Đang xử lý xem trước...")
+        self.jobs.submit('preview', render, on_done=done, on_error=self.on_job_error,
+                         on_progress=self.on_job_progress)
+
+    def get_preview_canvas_size(self) -> tuple:
+        if self.preview_window is not None and self.preview_window.winfo_exists():
+            width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+            if width > 1 and height > 1:
+                return (width, height)
+        return PREVIEW_CANVAS_SIZE
 
     def run_save(self):
-        if self.preview_image is None:
+        if self.preview_args is None:
             messagebox.showerror("Lỗi", "Vui lòng 'Xem Trước' ảnh trước khi lưu.")
             return
         output_file = self.entry_output.get()
@@ -772,15 +907,27 @@ class ImageTransformerApp(ctk.CTk):
             return
         quality_val = int(self.slider_quality.get())
         
+        # Ảnh xem trước chỉ là proxy: chạy lại toàn bộ ở độ phân giải gốc với đúng thiết lập đã xem.
+        args = Namespace(**vars(self.preview_args))
+        args.output_path = output_file
+        args.quality = quality_val
+        
+        if self.jobs.is_busy('save'):
+            messagebox.showinfo("Đang lưu", "Ảnh đang được lưu, vui lòng đợi.")
+            return
+        
         print(f"Bắt đầu lưu ảnh tới: {output_file}")
-        try:
-            success = transformer.save_image(self.preview_image, output_file, quality_val)
+
+        def done(job, success):
             if success:
                 messagebox.showinfo("Thành công", f"Đã lưu ảnh thành công tại:\n{output_file}")
             else:
                 messagebox.showerror("Thất bại", "Lưu ảnh thất bại. Kiểm tra console.")
-        except Exception as e:
-            messagebox.showerror("Lỗi hệ thống", f"Có lỗi xảy ra khi lưu: {e}")
+
+        self.start_job_status("Đang lưu ảnh...")
+        self.jobs.submit('save', lambda job: transformer.transform_image(args, progress=job.stage),
+                         on_done=done, on_error=self.on_job_error, on_progress=self.on_job_progress,
+                         supersede=False)
 
     def show_preview_window(self, pil_image: Image.Image):
         if self.preview_window is not None and self.preview_window.winfo_exists():
@@ -794,7 +941,10 @@ class ImageTransformerApp(ctk.CTk):
         self.zoom_scale = 1.0
         self.min_zoom = 0.1
         self.max_zoom = 5.0
-        self.original_image = pil_image.copy()
+        self.original_image = pil_image
+        self.preview_pyramid = ImagePyramid(pil_image)
+        self.view_offset = None
+        self.settle_job = None
         self.auto_fit = False
     
         self.canvas = ctk.CTkCanvas(self.preview_window, bg="gray20", highlightthickness=0)
@@ -862,6 +1012,7 @@ class ImageTransformerApp(ctk.CTk):
         fit_zoom = min(zoom_width, zoom_height)
         fit_zoom = max(self.min_zoom, min(self.max_zoom, fit_zoom))
         self.zoom_scale = fit_zoom
+        self.view_offset = None
         if hasattr(self, 'zoom_slider'):
             try:
                 if self.zoom_slider.winfo_exists():
@@ -877,78 +1028,78 @@ class ImageTransformerApp(ctk.CTk):
             return
         if self.auto_fit:
             self.preview_window.after(100, self.fit_to_window)
+        else:
+            self.update_preview_image(fast=True)
 
     def on_zoom_slider_change(self, value):
         self.auto_fit = False
         new_zoom = float(value) / 100.0
-        old_coords = None
-        if self.drag_data.get("item"):
-            try:
-                old_coords = self.canvas.coords(self.drag_data["item"])
-            except:
-                pass
-        old_zoom = self.zoom_scale
+        if self.view_offset is not None and self.zoom_scale > 0:
+            canvas_width, canvas_height = self.get_preview_canvas_size()
+            self.view_offset = zoom_about(self.view_offset, self.zoom_scale, new_zoom,
+                                          (canvas_width / 2, canvas_height / 2))
         self.zoom_scale = new_zoom
-        self.update_preview_image()
-    
-        if old_coords and len(old_coords) >= 2 and old_zoom > 0:
-           try:
-               canvas_width = self.canvas.winfo_width() or 980
-               canvas_height = self.canvas.winfo_height() or 720
-               canvas_center_x = canvas_width / 2
-               canvas_center_y = canvas_height / 2
-               zoom_ratio = new_zoom / old_zoom
-               dx = old_coords[0] - canvas_center_x
-               dy = old_coords[1] - canvas_center_y
-               new_x = canvas_center_x + dx * zoom_ratio
-               new_y = canvas_center_y + dy * zoom_ratio
-               self.canvas.coords(self.drag_data["item"], new_x, new_y)
-           except:
-              pass  
-
-    def update_preview_image(self):
+        self.update_preview_image(fast=True)
+
+    def update_preview_image(self, fast: bool = False):
         if not hasattr(self, 'preview_window') or not self.preview_window.winfo_exists():
             return
-        new_width = int(self.original_image.width * self.zoom_scale)
-        new_height = int(self.original_image.height * self.zoom_scale)
-        resized_img = self.original_image.copy()
-        resized_img = resized_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        self.photo_image = ImageTk.PhotoImage(resized_img)
-        self.canvas.delete("all")
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
+        canvas_size = self.get_preview_canvas_size()
+        if self.view_offset is None:
+            self.view_offset = centered_offset(self.original_image.size, self.zoom_scale, canvas_size)
     
-        if canvas_width <= 1:
-            canvas_width = 980
-            canvas_height = 720
-        x = canvas_width // 2
-        y = canvas_height // 2
+        # Chỉ dựng phần ảnh nằm trong canvas, lấy từ tầng mipmap phù hợp với mức zoom.
+        resample = Image.Resampling.BILINEAR if fast else Image.Resampling.LANCZOS
+        region, position = self.preview_pyramid.render(self.zoom_scale, self.view_offset, canvas_size, resample)
+        if region is None:
+            self.canvas.delete("all")
+            self.drag_data["item"] = None
+            self.photo_image = None
+        else:
+            self.photo_image = ImageTk.PhotoImage(region)
+            if self.drag_data["item"] is None:
+                self.drag_data["item"] = self.canvas.create_image(*position, image=self.photo_image, anchor="nw")
+            else:
+                self.canvas.itemconfigure(self.drag_data["item"], image=self.photo_image)
+                self.canvas.coords(self.drag_data["item"], *position)
     
-        self.drag_data["item"] = self.canvas.create_image(x, y, image=self.photo_image, anchor="center")
         if hasattr(self, 'zoom_label'):
             try:
                 if self.zoom_label.winfo_exists():
                     self.zoom_label.configure(text=f"Zoom: {int(self.zoom_scale * 100)}%")
             except:
                 pass
+        if fast:
+            self.schedule_preview_settle()
+
+    def schedule_preview_settle(self):
+        if self.settle_job is not None:
+            self.preview_window.after_cancel(self.settle_job)
+        self.settle_job = self.preview_window.after(PREVIEW_SETTLE_MS, self.settle_preview_image)
+
+    def settle_preview_image(self):
+        self.settle_job = None
+        self.update_preview_image()
 
     def on_drag_start(self, event):
          self.drag_data["x"] = event.x
          self.drag_data["y"] = event.y
 
     def on_drag_motion(self, event):
-        if self.drag_data["item"]:
+        if self.view_offset is not None:
             dx = event.x - self.drag_data["x"]
             dy = event.y - self.drag_data["y"]
-            self.canvas.move(self.drag_data["item"], dx, dy)
+            self.view_offset = (self.view_offset[0] + dx, self.view_offset[1] + dy)
             self.drag_data["x"] = event.x
             self.drag_data["y"] = event.y
+            self.update_preview_image(fast=True)
 
     def reset_zoom(self):
          if not hasattr(self, 'preview_window') or not self.preview_window.winfo_exists():
              return
          self.auto_fit = False
          self.zoom_scale = 1.0
+         self.view_offset = None
          if hasattr(self, 'zoom_slider'):
               try:
                   if self.zoom_slider.winfo_exists():
@@ -958,5 +1109,9 @@ class ImageTransformerApp(ctk.CTk):
          self.update_preview_image()
 
 if __name__ == "__main__":
+    # Cần cho bản đóng gói trên Windows: các tiến trình render PDF khởi động lại chính file exe.
+    multiprocessing.freeze_support()
+    # Thông báo từng bước xử lý in ra console như trước (thư viện mặc định không in gì).
+    instrument.add_log_handler(instrument.ConsoleHandler(logging.INFO))
     app = ImageTransformerApp()
     app.mainloop()
\ No newline at end of file
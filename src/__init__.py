@@ -8,6 +8,11 @@ __version__ = "1.0.0"
 __author__ = "Tachibana11111"
 __email__ = "truyenthonga@gmail.com"
 
+import logging
+
+# Thông báo xử lý đi qua logger "src.*"; thư viện mặc định không in gì (xem instrument.log_to_console).
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
 from . import transformer
 
 __all__ = ['transformer']
\ No newline at end of file
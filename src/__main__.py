@@ -0,0 +1,466 @@
+import os
+import sys
+import signal
+import argparse
+import time
+from datetime import datetime
+
+# Các module xử lý (kéo theo cv2/scipy/fitz) chỉ được nạp trong build_parser() và từng lệnh: khi worker
+# được tạo bằng spawn (Windows, bản exe), mỗi worker nạp lại module này và không cần tới chúng.
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"phải là số nguyên >= 1: {value}")
+    return number
+
+def add_trace_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--trace", help="Ghi sự kiện từng bước xử lý (thời gian, CPU, kích thước, bộ nhớ) vào file JSON lines")
+    parser.add_argument("--stage-summary", type=positive_int, nargs="?", const=10, metavar="N",
+                        help="In N bước tốn thời gian nhất của cả lô (mặc định 10)")
+
+def add_target_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--target-size", type=float, metavar="KB",
+                        help="JPEG/WebP: chọn quality cao nhất (không quá -q/preset) cho file không vượt quá KB")
+    parser.add_argument("--min-ssim", type=float,
+                        help="JPEG/WebP: chọn quality thấp nhất có SSIM so với ảnh trước khi nén không dưới giá trị này (vd: 0.98)")
+
+def apply_target_arguments(args, preset: dict) -> bool:
+    if args.target_size is not None:
+        if args.target_size <= 0:
+            print(f"LỖI: --target-size phải lớn hơn 0: {args.target_size}")
+            return False
+        preset['target_size_kb'] = args.target_size
+    if args.min_ssim is not None:
+        if not 0 < args.min_ssim <= 1:
+            print(f"LỖI: --min-ssim phải trong khoảng (0, 1]: {args.min_ssim}")
+            return False
+        preset['min_ssim'] = args.min_ssim
+    return True
+
+def open_sinks(args) -> tuple:
+    # (các sink cần ghi, sink tổng hợp hoặc None) theo --trace/--stage-summary.
+    from . import instrument
+    sinks = []
+    if args.trace:
+        sinks.append(instrument.JsonLinesSink(args.trace))
+    summary = instrument.SummarySink() if args.stage_summary else None
+    if summary:
+        sinks.append(summary)
+    return sinks, summary
+
+def build_parser() -> argparse.ArgumentParser:
+    from . import streaming, tiled, result_cache, watch, service, color_lut, image_index, benchmark
+    parser = argparse.ArgumentParser(prog="python -m src", description="Image Transformer Pro - chế độ dòng lệnh")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_batch = subparsers.add_parser("batch", help="Xử lý hàng loạt ảnh theo preset")
+    p_batch.add_argument("input", help="Thư mục hoặc mẫu glob (vd: 'photos/*.jpg')")
+    p_batch.add_argument("--preset", required=True, help="File preset JSON (lưu từ giao diện)")
+    p_batch.add_argument("-o", "--output-dir", required=True, help="Thư mục lưu kết quả")
+    p_batch.add_argument("-w", "--workers", type=positive_int, default=os.cpu_count(), help="Số tiến trình xử lý song song")
+    p_batch.add_argument("-f", "--format", choices=["jpg", "png", "webp"], help="Định dạng đầu ra (mặc định giữ nguyên)")
+    p_batch.add_argument("-q", "--quality", type=int, help="Chất lượng 1-100 (ghi đè preset)")
+    add_target_arguments(p_batch)
+    p_batch.add_argument("-r", "--recursive", action="store_true", help="Duyệt cả thư mục con")
+    p_batch.add_argument("-v", "--verbose", action="store_true", help="In chi tiết từng bước xử lý")
+    p_batch.add_argument("--tiled", action="store_true",
+                         help="Xử lý theo dải qua file tạm, giới hạn bộ nhớ (cho ảnh rất lớn)")
+    p_batch.add_argument("--memory-budget", type=float, default=tiled.DEFAULT_MEMORY_BUDGET_MB,
+                         help="Ngân sách bộ nhớ mỗi worker khi dùng --tiled (MB)")
+    p_batch.add_argument("--scratch-dir", help="Thư mục chứa file tạm khi dùng --tiled (mặc định: thư mục tạm hệ thống)")
+    p_batch.add_argument("--cache-dir", help="Thư mục cache kết quả: ảnh + preset đã xử lý trước đó chỉ cần sao chép lại")
+    p_batch.add_argument("--cache-size", type=float, default=result_cache.DEFAULT_CACHE_MB,
+                         help="Dung lượng tối đa của cache (MB), xóa kết quả lâu không dùng nhất khi vượt")
+    p_batch.add_argument("--cache-link", action="store_true", help="Trả kết quả từ cache bằng hardlink thay vì sao chép")
+    p_batch.add_argument("--stream", action="store_true",
+                         help="Chạy dạng dây chuyền: giải mã, xử lý, mã hóa trên các luồng riêng (-w là số luồng xử lý)")
+    p_batch.add_argument("--decode-workers", type=positive_int, default=streaming.DEFAULT_DECODE_WORKERS,
+                         help="Số luồng đọc/giải mã ảnh khi dùng --stream")
+    p_batch.add_argument("--encode-workers", type=positive_int, default=streaming.DEFAULT_ENCODE_WORKERS,
+                         help="Số luồng mã hóa/ghi ảnh khi dùng --stream")
+    p_batch.add_argument("--queue-size", type=positive_int, default=streaming.DEFAULT_QUEUE_SIZE,
+                         help="Số ảnh tối đa chờ giữa hai bước khi dùng --stream (giới hạn bộ nhớ)")
+    p_batch.add_argument("--timestamp", help="Cố định thời điểm của timestamp (vd: '2025-01-31 08:00'), cho phép cache")
+    add_trace_arguments(p_batch)
+
+    p_watch = subparsers.add_parser("watch", help="Theo dõi thư mục, tự xử lý ảnh/PDF mới được thả vào")
+    p_watch.add_argument("dirs", nargs="+", help="Các thư mục cần theo dõi")
+    p_watch.add_argument("--preset", help="File preset JSON (mặc định: preset trống, chỉ chuyển định dạng)")
+    p_watch.add_argument("-o", "--output-dir", required=True, help="Thư mục lưu kết quả")
+    p_watch.add_argument("-w", "--workers", type=positive_int, default=os.cpu_count(), help="Số tiến trình xử lý, khởi động sẵn")
+    p_watch.add_argument("-f", "--format", choices=["jpg", "png", "webp"], help="Định dạng đầu ra (mặc định giữ nguyên, PDF ra JPG)")
+    p_watch.add_argument("-q", "--quality", type=int, help="Chất lượng 1-100 (ghi đè preset)")
+    add_target_arguments(p_watch)
+    p_watch.add_argument("--dpi", type=int, help="Độ phân giải khi render PDF (mặc định theo preset, 300)")
+    p_watch.add_argument("--done-dir", help="Nơi chuyển file đã xử lý xong (mặc định: <thư mục theo dõi>/done)")
+    p_watch.add_argument("--failed-dir", help="Nơi chuyển file lỗi, kèm <tên>.error.txt (mặc định: <thư mục theo dõi>/failed)")
+    p_watch.add_argument("--settle", type=float, default=watch.DEFAULT_SETTLE_SECONDS,
+                         help="Số giây kích thước/mtime phải đứng yên trước khi coi file đã chép xong")
+    p_watch.add_argument("--poll", action="store_true",
+                         help="Quét định kỳ thay vì inotify (bắt buộc với thư mục mạng SMB/NFS)")
+    p_watch.add_argument("--poll-interval", type=float, default=watch.DEFAULT_POLL_INTERVAL, help="Chu kỳ quét (giây)")
+    p_watch.add_argument("-r", "--recursive", action="store_true", help="Theo dõi cả thư mục con")
+    p_watch.add_argument("--once", action="store_true", help="Xử lý các file đang có rồi thoát (thay cho cron)")
+    add_trace_arguments(p_watch)
+
+    p_serve = subparsers.add_parser("serve", help="Dịch vụ HTTP cục bộ: gửi ảnh/PDF + preset, nhận lại kết quả")
+    p_serve.add_argument("--host", default=service.DEFAULT_HOST, help="Địa chỉ lắng nghe (mặc định chỉ máy này)")
+    p_serve.add_argument("--port", type=int, default=service.DEFAULT_PORT)
+    p_serve.add_argument("-w", "--workers", type=positive_int, default=os.cpu_count(), help="Số tiến trình xử lý, khởi động sẵn")
+    p_serve.add_argument("--queue", type=int, default=service.DEFAULT_QUEUE_LIMIT,
+                         help="Số request được chờ khi mọi worker đều bận; vượt quá trả 503")
+    p_serve.add_argument("--timeout", type=float, default=service.DEFAULT_TIMEOUT, help="Thời gian chờ tối đa mỗi request (giây), quá thì trả 504")
+    p_serve.add_argument("--max-body", type=float, default=service.DEFAULT_MAX_BODY_MB, help="Dung lượng tối đa mỗi request (MB)")
+    p_serve.add_argument("-v", "--verbose", action="store_true", help="In từng request")
+
+    p_load = subparsers.add_parser("loadtest", help="Đo độ trễ (p50/p99) và số request/s của dịch vụ serve")
+    p_load.add_argument("url", help="vd: http://127.0.0.1:8765/transform?format=webp")
+    p_load.add_argument("--file", required=True, help="Ảnh/PDF gửi trong mỗi request")
+    p_load.add_argument("--preset", help="File preset JSON gửi kèm")
+    p_load.add_argument("-c", "--concurrency", type=positive_int, default=4, help="Số client đồng thời")
+    p_load.add_argument("-n", "--requests", type=positive_int, default=100, help="Tổng số request")
+
+    p_lut = subparsers.add_parser("lut", help="Xuất chuỗi hiệu chỉnh màu của preset thành file .cube")
+    p_lut.add_argument("--preset", required=True, help="File preset JSON")
+    p_lut.add_argument("-o", "--output", required=True, help="File .cube đầu ra")
+    p_lut.add_argument("--image", help="Ảnh mẫu để tính độ sáng trung bình cho bước tương phản")
+    p_lut.add_argument("--size", type=int, default=color_lut.LUT_SIZE, help="Kích thước LUT (2-65)")
+
+    p_pdf = subparsers.add_parser("pdf", help="Chuyển các trang PDF sang JPG")
+    p_pdf.add_argument("input", help="File PDF đầu vào")
+    p_pdf.add_argument("-o", "--output-dir", required=True, help="Thư mục lưu ảnh")
+    p_pdf.add_argument("--dpi", type=int, default=300, help="Độ phân giải (mặc định 300)")
+    p_pdf.add_argument("-p", "--pages", help="Các trang cần chuyển, vd: '1-5,8,10-' (mặc định: tất cả)")
+    p_pdf.add_argument("-w", "--workers", type=positive_int, default=os.cpu_count(), help="Số tiến trình render song song")
+    p_pdf.add_argument("--preset", help="Áp dụng preset JSON lên từng trang (trong bộ nhớ, không qua JPG trung gian)")
+    p_pdf.add_argument("-f", "--format", choices=["jpg", "png", "webp"], default="jpg", help="Định dạng đầu ra khi dùng --preset")
+    p_pdf.add_argument("-q", "--quality", type=int, help="Chất lượng 1-100 (ghi đè preset)")
+    add_target_arguments(p_pdf)
+    add_trace_arguments(p_pdf)
+
+    p_index = subparsers.add_parser("index", help="Chỉ mục thông tin ảnh (SQLite), chỉ đọc header")
+    index_commands = p_index.add_subparsers(dest="index_command", required=True)
+    p_scan = index_commands.add_parser("scan", help="Quét thư mục, chỉ đọc lại file mới/đã thay đổi")
+    p_scan.add_argument("root", help="Thư mục cần quét")
+    p_scan.add_argument("--db", default=image_index.DEFAULT_INDEX_PATH, help="File chỉ mục SQLite")
+    p_scan.add_argument("--no-recursive", dest="recursive", action="store_false", help="Không duyệt thư mục con")
+    p_scan.add_argument("-w", "--workers", type=positive_int, help="Số luồng đọc header")
+    p_query = index_commands.add_parser("query", help="Tìm ảnh trong chỉ mục")
+    p_query.add_argument("--db", default=image_index.DEFAULT_INDEX_PATH, help="File chỉ mục SQLite")
+    p_query.add_argument("--min-width", type=int)
+    p_query.add_argument("--max-width", type=int)
+    p_query.add_argument("--min-height", type=int)
+    p_query.add_argument("--max-height", type=int)
+    p_query.add_argument("--format", help="JPEG, PNG, WEBP, TIFF, BMP, PDF...")
+    p_query.add_argument("--exif", dest="has_exif", action="store_true", default=None, help="Chỉ ảnh có EXIF")
+    p_query.add_argument("--no-exif", dest="has_exif", action="store_false", help="Chỉ ảnh không có EXIF")
+    p_query.add_argument("--min-pages", type=int, help="Số trang/khung hình tối thiểu")
+    p_query.add_argument("--under", help="Chỉ các file nằm trong thư mục này")
+    p_query.add_argument("--errors", action="store_true", help="Gồm cả file không đọc được")
+    p_query.add_argument("--sort", default="path", choices=sorted(image_index.ORDER_COLUMNS))
+    p_query.add_argument("--desc", action="store_true", help="Sắp xếp giảm dần")
+    p_query.add_argument("--limit", type=int)
+    p_query.add_argument("--count", action="store_true", help="Chỉ in số kết quả")
+
+    p_bench = subparsers.add_parser("bench", help="Đo thời gian và bộ nhớ của từng thao tác trên ảnh/PDF giả lập")
+    p_bench.add_argument("--sizes", default=",".join(f"{s:g}" for s in benchmark.DEFAULT_SIZES),
+                         help=f"Các kích thước ảnh (MP), vd: '1,4,16,100' (mặc định: {','.join(map(str, benchmark.DEFAULT_SIZES))})")
+    p_bench.add_argument("--ops", help="Chỉ đo các thao tác này (tên hoặc mẫu glob, cách nhau bởi dấu phẩy), vd: 'sepia,preset_*'")
+    p_bench.add_argument("--repeat", type=positive_int, default=benchmark.DEFAULT_REPEAT, help="Số lần lặp mỗi phép đo (lấy lần nhanh nhất)")
+    p_bench.add_argument("--baseline", help="File baseline JSON để so sánh; trả mã lỗi 1 nếu có hồi quy")
+    p_bench.add_argument("--save", help="Ghi kết quả lần chạy này thành file baseline JSON")
+    p_bench.add_argument("--threshold", type=float, default=benchmark.DEFAULT_THRESHOLD,
+                         help="Ngưỡng chậm đi cho phép so với baseline (0.25 = 25%%)")
+    p_bench.add_argument("--memory-threshold", type=float, default=benchmark.DEFAULT_MEMORY_THRESHOLD,
+                         help="Ngưỡng tăng bộ nhớ đỉnh cho phép so với baseline")
+    p_bench.add_argument("--list", action="store_true", help="Liệt kê các thao tác có thể đo")
+    return parser
+
+def run_batch_command(args) -> int:
+    from . import transformer, batch, streaming, renditions, instrument
+    try:
+        preset = transformer.read_preset(args.preset)
+    except Exception as e:
+        print(f"LỖI khi đọc preset {args.preset}: {e}")
+        return 2
+    if args.quality is not None:
+        preset['quality'] = max(1, min(100, args.quality))
+    if not apply_target_arguments(args, preset):
+        return 2
+    try:
+        if renditions.parse_renditions(preset.get('renditions')) and args.tiled:
+            print("LỖI: --tiled chưa hỗ trợ preset có renditions")
+            return 2
+    except ValueError as e:
+        print(f"LỖI trong preset {args.preset}: {e}")
+        return 2
+    if args.timestamp:
+        try:
+            datetime.fromisoformat(args.timestamp)
+        except ValueError:
+            print(f"LỖI: Thời điểm không hợp lệ: {args.timestamp} (dạng YYYY-MM-DD HH:MM[:SS])")
+            return 2
+        preset['timestamp_fixed'] = args.timestamp
+
+    inputs = batch.collect_inputs(args.input, recursive=args.recursive)
+    if not inputs:
+        print(f"LỖI: Không tìm thấy ảnh nào tại: {args.input}")
+        return 2
+
+    if args.stream and args.tiled:
+        print("LỖI: --stream không dùng chung được với --tiled")
+        return 2
+
+    tile_options = None
+    if args.tiled:
+        tile_options = {'memory_budget_mb': args.memory_budget, 'scratch_dir': args.scratch_dir}
+    cache_options = None
+    if args.cache_dir:
+        cache_options = {'cache_dir': args.cache_dir, 'max_bytes': int(args.cache_size * (1 << 20)),
+                         'link': args.cache_link}
+
+    jobs = [(path, batch.build_output_path(path, args.output_dir, args.format, args.input)) for path in inputs]
+    if args.stream:
+        print(f"Bắt đầu xử lý {len(jobs)} ảnh theo dây chuyền: {args.decode_workers} luồng giải mã, "
+              f"{args.workers} luồng xử lý, {args.encode_workers} luồng mã hóa...")
+    else:
+        print(f"Bắt đầu xử lý {len(jobs)} ảnh với {args.workers} worker...")
+    sinks, summary = open_sinks(args)
+    try:
+        with instrument.recording(*sinks):
+            if args.stream:
+                report = streaming.run_stream(jobs, preset, decode_workers=args.decode_workers,
+                                              process_workers=args.workers, encode_workers=args.encode_workers,
+                                              queue_size=args.queue_size, verbose=args.verbose,
+                                              on_result=batch.print_result, cache_options=cache_options)
+            else:
+                report = batch.run_batch(jobs, preset, workers=args.workers, verbose=args.verbose,
+                                         on_result=batch.print_result, tile_options=tile_options,
+                                         cache_options=cache_options)
+    finally:
+        for sink in sinks:
+            sink.close()
+    batch.print_summary(report)
+    if args.stream:
+        streaming.print_stage_stats(report)
+    if summary:
+        summary.print_summary(args.stage_summary)
+    return 0 if not report.failed else 1
+
+def run_watch_command(args) -> int:
+    from . import transformer, batch, renditions, instrument, watch
+    preset = {}
+    if args.preset:
+        try:
+            preset = transformer.read_preset(args.preset)
+        except Exception as e:
+            print(f"LỖI khi đọc preset {args.preset}: {e}")
+            return 2
+    if args.quality is not None:
+        preset['quality'] = max(1, min(100, args.quality))
+    if not apply_target_arguments(args, preset):
+        return 2
+    if args.dpi is not None:
+        preset['pdf_dpi'] = args.dpi
+    try:
+        renditions.parse_renditions(preset.get('renditions'))
+    except ValueError as e:
+        print(f"LỖI trong preset {args.preset}: {e}")
+        return 2
+    for directory in args.dirs:
+        if not os.path.isdir(directory):
+            print(f"LỖI: Không tìm thấy thư mục: {directory}")
+            return 2
+        if os.path.abspath(directory) == os.path.abspath(args.output_dir):
+            print(f"LỖI: Thư mục kết quả phải khác thư mục theo dõi: {directory}")
+            return 2
+
+    sinks, summary = open_sinks(args)
+    try:
+        with instrument.recording(*sinks):
+            hot = watch.HotFolder(args.dirs, args.output_dir, preset, workers=args.workers,
+                                  output_format=args.format, done_dir=args.done_dir, failed_dir=args.failed_dir,
+                                  recursive=args.recursive, settle=args.settle, poll=args.poll,
+                                  poll_interval=args.poll_interval, on_result=batch.print_result)
+            # Ctrl+C / kill: ngừng nhận file mới, làm xong các file đang xử lý rồi thoát.
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: hot.stop())
+            print(f"Đang theo dõi {', '.join(args.dirs)} ({hot.watcher.kind}, {hot.workers} worker)"
+                  + ("" if args.once else ", Ctrl+C để dừng") + "...")
+            try:
+                hot.run(once=args.once)
+            finally:
+                hot.close()
+    finally:
+        for sink in sinks:
+            sink.close()
+    watch.print_watch_summary(hot)
+    if summary:
+        summary.print_summary(args.stage_summary)
+    return 0 if all(r.success for r in hot.results) else 1
+
+def run_serve_command(args) -> int:
+    from . import service
+    try:
+        service.serve(args.host, args.port, args.workers, args.queue, args.timeout, args.max_body, args.verbose)
+    except OSError as e:
+        print(f"LỖI: Không mở được cổng {args.host}:{args.port}: {e}")
+        return 2
+    return 0
+
+def run_loadtest_command(args) -> int:
+    from . import transformer, service
+    try:
+        with open(args.file, 'rb') as f:
+            data = f.read()
+        preset = transformer.read_preset(args.preset) if args.preset else None
+    except Exception as e:
+        print(f"LỖI khi đọc dữ liệu: {e}")
+        return 2
+    print(f"Gửi {args.requests} request tới {args.url} với {args.concurrency} client...")
+    report = service.load_test(args.url, data, preset, args.concurrency, args.requests)
+    service.print_load_report(report)
+    return 0 if report.latencies and not report.errors else 1
+
+def run_lut_command(args) -> int:
+    from . import transformer, instrument
+    try:
+        preset = transformer.load_preset(args.preset)
+    except Exception as e:
+        print(f"LỖI khi đọc preset {args.preset}: {e}")
+        return 2
+    with instrument.log_to_console():
+        reference = None
+        if args.image:
+            reference = transformer.open_image(args.image)
+            if reference is None:
+                return 2
+        return 0 if transformer.export_color_lut(preset, args.output, reference, args.size) else 1
+
+def run_pdf_command(args) -> int:
+    from . import transformer, batch, instrument
+    pdf_args = None
+    if not args.preset and (args.target_size is not None or args.min_ssim is not None):
+        print("LỖI: --target-size/--min-ssim chỉ dùng được cùng --preset")
+        return 2
+    if args.preset:
+        try:
+            preset = transformer.read_preset(args.preset)
+        except Exception as e:
+            print(f"LỖI khi đọc preset {args.preset}: {e}")
+            return 2
+        if args.quality is not None:
+            preset['quality'] = max(1, min(100, args.quality))
+        if not apply_target_arguments(args, preset):
+            return 2
+        if preset.get('renditions'):
+            print("LỖI: renditions chưa hỗ trợ đầu vào PDF")
+            return 2
+        output_path = batch.build_output_path(args.input, args.output_dir, args.format)
+        pdf_args = transformer.load_preset_dict(preset, input_path=args.input, output_path=output_path,
+                                                pdf_dpi=args.dpi, pdf_pages=args.pages)
+    sinks, summary = open_sinks(args)
+    try:
+        # Lệnh pdf in tiến độ từng trang như trước; batch/watch chỉ báo kết quả từng file.
+        with instrument.recording(*sinks), instrument.log_to_console():
+            if pdf_args is None:
+                ok = transformer.process_pdf_to_jpg(args.input, args.output_dir, args.dpi, pages=args.pages,
+                                                    workers=args.workers)
+            else:
+                ok = transformer.transform_pdf(pdf_args, workers=args.workers)
+    finally:
+        for sink in sinks:
+            sink.close()
+    if summary:
+        summary.print_summary(args.stage_summary)
+    return 0 if ok else 1
+
+def run_index_command(args) -> int:
+    from . import image_index
+    with image_index.ImageIndex(args.db) as index:
+        if args.index_command == "scan":
+            if not os.path.isdir(args.root):
+                print(f"LỖI: Không tìm thấy thư mục: {args.root}")
+                return 2
+            report = index.scan(args.root, recursive=args.recursive, workers=args.workers)
+            print(f"Đã quét {args.root} trong {report.seconds:.2f}s: {report.added} mới, {report.updated} thay đổi, "
+                  f"{report.unchanged} không đổi, {report.removed} đã xóa, {report.failed} lỗi.")
+            return 0 if not report.failed else 1
+
+        start = time.perf_counter()
+        records = index.query(min_width=args.min_width, max_width=args.max_width,
+                              min_height=args.min_height, max_height=args.max_height,
+                              format=args.format, has_exif=args.has_exif, min_pages=args.min_pages,
+                              under=args.under, include_errors=args.errors,
+                              order_by=args.sort, descending=args.desc, limit=args.limit)
+        elapsed = time.perf_counter() - start
+        if not args.count:
+            for r in records:
+                if r.error:
+                    print(f"{r.path}\tLỖI: {r.error}")
+                elif r.format == 'PDF':
+                    print(f"{r.path}\tPDF\t{r.pages} trang")
+                else:
+                    exif = "\tEXIF" if r.has_exif else ""
+                    print(f"{r.path}\t{r.width}x{r.height}\t{r.format}\t{r.mode}{exif}")
+        print(f"{len(records)} kết quả ({elapsed * 1000:.1f} ms).")
+        return 0
+
+def run_bench_command(args) -> int:
+    from . import benchmark
+    if args.list:
+        print("\n".join(benchmark.operation_names()))
+        return 0
+    try:
+        sizes = [float(s) for s in args.sizes.split(',') if s.strip()]
+    except ValueError:
+        print(f"LỖI: Danh sách kích thước không hợp lệ: {args.sizes}")
+        return 2
+    operations = [o.strip() for o in args.ops.split(',') if o.strip()] if args.ops else None
+    if operations and not any(benchmark.fnmatch.fnmatch(name, pattern)
+                              for name in benchmark.operation_names() for pattern in operations):
+        print(f"LỖI: Không có thao tác nào khớp với: {args.ops} (xem --list)")
+        return 2
+    baseline = None
+    if args.baseline:
+        try:
+            baseline = benchmark.load_baseline(args.baseline)
+        except Exception as e:
+            print(f"LỖI khi đọc baseline {args.baseline}: {e}")
+            return 2
+
+    print(f"Đo trên ảnh {', '.join(f'{s:g}' for s in sizes)} MP, lặp {args.repeat} lần...")
+    results = benchmark.run_suite(sizes, operations, args.repeat,
+                                  progress=lambda m: print(benchmark.format_measurement(m, baseline), flush=True))
+    if args.save:
+        benchmark.save_baseline(results, args.save)
+        print(f"Đã lưu baseline: {args.save}")
+    if baseline is None:
+        return 0
+    regressions = benchmark.compare(baseline, results, args.threshold, args.memory_threshold)
+    benchmark.print_regressions(regressions)
+    return 1 if regressions else 0
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == "batch":
+        return run_batch_command(args)
+    if args.command == "watch":
+        return run_watch_command(args)
+    if args.command == "serve":
+        return run_serve_command(args)
+    if args.command == "loadtest":
+        return run_loadtest_command(args)
+    if args.command == "lut":
+        return run_lut_command(args)
+    if args.command == "pdf":
+        return run_pdf_command(args)
+    if args.command == "index":
+        return run_index_command(args)
+    if args.command == "bench":
+        return run_bench_command(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import os
+import io
+import glob
+import time
+import contextlib
+import logging
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Tuple
+
+from . import transformer
+from . import fonts
+from . import instrument
+from . import logos
+from . import pipeline
+from . import pdf_raster
+from . import renditions
+from . import tiled
+from . import result_cache
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+
+@dataclass
+class FileResult:
+    input_path: str
+    output_path: str
+    success: bool
+    seconds: float
+    megapixels: float = 0.0
+    error: str = ""
+    worker_pid: int = 0
+    cache_stats: dict = field(default_factory=dict)
+    events: list = field(default_factory=list)   # sự kiện instrument của file này (dạng dict)
+    outputs: list = field(default_factory=list)  # các file đã ghi khi preset có renditions
+
+@dataclass
+class BatchReport:
+    results: List[FileResult]
+    wall_seconds: float
+    workers: int
+
+    @property
+    def succeeded(self) -> List[FileResult]:
+        return [r for r in self.results if r.success]
+
+    @property
+    def failed(self) -> List[FileResult]:
+        return [r for r in self.results if not r.success]
+
+    @property
+    def files_per_second(self) -> float:
+        return len(self.results) / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    @property
+    def megapixels_per_second(self) -> float:
+        total = sum(r.megapixels for r in self.succeeded)
+        return total / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def cache_totals(self) -> dict:
+        # Mỗi worker giữ cache riêng: lấy số liệu mới nhất của từng tiến trình rồi cộng lại.
+        latest = {}
+        for result in self.results:
+            if result.cache_stats:
+                latest[result.worker_pid] = result.cache_stats
+        totals: dict = {}
+        for stats in latest.values():
+            for name, values in stats.items():
+                entry = totals.setdefault(name, {'hits': 0, 'misses': 0})
+                entry['hits'] += values.get('hits', 0)
+                entry['misses'] += values.get('misses', 0)
+        return totals
+
+def collect_inputs(source: str, recursive: bool = False) -> List[str]:
+    if os.path.isdir(source):
+        pattern = os.path.join(source, '**', '*') if recursive else os.path.join(source, '*')
+        candidates = glob.glob(pattern, recursive=recursive)
+    else:
+        candidates = glob.glob(source, recursive=recursive)
+    files = [p for p in candidates
+             if os.path.isfile(p) and os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS]
+    return sorted(files)
+
+def build_output_path(input_path: str, output_dir: str, output_format: str | None = None,
+                      source_root: str | None = None) -> str:
+    if source_root and os.path.isdir(source_root):
+        rel_dir = os.path.dirname(os.path.relpath(input_path, source_root))
+    else:
+        rel_dir = ""
+    base, ext = os.path.splitext(os.path.basename(input_path))
+    if output_format:
+        ext = '.' + output_format.lower().lstrip('.')
+    return os.path.join(output_dir, rel_dir, base + ext)
+
+def _last_error(text: str) -> str:
+    errors = [line.strip() for line in text.splitlines() if 'LỖI' in line or 'CẢNH BÁO' in line]
+    return errors[-1] if errors else ""
+
+def collect_cache_stats() -> dict:
+    info = fonts.font_cache_info()
+    stats = {'font_paths': info['paths'], 'fonts': info['fonts'], 'logos': logos.logo_cache_info()}
+    results = result_cache.result_cache_info()
+    if results['hits'] or results['misses']:
+        stats['results'] = results
+    return stats
+
+def process_file(input_path: str, output_path: str, preset: dict, verbose: bool = False,
+                 tile_options: dict | None = None, cache_options: dict | None = None,
+                 trace: bool = False) -> FileResult:
+    # trace=True: ghi sự kiện từng bước vào FileResult.events để tiến trình chính chuyển cho các sink.
+    start = time.perf_counter()
+    messages = io.StringIO()
+    megapixels = 0.0
+    success = False
+    outputs = []
+    events = instrument.CollectSink()
+    try:
+        with contextlib.ExitStack() as stack:
+            # Lỗi/cảnh báo của file này được gom lại để báo trong FileResult.error; verbose: in thêm từng bước.
+            capture = stack.enter_context(instrument.logging_to(instrument.LogCapture()))
+            stack.enter_context(capture.capture(messages))
+            if verbose:
+                stack.enter_context(instrument.log_to_console())
+            if trace:
+                stack.enter_context(instrument.recording(events, replace=True))
+                stack.enter_context(instrument.source(input_path))
+            args = transformer.load_preset_dict(preset, input_path=input_path, output_path=output_path)
+
+            def run() -> bool:
+                nonlocal megapixels
+                if tile_options is not None:
+                    width, height = tiled.probe_size(input_path)
+                    megapixels = width * height / 1_000_000
+                    return tiled.transform_tiled(args, **tile_options)
+                if pdf_raster.is_pdf(input_path):
+                    # Như transform_image: từng trang qua preset, ghi <tên>_page_<n><đuôi> (chế độ watch).
+                    if args.renditions:
+                        log.error("LỖI: renditions chưa hỗ trợ đầu vào PDF")
+                        return False
+                    return transformer.transform_pdf(transformer.with_pdf_defaults(args), workers=1)
+                img, source_size = transformer.open_image_with_size(input_path, args)
+                if img is None:
+                    return False
+                megapixels = source_size[0] * source_size[1] / 1_000_000
+                if args.renditions:
+                    rendered = renditions.render(img, args)
+                    outputs.extend(output.path for output in rendered)
+                    return renditions.save(rendered)
+                # Preset được dịch một lần cho mỗi tiến trình, dùng lại cho mọi file.
+                img = pipeline.compiled(args)(img)
+                os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+                return transformer.save_image(img, output_path, **transformer.save_options(args))
+
+            cache = result_cache.get_cache(**cache_options) if cache_options else None
+            # Chế độ tile có thể lệch ±1 so với xử lý trong bộ nhớ: giữ khóa cache riêng.
+            success = result_cache.run_cached(cache, args, run, extra={'tiled': True} if tile_options else None)
+    except Exception as e:
+        messages.write(f"LỖI không thể xử lý ảnh: {e}\n")
+    return FileResult(
+        input_path=input_path,
+        output_path=output_path,
+        success=success,
+        seconds=time.perf_counter() - start,
+        megapixels=megapixels,
+        error="" if success else _last_error(messages.getvalue()),
+        worker_pid=os.getpid(),
+        cache_stats=collect_cache_stats(),
+        events=[event.to_dict() for event in events.events],
+        outputs=outputs,
+    )
+
+def run_batch(jobs: List[Tuple[str, str]], preset: dict, workers: int | None = None,
+              verbose: bool = False, on_result=None, tile_options: dict | None = None,
+              cache_options: dict | None = None) -> BatchReport:
+    workers = workers or os.cpu_count() or 1
+    results: List[FileResult] = []
+    start = time.perf_counter()
+    # Đang có sink lắng nghe (instrument.recording): worker ghi sự kiện và gửi về đây.
+    trace = instrument.enabled()
+
+    def finish(result: FileResult):
+        instrument.replay(result.events)
+        result.events = []
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    if workers == 1:
+        for input_path, output_path in jobs:
+            finish(process_file(input_path, output_path, preset, verbose, tile_options, cache_options, trace))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(process_file, i, o, preset, verbose, tile_options, cache_options, trace): (i, o)
+                       for i, o in jobs}
+            for future in as_completed(futures):
+                input_path, output_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = FileResult(input_path, output_path, False, 0.0, error=str(e))
+                finish(result)
+
+    return BatchReport(results=results, wall_seconds=time.perf_counter() - start, workers=workers)
+
+def print_result(result: FileResult):
+    if result.success:
+        outputs = ', '.join(result.outputs) if result.outputs else result.output_path
+        print(f"  [OK]   {result.input_path} -> {outputs} ({result.seconds:.2f}s)")
+    else:
+        print(f"  [LỖI]  {result.input_path}: {result.error or 'không rõ nguyên nhân'}")
+
+def print_summary(report: BatchReport):
+    print(f"Hoàn tất: {len(report.succeeded)}/{len(report.results)} file thành công, "
+          f"{len(report.failed)} lỗi, {report.workers} worker.")
+    print(f"Thời gian: {report.wall_seconds:.2f}s | "
+          f"{report.files_per_second:.2f} file/s | {report.megapixels_per_second:.1f} MP/s")
+    totals = report.cache_totals()
+    if totals:
+        parts = [f"{name} {v['hits']}/{v['hits'] + v['misses']}" for name, v in totals.items()]
+        print("Cache (hit/tổng): " + ", ".join(parts))
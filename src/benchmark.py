@@ -0,0 +1,334 @@
+import gc
+import os
+import io
+import sys
+import json
+import time
+import ctypes
+import fnmatch
+import platform
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Tuple
+
+import fitz
+import numpy as np
+import PIL
+from PIL import Image
+
+from . import color_lut
+from . import transformer
+
+BASELINE_VERSION = 1
+DEFAULT_SIZES = (1, 4, 16)
+SIZES = (1, 4, 16, 100)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_MEMORY_THRESHOLD = 0.25
+# Chênh lệch tuyệt đối nhỏ hơn mức này coi như nhiễu đo, không tính là chậm đi/tốn thêm.
+MIN_SECONDS_DELTA = 0.01
+MIN_MEMORY_DELTA_MB = 8.0
+SAMPLE_INTERVAL = 0.002
+FIXED_TIMESTAMP = "2024-01-01 08:00"
+
+# Diện tích trang A4 theo điểm ảnh ở 1 dpi (8.27 x 11.69 inch).
+_A4_SQUARE_INCHES = 8.27 * 11.69
+
+@dataclass
+class Measurement:
+    name: str                 # "<thao tác>@<MP>MP"
+    seconds: float            # nhanh nhất trong các lần lặp
+    cpu_seconds: float
+    peak_mb: float            # bộ nhớ tăng thêm cao nhất so với lúc bắt đầu (lớn nhất trong các lần lặp)
+    megapixels: float
+
+@dataclass
+class Regression:
+    name: str
+    metric: str               # 'seconds' | 'peak_mb'
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float('inf')
+
+def _text_watermark(img: Image.Image) -> Image.Image:
+    return transformer.create_text_watermark(img, "© Image Transformer Pro", 0.7, 'br', max(12, img.width // 30))
+
+def _timestamp_watermark(img: Image.Image) -> Image.Image:
+    return transformer.create_timestamp_watermark(img, 0.7, 'tl', max(12, img.width // 40), at=FIXED_TIMESTAMP)
+
+def _color_chain(img: Image.Image) -> Image.Image:
+    return color_lut.apply_color_ops(img, [('brightness', 1.1), ('contrast', 1.2), ('saturation', 1.3),
+                                           ('temperature', 1.1)])
+
+def _save(extension: str, **options) -> Callable[[Image.Image], bool]:
+    def save(img: Image.Image) -> bool:
+        fd, path = tempfile.mkstemp(suffix=extension, prefix='itp-bench-')
+        os.close(fd)
+        try:
+            return transformer.save_image(img, path, **options)
+        finally:
+            os.remove(path)
+    return save
+
+# tên -> (hàm nhận ảnh, hàm có sửa ảnh đầu vào tại chỗ không). Ảnh bị sửa được sao chép trước khi bấm giờ.
+OPERATIONS: Dict[str, Tuple[Callable[[Image.Image], object], bool]] = {
+    'crop': (lambda img: transformer.crop_to_aspect_ratio(img, "16:9"), False),
+    'resize_half': (lambda img: img.resize((img.width // 2, img.height // 2), Image.Resampling.LANCZOS), False),
+    'mirror': (lambda img: transformer.mirror_image(img, "Ngang"), False),
+    'sepia': (transformer.apply_sepia, False),
+    'vintage': (transformer.apply_vintage, False),
+    'saturation': (lambda img: transformer.adjust_saturation(img, 1.3), False),
+    'temperature': (lambda img: transformer.adjust_temperature(img, 1.2), False),
+    'color_lut': (_color_chain, False),
+    'emboss': (transformer.apply_emboss, False),
+    'edge_detection': (transformer.apply_edge_detection, False),
+    'oil_painting': (transformer.apply_oil_painting, False),
+    'motion_blur': (lambda img: transformer.apply_motion_blur(img, size=15, angle=30), False),
+    'border': (lambda img: transformer.add_border(img, 20, "#000000"), False),
+    'rounded_corners': (lambda img: transformer.add_rounded_corners(img, max(4, img.width // 20)), False),
+    'shadow': (lambda img: transformer.add_shadow(img, 10, 10, "#000000"), False),
+    'text_watermark': (_text_watermark, True),
+    'timestamp_watermark': (_timestamp_watermark, True),
+    'save_jpeg': (_save('.jpg', quality=90), False),
+    'save_png': (_save('.png'), False),
+}
+
+# Preset đầy đủ chạy qua apply_transformations (cùng đường xử lý với giao diện và dòng lệnh).
+PRESETS: Dict[str, dict] = {
+    'preset_web': {'resize': 'half', 'brightness': 1.1, 'contrast': 1.1, 'saturation': 1.2,
+                   'filter': 'Làm nét', 'watermark_text': '© Studio', 'watermark_font_size': 40},
+    'preset_vintage': {'crop_ratio': '4:3', 'artistic_filter': 'Cổ điển', 'temperature': 1.1,
+                       'border_width': 20, 'border_color': '#FFFFFF', 'rounded_radius': 30},
+    'preset_heavy': {'motion_blur': True, 'motion_blur_size': 25, 'motion_blur_angle': 45,
+                     'grayscale': True, 'pixelate_size': 4, 'shadow_enabled': True,
+                     'timestamp_enabled': True, 'timestamp_fixed': FIXED_TIMESTAMP},
+}
+
+PDF_OPERATION = 'pdf_to_jpg'
+PDF_PAGES = 2
+
+def operation_names() -> List[str]:
+    return list(OPERATIONS) + list(PRESETS) + [PDF_OPERATION]
+
+def image_dimensions(megapixels: float, aspect: float = 3 / 2) -> Tuple[int, int]:
+    height = max(1, int((megapixels * 1_000_000 / aspect) ** 0.5))
+    return max(1, int(height * aspect)), height
+
+def synthetic_image(megapixels: float, seed: int = 0) -> Image.Image:
+    # Ảnh giả lập có nội dung giống ảnh chụp: dải màu mượt + nhiễu, để bộ mã hóa không nén quá dễ.
+    width, height = image_dimensions(megapixels)
+    rng = np.random.default_rng(seed)
+    rows = np.empty((height, width, 3), dtype=np.uint8)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    for top in range(0, height, 256):
+        y = np.linspace(0, 255, height, dtype=np.float32)[top:top + 256, None]
+        noise = rng.integers(-24, 25, (len(y), width, 3), dtype=np.int16)
+        base = np.stack([np.broadcast_to(x, (len(y), width)), np.broadcast_to(y, (len(y), width)),
+                         (x[None, :] + y) / 2], axis=-1)
+        rows[top:top + len(y)] = np.clip(base + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(rows)
+
+def pdf_dpi_for(megapixels: float) -> int:
+    # DPI để mỗi trang A4 render ra khoảng `megapixels` MP.
+    return max(36, round((megapixels * 1_000_000 / _A4_SQUARE_INCHES) ** 0.5))
+
+def synthetic_pdf(path: str, pages: int = PDF_PAGES) -> str:
+    with fitz.open() as document:
+        for number in range(1, pages + 1):
+            page = document.new_page(width=595, height=842)
+            page.insert_text((72, 90), f"Image Transformer Pro - trang {number}", fontsize=24)
+            for row in range(12):
+                color = ((row * 37) % 255 / 255, (row * 71) % 255 / 255, (row * 113) % 255 / 255)
+                page.draw_rect(fitz.Rect(72, 130 + row * 52, 523, 170 + row * 52), color=color, fill=color)
+                page.insert_text((80, 158 + row * 52), "Lorem ipsum dolor sit amet " * 2, fontsize=11,
+                                 color=(1, 1, 1))
+        document.save(path)
+    return path
+
+def _rss_bytes() -> int | None:
+    # Bộ nhớ thường trú hiện tại của tiến trình (Pillow/OpenCV cấp phát ngoài tầm tracemalloc).
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'win32':
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(Counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+def release_free_memory():
+    # Trả bộ nhớ đã giải phóng về hệ điều hành trước mỗi phép đo; nếu không, lần cấp phát sau dùng lại
+    # vùng nhớ cũ mà RSS không tăng và bộ nhớ đỉnh đo được thấp hơn thực tế.
+    gc.collect()
+    if hasattr(Image.core, 'clear_cache'):
+        Image.core.clear_cache()
+    if sys.platform.startswith('linux'):
+        try:
+            ctypes.CDLL(None).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+class PeakMemory:
+    # Lấy mẫu RSS trong một luồng nền; nền tảng không đọc được RSS thì dùng tracemalloc
+    # (chỉ thấy bộ nhớ cấp phát qua Python/numpy).
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_rss = None
+
+    def __enter__(self):
+        self._start_rss = _rss_bytes()
+        if self._start_rss is None:
+            tracemalloc.start()
+            return self
+        self._peak = self._start_rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, _rss_bytes() or 0)
+
+    def __exit__(self, *exc):
+        if self._thread is None:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return
+        self._stop.set()
+        self._thread.join()
+        self._peak = max(self._peak, _rss_bytes() or 0)
+        self.peak_bytes = self._peak - self._start_rss
+
+def measure(name: str, run: Callable[[], object], megapixels: float, repeat: int = DEFAULT_REPEAT,
+            setup: Callable[[], tuple] | None = None) -> Measurement:
+    # setup() chuẩn bị đối số cho mỗi lần chạy (ngoài phần bấm giờ); kết quả bị bỏ ngay sau khi đo.
+    best_wall, best_cpu, peak = float('inf'), float('inf'), 0
+    for _ in range(max(1, repeat)):
+        call_args = setup() if setup else ()
+        release_free_memory()
+        with PeakMemory() as memory, contextlib.redirect_stdout(io.StringIO()):
+            wall, cpu = time.perf_counter(), time.process_time()
+            result = run(*call_args)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        del result, call_args
+        best_wall, best_cpu = min(best_wall, wall), min(best_cpu, cpu)
+        peak = max(peak, memory.peak_bytes)
+    return Measurement(name, round(best_wall, 5), round(best_cpu, 5), round(peak / (1 << 20), 2), megapixels)
+
+def _preset_runner(preset: dict, size: Tuple[int, int]) -> Callable[[Image.Image], Image.Image]:
+    if preset.get('resize') == 'half':
+        preset = {**preset, 'resize': f"{size[0] // 2}x{size[1] // 2}"}
+    args = transformer.load_preset_dict(preset)
+    return lambda img: transformer.apply_transformations(img, args)
+
+def run_suite(sizes=DEFAULT_SIZES, operations: List[str] | None = None, repeat: int = DEFAULT_REPEAT,
+              progress=None) -> List[Measurement]:
+    # operations: tên hoặc mẫu glob (vd 'preset_*'); None -> tất cả.
+    selected = [name for name in operation_names()
+                if not operations or any(fnmatch.fnmatch(name, pattern) for pattern in operations)]
+    results: List[Measurement] = []
+    for megapixels in sizes:
+        image_names = [n for n in selected if n != PDF_OPERATION]
+        img = synthetic_image(megapixels) if image_names else None
+        for name in image_names:
+            label = f"{name}@{megapixels:g}MP"
+            if name in PRESETS:
+                fn, mutates = _preset_runner(PRESETS[name], img.size), False
+            else:
+                fn, mutates = OPERATIONS[name]
+            setup = (lambda: (img.copy(),)) if mutates else (lambda: (img,))
+            results.append(measure(label, fn, megapixels, repeat, setup))
+            if progress:
+                progress(results[-1])
+        del img
+        if PDF_OPERATION in selected:
+            with tempfile.TemporaryDirectory(prefix='itp-bench-') as folder:
+                pdf_path = synthetic_pdf(os.path.join(folder, 'bench.pdf'))
+                output = os.path.join(folder, 'pages')
+                dpi = pdf_dpi_for(megapixels)
+                run = lambda: transformer.process_pdf_to_jpg(pdf_path, output, dpi, workers=1)
+                results.append(measure(f"{PDF_OPERATION}@{megapixels:g}MP", run, megapixels * PDF_PAGES, repeat))
+                if progress:
+                    progress(results[-1])
+    return results
+
+def environment() -> dict:
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def save_baseline(results: List[Measurement], path: str):
+    data = {
+        'version': BASELINE_VERSION,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': environment(),
+        'results': {m.name: asdict(m) for m in results},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def load_baseline(path: str) -> Dict[str, Measurement]:
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != BASELINE_VERSION:
+        raise ValueError(f"Baseline {path} có phiên bản {data.get('version')}, cần {BASELINE_VERSION}")
+    return {name: Measurement(**values) for name, values in data['results'].items()}
+
+def compare(baseline: Dict[str, Measurement], results: List[Measurement],
+            threshold: float = DEFAULT_THRESHOLD,
+            memory_threshold: float = DEFAULT_MEMORY_THRESHOLD) -> List[Regression]:
+    # Chậm đi/tốn bộ nhớ hơn quá ngưỡng (tỷ lệ) *và* quá mức nhiễu tuyệt đối thì tính là hồi quy.
+    regressions = []
+    for current in results:
+        old = baseline.get(current.name)
+        if old is None:
+            continue
+        if (current.seconds > old.seconds * (1 + threshold)
+                and current.seconds - old.seconds > MIN_SECONDS_DELTA):
+            regressions.append(Regression(current.name, 'seconds', old.seconds, current.seconds))
+        if (current.peak_mb > old.peak_mb * (1 + memory_threshold)
+                and current.peak_mb - old.peak_mb > MIN_MEMORY_DELTA_MB):
+            regressions.append(Regression(current.name, 'peak_mb', old.peak_mb, current.peak_mb))
+    return regressions
+
+def format_measurement(m: Measurement, baseline: Dict[str, Measurement] | None = None) -> str:
+    line = (f"  {m.name:<30} {m.seconds * 1000:10.1f} ms  CPU {m.cpu_seconds * 1000:10.1f} ms  "
+            f"bộ nhớ +{m.peak_mb:8.1f} MB  {m.megapixels / m.seconds if m.seconds else 0:8.1f} MP/s")
+    old = (baseline or {}).get(m.name)
+    if old is not None and old.seconds:
+        line += f"  (so với baseline: x{m.seconds / old.seconds:.2f} thời gian, {m.peak_mb - old.peak_mb:+.1f} MB)"
+    return line
+
+def print_regressions(regressions: List[Regression]):
+    if not regressions:
+        print("Không có thao tác nào chậm đi hoặc tốn bộ nhớ hơn ngưỡng cho phép.")
+        return
+    print(f"PHÁT HIỆN {len(regressions)} hồi quy:")
+    for r in regressions:
+        unit = 's' if r.metric == 'seconds' else ' MB'
+        label = 'thời gian' if r.metric == 'seconds' else 'bộ nhớ'
+        print(f"  [HỒI QUY] {r.name}: {label} {r.baseline:g}{unit} -> {r.current:g}{unit} (x{r.ratio:.2f})")
@@ -0,0 +1,283 @@
+import os
+import logging
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter, ImageStat
+
+log = logging.getLogger(__name__)
+
+LUT_SIZE = 33
+MAX_LUT_SIZE = 65
+PROXY_PIXELS = 256 * 256
+
+SEPIA_MATRIX = np.array([[0.393, 0.769, 0.189],
+                         [0.349, 0.686, 0.168],
+                         [0.272, 0.534, 0.131]])
+
+# Các bước chỉ phụ thuộc từng kênh màu riêng lẻ -> gộp được thành bảng 1D (Image.point).
+PER_CHANNEL_OPS = ('brightness', 'contrast', 'temperature', 'invert')
+
+# Ma trận sepia cho Image.convert: hệ số -0.5 bù phép làm tròn của Pillow để cắt phần thập phân như numpy.
+SEPIA_CONVERT = tuple(float(v) for row in SEPIA_MATRIX for v in (*row, -0.5))
+
+def _luma(rgb: np.ndarray) -> np.ndarray:
+    # Cùng hệ số với Image.convert('L') của Pillow (L24).
+    return (rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471) / 65536
+
+def _finish(values: np.ndarray, quantize: bool) -> np.ndarray:
+    values = np.clip(values, 0, 255)
+    if quantize:
+        return np.trunc(values)
+    # Mỗi bước gốc cắt phần thập phân khi ghi ra uint8: bù sai lệch trung bình 0.5.
+    return np.where((values > 0) & (values < 255), values - 0.5, values)
+
+def _blend(base, values: np.ndarray, alpha: float, quantize: bool) -> np.ndarray:
+    # Image.blend của Pillow tính bằng float32: base + alpha * (values - base).
+    if quantize:
+        alpha = np.float32(alpha)
+        return _finish((np.float32(base) + alpha * (values - base).astype(np.float32)).astype(np.float64), True)
+    return _finish(base + alpha * (values - base), False)
+
+def _run_ops(rgb: np.ndarray, ops: Tuple[tuple, ...], quantize: bool) -> np.ndarray:
+    rgb = rgb.astype(np.float64)
+    for op in ops:
+        name = op[0]
+        if name == 'brightness':
+            rgb = _blend(0.0, rgb, op[1], quantize)
+        elif name == 'contrast':
+            rgb = _blend(float(op[2]), rgb, op[1], quantize)
+        elif name == 'saturation':
+            luma = _luma(rgb)[..., None]
+            if quantize:
+                luma = np.floor(luma + 0.5)
+            rgb = _blend(luma, rgb, op[1], quantize)
+        elif name == 'temperature':
+            factor = op[1]
+            if factor > 1.0:
+                rgb[..., 0] = rgb[..., 0] * factor
+                rgb[..., 1] = rgb[..., 1] * (1 + (factor - 1) * 0.5)
+            else:
+                rgb[..., 2] = rgb[..., 2] * (2 - factor)
+            rgb = _finish(rgb, quantize)
+        elif name == 'sepia':
+            rgb = _finish(rgb @ SEPIA_MATRIX.T, quantize)
+        elif name == 'grayscale':
+            luma = _luma(rgb)
+            if quantize:
+                luma = np.floor(luma + 0.5)
+            rgb = np.repeat(luma[..., None], 3, axis=-1)
+        elif name == 'invert':
+            rgb = 255 - rgb
+        elif name == 'cube':
+            rgb = _sample_cube(_read_cube_cached(op[1], op[2]), rgb)
+        else:
+            raise ValueError(f"Bước màu không hỗ trợ: {name}")
+    return rgb
+
+@lru_cache(maxsize=128)
+def compile_point_table(ops: Tuple[tuple, ...]) -> Tuple[int, ...]:
+    ramp = np.repeat(np.arange(256, dtype=np.float64)[:, None], 3, axis=1)
+    mapped = _run_ops(ramp, ops, quantize=True).astype(np.uint8)
+    return tuple(int(v) for v in mapped.T.reshape(-1))
+
+@lru_cache(maxsize=32)
+def compile_lut(ops: Tuple[tuple, ...], size: int = LUT_SIZE) -> ImageFilter.Color3DLUT:
+    # Chỉ dùng để xuất file .cube: nội suy tam tuyến tính qua chỗ bị cắt 0/255 lệch tới vài mức,
+    # nên khi xử lý ảnh các bước trộn kênh được chạy riêng (xem _segments).
+    size = max(2, min(MAX_LUT_SIZE, int(size)))
+    axis = np.linspace(0.0, 255.0, size)
+    b, g, r = np.meshgrid(axis, axis, axis, indexing='ij')
+    grid = np.stack([r, g, b], axis=-1)
+    table = _run_ops(grid, ops, quantize=False) / 255.0
+    return ImageFilter.Color3DLUT(size, table.astype(np.float32), _copy_table=False)
+
+@lru_cache(maxsize=128)
+def _segments(ops: Tuple[tuple, ...]) -> Tuple[tuple, ...]:
+    # Các bước theo từng kênh liền nhau gộp thành một bảng 1D (chính xác vì mô phỏng cả phép cắt uint8
+    # sau mỗi bước); bước trộn kênh (saturation, sepia, grayscale, .cube) chạy bằng phép gốc của Pillow.
+    segments: List[tuple] = []
+    run: List[tuple] = []
+    for op in ops:
+        if op[0] in PER_CHANNEL_OPS:
+            run.append(op)
+            continue
+        if run:
+            segments.append(('point', compile_point_table(tuple(run))))
+            run = []
+        segments.append(('mix', op))
+    if run:
+        segments.append(('point', compile_point_table(tuple(run))))
+    return tuple(segments)
+
+def prepare(ops: Tuple[tuple, ...]):
+    # Biên dịch trước bảng 1D và nạp LUT .cube (không phụ thuộc ảnh).
+    for kind, part in _segments(tuple(ops)):
+        if kind == 'mix' and part[0] == 'cube':
+            _cube_filter_cached(part[1], part[2])
+
+def cache_info() -> dict:
+    return {'point': compile_point_table.cache_info(), 'segments': _segments.cache_info(),
+            'lut3d': _cube_filter_cached.cache_info()}
+
+def clear_cache():
+    compile_point_table.cache_clear()
+    compile_lut.cache_clear()
+    _segments.cache_clear()
+    _read_cube_cached.cache_clear()
+    _cube_filter_cached.cache_clear()
+
+def _make_proxy(img: Image.Image) -> Image.Image:
+    factor = int((img.width * img.height / PROXY_PIXELS) ** 0.5)
+    return img.reduce(factor) if factor > 1 else img
+
+def _mix(img: Image.Image, op: tuple) -> Image.Image:
+    name = op[0]
+    if name == 'saturation':
+        return ImageEnhance.Color(img).enhance(op[1])
+    if name == 'grayscale':
+        return img.convert('LA').convert('RGBA') if img.mode == 'RGBA' else img.convert('L').convert('RGB')
+    if name == 'sepia':
+        out = img.convert('RGB').convert('RGB', SEPIA_CONVERT)
+        if img.mode == 'RGBA':
+            out.putalpha(img.getchannel('A'))
+        return out
+    if name == 'cube':
+        return img.filter(_cube_filter_cached(op[1], op[2]))
+    raise ValueError(f"Bước màu không hỗ trợ: {name}")
+
+def _apply(img: Image.Image, ops: Tuple[tuple, ...]) -> Image.Image:
+    for kind, part in _segments(ops):
+        if kind == 'point':
+            img = img.point(part + tuple(range(256)) if img.mode == 'RGBA' else part)
+        else:
+            img = _mix(img, part)
+    return img
+
+def _estimate_mean(img: Image.Image, prefix: List[tuple], proxy_holder: list, histogram=None) -> int:
+    if all(op[0] in PER_CHANNEL_OPS for op in prefix):
+        # Đẩy histogram từng kênh qua bảng 1D: không phải giải mã lại ảnh.
+        if histogram is None:
+            histogram = img.histogram()
+        hist = np.array(histogram[:768], dtype=np.float64).reshape(3, 256)
+        table = np.array(compile_point_table(tuple(prefix)), dtype=np.float64).reshape(3, 256)
+        channel_means = (hist * table).sum(axis=1) / max(1.0, hist[0].sum())
+        return int(_luma(channel_means) + 0.5)
+    if not proxy_holder:
+        proxy_holder.append(_make_proxy(img))
+    proxy = _apply(proxy_holder[0], tuple(prefix))
+    return int(ImageStat.Stat(proxy.convert('L')).mean[0] + 0.5)
+
+def resolve_ops(img: Image.Image, ops: List[tuple], histogram=None) -> Tuple[tuple, ...]:
+    # ImageEnhance.Contrast dùng độ sáng trung bình của ảnh tại bước đó, nên phải tính trước khi biên dịch.
+    # `histogram` cho phép truyền histogram của cả ảnh khi `img` chỉ là ảnh thu nhỏ (chế độ tile).
+    resolved: List[tuple] = []
+    proxy_holder: list = []
+    for op in ops:
+        if op[0] == 'contrast' and len(op) == 2:
+            op = ('contrast', op[1], _estimate_mean(img, resolved, proxy_holder, histogram))
+        resolved.append(op)
+    return tuple(resolved)
+
+def apply_resolved_ops(img: Image.Image, ops: Tuple[tuple, ...]) -> Image.Image:
+    if not ops:
+        return img
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return _apply(img, tuple(ops))
+
+def apply_color_ops(img: Image.Image, ops: List[tuple]) -> Image.Image:
+    if not ops:
+        return img
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    return apply_resolved_ops(img, resolve_ops(img, ops))
+
+def _sample_cube(cube: Tuple[int, np.ndarray], rgb: np.ndarray) -> np.ndarray:
+    size, table = cube
+    pos = np.clip(rgb / 255.0, 0.0, 1.0) * (size - 1)
+    lo = np.minimum(np.floor(pos).astype(np.int64), size - 2)
+    frac = pos - lo
+    out = np.zeros(rgb.shape, dtype=np.float64)
+    for dr in (0, 1):
+        wr = frac[..., 0] if dr else 1 - frac[..., 0]
+        for dg in (0, 1):
+            wg = frac[..., 1] if dg else 1 - frac[..., 1]
+            for db in (0, 1):
+                wb = frac[..., 2] if db else 1 - frac[..., 2]
+                corner = table[lo[..., 2] + db, lo[..., 1] + dg, lo[..., 0] + dr]
+                out += (wr * wg * wb)[..., None] * corner
+    return out * 255.0
+
+def _cube_table(lut: ImageFilter.Color3DLUT) -> np.ndarray:
+    size = lut.size[0]
+    return np.asarray(lut.table, dtype=np.float64).reshape(size, size, size, lut.channels)[..., :3]
+
+def save_cube(lut: ImageFilter.Color3DLUT, cube_path: str, title: str = "Image Transformer Pro") -> bool:
+    try:
+        size = lut.size[0]
+        rows = _cube_table(lut).reshape(-1, 3)
+        with open(cube_path, 'w', encoding='utf-8') as f:
+            f.write(f'TITLE "{title}"\n')
+            f.write(f"LUT_3D_SIZE {size}\n")
+            f.write("DOMAIN_MIN 0.0 0.0 0.0\n")
+            f.write("DOMAIN_MAX 1.0 1.0 1.0\n")
+            for r, g, b in rows:
+                f.write(f"{r:.6f} {g:.6f} {b:.6f}\n")
+        log.info("Đã xuất LUT (%s³) tại: %s", size, cube_path)
+        return True
+    except Exception as e:
+        log.error("LỖI khi xuất file .cube: %s", e)
+        return False
+
+def _parse_cube(cube_path: str) -> Tuple[int, np.ndarray]:
+    size = None
+    domain_min = np.zeros(3)
+    domain_max = np.ones(3)
+    rows = []
+    with open(cube_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            key = line.split()[0].upper()
+            if key == 'TITLE':
+                continue
+            if key == 'LUT_3D_SIZE':
+                size = int(line.split()[1])
+            elif key == 'LUT_1D_SIZE':
+                raise ValueError("Chỉ hỗ trợ file .cube dạng 3D")
+            elif key == 'DOMAIN_MIN':
+                domain_min = np.array([float(v) for v in line.split()[1:4]])
+            elif key == 'DOMAIN_MAX':
+                domain_max = np.array([float(v) for v in line.split()[1:4]])
+            else:
+                rows.append([float(v) for v in line.split()[:3]])
+    if size is None or len(rows) != size ** 3:
+        raise ValueError(f"File .cube không hợp lệ: {cube_path}")
+    # DOMAIN_MIN/MAX là miền của giá trị *đầu vào*; ảnh 8-bit luôn tra trong [0, 1].
+    if not (np.allclose(domain_min, 0.0) and np.allclose(domain_max, 1.0)):
+        raise ValueError(f"Chỉ hỗ trợ file .cube có DOMAIN 0..1: {cube_path}")
+    return size, np.clip(np.array(rows), 0.0, 1.0).reshape(size, size, size, 3)
+
+@lru_cache(maxsize=16)
+def _read_cube_cached(cube_path: str, mtime: float) -> Tuple[int, np.ndarray]:
+    return _parse_cube(cube_path)
+
+@lru_cache(maxsize=16)
+def _cube_filter_cached(cube_path: str, mtime: float) -> ImageFilter.Color3DLUT:
+    size, table = _read_cube_cached(cube_path, mtime)
+    return ImageFilter.Color3DLUT(size, table.astype(np.float32))
+
+def read_cube(cube_path: str) -> Tuple[int, np.ndarray]:
+    return _read_cube_cached(cube_path, os.path.getmtime(cube_path))
+
+def cube_op(cube_path: str) -> tuple:
+    cube_path = os.path.abspath(cube_path)
+    mtime = os.path.getmtime(cube_path)
+    _read_cube_cached(cube_path, mtime)
+    return ('cube', cube_path, mtime)
+
+def load_cube(cube_path: str) -> ImageFilter.Color3DLUT:
+    return _cube_filter_cached(cube_path, os.path.getmtime(cube_path))
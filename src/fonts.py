@@ -0,0 +1,41 @@
+from PIL import ImageFont
+
+from .lru import LRUCache
+
+FALLBACK_FONT = "arial.ttf"
+
+# Tên font -> đường dẫn thật (hoặc None nếu không tìm thấy, để khỏi dò thư mục font lần nữa).
+_font_paths = LRUCache(max_entries=256)
+_fonts = LRUCache(max_entries=128)
+_default_font = None
+
+def _locate(font_name: str) -> str | None:
+    try:
+        return ImageFont.truetype(font_name, size=10).path
+    except (IOError, OSError):
+        return None
+
+def resolve_font_path(font_name: str) -> str | None:
+    return _font_paths.get_or_create(font_name, lambda: _locate(font_name))
+
+def _default():
+    global _default_font
+    if _default_font is None:
+        _default_font = ImageFont.load_default()
+    return _default_font
+
+def get_font(font_name: str, size: int):
+    for name in (font_name, FALLBACK_FONT):
+        path = resolve_font_path(name) if name else None
+        if path:
+            return _fonts.get_or_create((path, size), lambda: ImageFont.truetype(path, size=size))
+    return _default()
+
+def font_cache_info() -> dict:
+    return {'paths': _font_paths.stats(), 'fonts': _fonts.stats()}
+
+def clear_font_cache():
+    global _default_font
+    _font_paths.clear()
+    _fonts.clear()
+    _default_font = None
@@ -0,0 +1,233 @@
+import os
+import time
+import sqlite3
+from dataclasses import dataclass, fields
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+import fitz
+from PIL import ExifTags, Image
+
+from . import batch
+from . import pdf_raster
+from . import tiled
+
+INDEX_EXTENSIONS = batch.IMAGE_EXTENSIONS + pdf_raster.PDF_EXTENSIONS
+DEFAULT_INDEX_PATH = 'image_index.sqlite'
+COMMIT_EVERY = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT,
+    mode TEXT,
+    width INTEGER,
+    height INTEGER,
+    has_exif INTEGER,
+    pages INTEGER,
+    error TEXT,
+    scanned_at REAL
+);
+CREATE INDEX IF NOT EXISTS images_width ON images(width);
+CREATE INDEX IF NOT EXISTS images_height ON images(height);
+CREATE INDEX IF NOT EXISTS images_format ON images(format);
+"""
+
+ORDER_COLUMNS = {
+    'path': 'path',
+    'width': 'width',
+    'height': 'height',
+    'pixels': 'width * height',
+    'size': 'size',
+    'mtime': 'mtime_ns',
+}
+
+@dataclass
+class ImageRecord:
+    path: str
+    size: int
+    mtime_ns: int
+    format: str | None = None
+    mode: str | None = None
+    width: int | None = None
+    height: int | None = None
+    has_exif: bool = False
+    pages: int = 1
+    error: str = ""
+
+    @property
+    def megapixels(self) -> float:
+        return (self.width or 0) * (self.height or 0) / 1_000_000
+
+_COLUMNS = [f.name for f in fields(ImageRecord)]
+
+@dataclass
+class ScanReport:
+    added: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+    @property
+    def scanned(self) -> int:
+        return self.added + self.updated
+
+def read_header(path: str) -> dict:
+    # Chỉ đọc phần header: Image.open không giải mã điểm ảnh, PDF chỉ đọc bảng trang.
+    if pdf_raster.is_pdf(path):
+        with fitz.open(path) as document:
+            return {'format': 'PDF', 'mode': None, 'width': None, 'height': None,
+                    'has_exif': False, 'pages': document.page_count}
+    with tiled.unbounded_pixels():
+        img = Image.open(path)
+    with img:
+        if 'exif' in img.info:
+            has_exif = True
+        elif img.format == 'TIFF':
+            # Với TIFF getexif() là chính thư mục tag của file: EXIF nằm ở IFD con riêng.
+            has_exif = ExifTags.IFD.Exif in img.getexif()
+        else:
+            has_exif = False
+        return {'format': img.format, 'mode': img.mode, 'width': img.width, 'height': img.height,
+                'has_exif': has_exif, 'pages': getattr(img, 'n_frames', 1)}
+
+def _read_record(entry: Tuple[str, int, int]) -> ImageRecord:
+    path, size, mtime_ns = entry
+    try:
+        return ImageRecord(path, size, mtime_ns, **read_header(path))
+    except Exception as e:
+        return ImageRecord(path, size, mtime_ns, pages=0, error=str(e) or type(e).__name__)
+
+def walk_files(root: str, recursive: bool = True) -> Iterator[Tuple[str, int, int]]:
+    # (đường dẫn tuyệt đối, kích thước, mtime_ns) của các file ảnh/PDF dưới root.
+    stack = [os.path.abspath(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in INDEX_EXTENSIONS and entry.is_file():
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime_ns
+                except OSError:
+                    continue
+
+def _prefix_range(directory: str) -> Tuple[str, str]:
+    # Khoảng [lo, hi) của mọi đường dẫn nằm dưới directory, để truy vấn dùng được khóa chính.
+    prefix = os.path.join(os.path.abspath(directory), '')
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+class ImageIndex:
+    def __init__(self, db_path: str = DEFAULT_INDEX_PATH):
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def scan(self, root: str, recursive: bool = True, workers: int | None = None, progress=None) -> ScanReport:
+        # Chỉ đọc lại header của file mới hoặc có size/mtime thay đổi; file đã biến mất bị xóa khỏi chỉ mục.
+        start = time.perf_counter()
+        report = ScanReport()
+        lo, hi = _prefix_range(root)
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in self._conn.execute(
+            "SELECT path, size, mtime_ns FROM images WHERE path >= ? AND path < ?", (lo, hi))}
+
+        changed = []
+        for path, size, mtime_ns in walk_files(root, recursive):
+            stamp = known.pop(path, None)
+            if stamp == (size, mtime_ns):
+                report.unchanged += 1
+            else:
+                changed.append((path, size, mtime_ns))
+                if stamp is None:
+                    report.added += 1
+                else:
+                    report.updated += 1
+        if not recursive:
+            known = {p: s for p, s in known.items() if os.path.dirname(p) == lo[:-1]}
+
+        # Đọc header là I/O: luồng đủ dùng và tránh chi phí khởi động tiến trình.
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        placeholders = ', '.join('?' * len(_COLUMNS))
+        upsert = f"INSERT OR REPLACE INTO images ({', '.join(_COLUMNS)}, scanned_at) VALUES ({placeholders}, ?)"
+        pending = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for done, record in enumerate(executor.map(_read_record, changed), 1):
+                if record.error:
+                    report.failed += 1
+                pending.append(tuple(getattr(record, name) for name in _COLUMNS) + (time.time(),))
+                if len(pending) >= COMMIT_EVERY:
+                    self._write(upsert, pending)
+                if progress:
+                    progress(done, len(changed))
+        self._write(upsert, pending)
+
+        if known:
+            self._conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in known])
+            self._conn.commit()
+            report.removed = len(known)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    def _write(self, sql: str, rows: list):
+        if rows:
+            self._conn.executemany(sql, rows)
+            self._conn.commit()
+            rows.clear()
+
+    def query(self, min_width: int | None = None, max_width: int | None = None,
+              min_height: int | None = None, max_height: int | None = None,
+              format: str | None = None, has_exif: bool | None = None, min_pages: int | None = None,
+              under: str | None = None, include_errors: bool = False,
+              order_by: str = 'path', descending: bool = False, limit: int | None = None) -> List[ImageRecord]:
+        clauses, params = [], []
+        for column, op, value in (('width', '>=', min_width), ('width', '<=', max_width),
+                                  ('height', '>=', min_height), ('height', '<=', max_height),
+                                  ('pages', '>=', min_pages)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        if format:
+            clauses.append("format = ?")
+            params.append(format.upper())
+        if has_exif is not None:
+            clauses.append("has_exif = ?")
+            params.append(int(has_exif))
+        if under:
+            clauses.append("path >= ? AND path < ?")
+            params.extend(_prefix_range(under))
+        if not include_errors:
+            clauses.append("error = ''")
+        if order_by not in ORDER_COLUMNS:
+            raise ValueError(f"Không thể sắp xếp theo '{order_by}' (hợp lệ: {', '.join(ORDER_COLUMNS)})")
+
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM images"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {ORDER_COLUMNS[order_by]}{' DESC' if descending else ''}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [ImageRecord(*row[:7], bool(row[7]), *row[8:]) for row in self._conn.execute(sql, params)]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
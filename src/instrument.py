@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Iterable, List, Tuple
+
+from PIL import Image
+
+from .stage_memo import image_bytes
+
+# Các sink đang nhận sự kiện trong ngữ cảnh hiện tại. Rỗng (mặc định) thì begin() trả None ngay,
+# không đo đạc gì: các vòng xử lý không tốn thêm chi phí khi không ai lắng nghe.
+_sinks: contextvars.ContextVar[tuple] = contextvars.ContextVar('instrument_sinks', default=())
+
+@dataclass
+class StageEvent:
+    stage: str
+    params: dict
+    wall_seconds: float
+    cpu_seconds: float
+    input_size: Tuple[int, int] | None = None
+    input_mode: str | None = None
+    output_size: Tuple[int, int] | None = None
+    output_mode: str | None = None
+    allocated_bytes: int = 0      # dữ liệu điểm ảnh của ảnh mới mà bước tạo ra (0 nếu trả lại chính ảnh vào)
+    source: str = ""              # file (hoặc trang PDF) đang xử lý
+    pid: int = field(default_factory=os.getpid)
+    started_at: float = 0.0       # time.time() lúc bắt đầu bước
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+class Sink:
+    def emit(self, event: StageEvent):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class NullSink(Sink):
+    def emit(self, event: StageEvent):
+        pass
+
+class CollectSink(Sink):
+    # Giữ sự kiện trong bộ nhớ, vd để worker batch gửi về tiến trình chính.
+    def __init__(self):
+        self.events: List[StageEvent] = []
+
+    def emit(self, event: StageEvent):
+        self.events.append(event)
+
+class JsonLinesSink(Sink):
+    # Mỗi sự kiện một dòng JSON, ghi nối tiếp vào file trace.
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def emit(self, event: StageEvent):
+        line = json.dumps(event.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+@dataclass
+class StageTotals:
+    stage: str
+    count: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    allocated_bytes: int = 0
+    max_seconds: float = 0.0
+    max_source: str = ""
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.wall_seconds / self.count if self.count else 0.0
+
+class SummarySink(Sink):
+    # Cộng dồn theo tên bước cho cả lô, để biết thời gian thực sự đi đâu.
+    def __init__(self):
+        self.totals: Dict[str, StageTotals] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event: StageEvent):
+        with self._lock:
+            totals = self.totals.setdefault(event.stage, StageTotals(event.stage))
+            totals.count += 1
+            totals.wall_seconds += event.wall_seconds
+            totals.cpu_seconds += event.cpu_seconds
+            totals.allocated_bytes += event.allocated_bytes
+            if event.wall_seconds >= totals.max_seconds:
+                totals.max_seconds = event.wall_seconds
+                totals.max_source = event.source
+
+    def slowest(self, limit: int | None = 10) -> List[StageTotals]:
+        ranked = sorted(self.totals.values(), key=lambda t: t.wall_seconds, reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def print_summary(self, limit: int | None = 10):
+        ranked = self.slowest(limit)
+        if not ranked:
+            return
+        total = sum(t.wall_seconds for t in self.totals.values())
+        print(f"Các bước tốn thời gian nhất (tổng {total:.2f}s):")
+        for t in ranked:
+            share = t.wall_seconds / total * 100 if total else 0.0
+            print(f"  {t.stage:<18} {t.wall_seconds:8.2f}s ({share:4.1f}%) | {t.count} lần, "
+                  f"trung bình {t.mean_seconds * 1000:.1f} ms, CPU {t.cpu_seconds:.2f}s, "
+                  f"cấp phát {t.allocated_bytes / (1 << 20):.0f} MB | chậm nhất {t.max_seconds * 1000:.1f} ms"
+                  + (f" ({os.path.basename(t.max_source)})" if t.max_source else ""))
+
+class Probe:
+    __slots__ = ('stage', 'params', 'source', 'input_size', 'input_mode', 'started_at', 'wall', 'cpu', 'image')
+
+    def __init__(self, stage: str, img, params: dict, source: str):
+        self.stage = stage
+        self.params = params
+        self.source = source
+        self.image = img
+        self.input_size = img.size if img is not None else None
+        self.input_mode = img.mode if img is not None else None
+        self.started_at = time.time()
+        self.cpu = time.thread_time()
+        self.wall = time.perf_counter()
+
+_source: contextvars.ContextVar[str] = contextvars.ContextVar('instrument_source', default="")
+
+def enabled() -> bool:
+    return bool(_sinks.get())
+
+def begin(stage: str, img: Image.Image | None = None, params: dict | None = None) -> Probe | None:
+    if not _sinks.get():
+        return None
+    return Probe(stage, img, params or {}, _source.get())
+
+def end(probe: Probe | None, img: Image.Image | None = None, output_size: Tuple[int, int] | None = None,
+        output_mode: str | None = None, allocated_bytes: int | None = None):
+    # img: kết quả của bước (None nếu bước không tạo ảnh, vd ghi file; khi đó có thể tự truyền kích thước).
+    if probe is None:
+        return
+    wall = time.perf_counter() - probe.wall
+    cpu = time.thread_time() - probe.cpu
+    if img is not None:
+        output_size, output_mode = img.size, img.mode
+        if allocated_bytes is None:
+            allocated_bytes = image_bytes(img) if img is not probe.image else 0
+    event = StageEvent(
+        stage=probe.stage, params=probe.params, wall_seconds=wall, cpu_seconds=cpu,
+        input_size=probe.input_size, input_mode=probe.input_mode,
+        output_size=output_size, output_mode=output_mode, allocated_bytes=allocated_bytes or 0,
+        source=probe.source, started_at=probe.started_at)
+    probe.image = None
+    emit(event)
+
+def emit(event: StageEvent):
+    for sink in _sinks.get():
+        sink.emit(event)
+
+def replay(events: Iterable[StageEvent | dict]):
+    # Đẩy lại sự kiện ghi ở tiến trình khác (worker batch) vào các sink hiện tại.
+    for event in events:
+        emit(event if isinstance(event, StageEvent) else StageEvent(**event))
+
+@contextlib.contextmanager
+def recording(*sinks: Sink, replace: bool = False):
+    # Trong khối with, mọi bước xử lý (trong luồng hiện tại) gửi sự kiện tới các sink này.
+    # replace=True: chỉ các sink này nhận, các sink bên ngoài tạm thời không thấy sự kiện.
+    token = _sinks.set(tuple(sinks) if replace else _sinks.get() + tuple(sinks))
+    try:
+        yield sinks[0] if len(sinks) == 1 else sinks
+    finally:
+        _sinks.reset(token)
+
+@contextlib.contextmanager
+def source(path: str):
+    # Gắn tên file đang xử lý vào các sự kiện phát ra trong khối with.
+    token = _source.set(path)
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+# Thông báo từng bước xử lý đi qua logger của gói (logging.getLogger(__name__) trong từng module).
+# Gói chỉ gắn NullHandler nên mặc định không in gì và log.info() dừng ngay ở kiểm tra mức log;
+# CLI và GUI bật in ra console bằng log_to_console(), batch/streaming gom lỗi bằng LogCapture.
+_log_lock = threading.Lock()
+
+class ConsoleHandler(logging.Handler):
+    # Ghi vào sys.stdout tại thời điểm ghi (không giữ stream lúc tạo) để redirect_stdout vẫn có tác dụng.
+    def emit(self, record: logging.LogRecord):
+        try:
+            print(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+class LogCapture(logging.Handler):
+    # Mỗi luồng ghi vào buffer mà nó đang gắn bằng capture(); luồng không gắn buffer thì bỏ qua.
+    def __init__(self, level: int = logging.WARNING):
+        super().__init__(level)
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def capture(self, buffer):
+        previous = getattr(self._local, 'buffer', None)
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = previous
+
+    def emit(self, record: logging.LogRecord):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.write(self.format(record) + '\n')
+
+def _package_logger() -> logging.Logger:
+    return logging.getLogger(__package__)
+
+def _update_level(logger: logging.Logger):
+    # Mức của logger gói = mức thấp nhất mà các handler đang gắn cần; không có thì theo logger gốc (WARNING).
+    levels = [h.level for h in logger.handlers if h.level > logging.NOTSET]
+    logger.setLevel(min(levels) if levels else logging.NOTSET)
+
+def add_log_handler(handler: logging.Handler):
+    logger = _package_logger()
+    with _log_lock:
+        logger.addHandler(handler)
+        _update_level(logger)
+
+def remove_log_handler(handler: logging.Handler):
+    logger = _package_logger()
+    with _log_lock:
+        logger.removeHandler(handler)
+        _update_level(logger)
+
+@contextlib.contextmanager
+def logging_to(handler: logging.Handler):
+    add_log_handler(handler)
+    try:
+        yield handler
+    finally:
+        remove_log_handler(handler)
+
+def log_to_console(level: int = logging.INFO):
+    # In thông báo từng bước ra stdout trong khối with, như bản chạy dòng lệnh trước đây.
+    return logging_to(ConsoleHandler(level))
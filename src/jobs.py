@@ -0,0 +1,117 @@
+import queue
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+class JobCancelled(BaseException):
+    # Kế thừa BaseException để không bị các khối `except Exception` trong transformer nuốt mất.
+    pass
+
+class Job:
+    def __init__(self, job_id: int, kind: str, post: Callable):
+        self.id = job_id
+        self.kind = kind
+        self._post = post
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def stage(self, name: str):
+        self.check()
+        self._post(self, 'progress', (None, None, name))
+
+    def progress(self, done: int, total: int, message: str = ""):
+        self.check()
+        self._post(self, 'progress', (done, total, message))
+
+class JobRunner:
+    def __init__(self, schedule: Callable[[int, Callable], object], poll_ms: int = 30, max_workers: int = 2,
+                 on_finished: Callable = None):
+        self._schedule = schedule
+        self._on_finished = on_finished
+        self._poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._events: queue.Queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._active: Dict[int, tuple] = {}
+        self._polling = False
+
+    def submit(self, kind: str, func: Callable[[Job], object], on_done: Callable = None,
+               on_error: Callable = None, on_progress: Callable = None, supersede: bool = True) -> Job:
+        if supersede:
+            self.cancel(kind)
+        job = Job(next(self._ids), kind, self._post)
+        self._active[job.id] = (job, on_done, on_error, on_progress)
+        self._executor.submit(self._run, job, func)
+        self._ensure_polling()
+        return job
+
+    def cancel(self, kind: str | None = None):
+        for job, *_ in list(self._active.values()):
+            if kind is None or job.kind == kind:
+                job.cancel()
+
+    def is_busy(self, kind: str | None = None) -> bool:
+        return any(kind is None or job.kind == kind for job, *_ in self._active.values())
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _post(self, job: Job, event: str, payload):
+        self._events.put((job, event, payload))
+
+    def _run(self, job: Job, func: Callable):
+        if job.cancelled:
+            self._post(job, 'cancelled', None)
+            return
+        try:
+            result = func(job)
+        except JobCancelled:
+            self._post(job, 'cancelled', None)
+        except Exception as e:
+            self._post(job, 'error', e)
+        else:
+            self._post(job, 'cancelled' if job.cancelled else 'done', result)
+
+    def _ensure_polling(self):
+        if not self._polling:
+            self._polling = True
+            self._schedule(self._poll_ms, self._poll)
+
+    def _poll(self):
+        # Chạy trên luồng giao diện: mọi callback đều được gọi tại đây.
+        try:
+            while True:
+                job, event, payload = self._events.get_nowait()
+                entry = self._active.get(job.id)
+                if entry is None:
+                    continue
+                _, on_done, on_error, on_progress = entry
+                if event == 'progress':
+                    if on_progress and not job.cancelled:
+                        on_progress(job, *payload)
+                    continue
+                del self._active[job.id]
+                if event == 'done' and on_done:
+                    on_done(job, payload)
+                elif event == 'error' and on_error:
+                    on_error(job, payload)
+                if self._on_finished:
+                    self._on_finished(job, event)
+        except queue.Empty:
+            pass
+        if self._active:
+            self._schedule(self._poll_ms, self._poll)
+        else:
+            self._polling = False
@@ -0,0 +1,35 @@
+import os
+
+from PIL import Image, ImageEnhance
+
+from .lru import LRUCache
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# (đường dẫn, mtime, chiều rộng đích, độ mờ) -> logo RGBA đã chuẩn bị sẵn.
+# Ảnh trong cache được dùng chung giữa các luồng nên tuyệt đối không sửa trực tiếp.
+_sprites = LRUCache(max_bytes=MAX_CACHE_BYTES, sizeof=lambda img: img.width * img.height * 4)
+
+def _prepare(path: str, target_width: int | None, opacity: float) -> Image.Image:
+    with Image.open(path) as src:
+        logo = src.convert("RGBA")
+
+    if target_width and logo.width > 0:
+        target_height = int(float(logo.height) * (target_width / float(logo.width)))
+        logo = logo.resize((target_width, target_height), Image.Resampling.LANCZOS)
+
+    if opacity < 1.0:
+        alpha = ImageEnhance.Brightness(logo.getchannel('A')).enhance(opacity)
+        logo.putalpha(alpha)
+    return logo
+
+def get_logo(path: str, target_width: int | None, opacity: float) -> Image.Image:
+    path = os.path.abspath(path)
+    key = (path, os.path.getmtime(path), target_width, round(float(opacity), 4))
+    return _sprites.get_or_create(key, lambda: _prepare(path, target_width, opacity))
+
+def logo_cache_info() -> dict:
+    return _sprites.stats()
+
+def clear_logo_cache():
+    _sprites.clear()
@@ -0,0 +1,71 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+MAX_SIZE = 401
+
+@lru_cache(maxsize=64)
+def motion_kernel(size: int, angle: int) -> np.ndarray:
+    kernel = np.zeros((size, size))
+    kernel[int((size - 1) / 2), :] = np.ones(size)
+    kernel = ndimage.rotate(kernel, angle, reshape=False)
+    kernel[np.abs(kernel) < 1e-6] = 0
+    # Xoay bằng spline làm hụt tổng trọng số (ảnh bị tối đi ở góc xiên): chuẩn hóa lại về 1.
+    kernel /= kernel.sum()
+    kernel.setflags(write=False)
+    return kernel
+
+@lru_cache(maxsize=64)
+def _plan(size: int, angle: int) -> tuple:
+    kernel = motion_kernel(size, angle)
+    center = size // 2
+    anchor = size - 1 - center
+    rows = np.flatnonzero(kernel.any(axis=1))
+    cols = np.flatnonzero(kernel.any(axis=0))
+    # Vệt mờ nằm đúng một hàng/cột đầy đủ -> box filter. Với độ dài chẵn hàng đó là (size - 1) // 2,
+    # lệch tâm kernel một điểm ảnh: kết quả dịch đi `shift` hàng/cột giống tích chập đầy đủ.
+    if len(rows) == 1 and len(cols) == size and np.allclose(kernel[rows[0]], 1 / size):
+        return ('box', (size, 1), (anchor, 0), (0, center - rows[0]))
+    if len(cols) == 1 and len(rows) == size and np.allclose(kernel[:, cols[0]], 1 / size):
+        return ('box', (1, size), (0, anchor), (center - cols[0], 0))
+    # Góc xiên: filter2D (OpenCV tự chuyển sang nhân chập qua DFT khi kernel lớn).
+    # Kernel phải lật lại vì filter2D tính tương quan chứ không phải tích chập.
+    flipped = np.ascontiguousarray(kernel[::-1, ::-1], dtype=np.float32)
+    return ('filter2d', flipped, (anchor, anchor))
+
+def _box(arr: np.ndarray, ksize: tuple, anchor: tuple, shift: tuple) -> np.ndarray:
+    dx, dy = shift
+    if not dx and not dy:
+        return cv2.blur(arr, ksize, anchor=anchor, borderType=cv2.BORDER_REFLECT)
+    # out[y, x] = blur[y + dy, x + dx]: thêm lề phản chiếu rồi cắt lệch đi.
+    padded = cv2.copyMakeBorder(arr, abs(dy), abs(dy), abs(dx), abs(dx), cv2.BORDER_REFLECT)
+    out = cv2.blur(padded, ksize, anchor=anchor, borderType=cv2.BORDER_REFLECT)
+    top, left = abs(dy) + dy, abs(dx) + dx
+    return out[top:top + arr.shape[0], left:left + arr.shape[1]]
+
+def halo(size: int) -> int:
+    # Số hàng lân cận cần đọc thêm mỗi phía khi xử lý theo dải (chế độ tile).
+    return max(1, min(int(size), MAX_SIZE)) // 2 + 1
+
+def apply_motion_blur(img: Image.Image, size: int = 15, angle: int = 0) -> Image.Image:
+    size = max(1, min(int(size), MAX_SIZE))
+    if size < 2:
+        return img
+    if img.mode not in ('L', 'RGB', 'RGBA'):
+        img = img.convert('RGB')
+
+    arr = np.asarray(img)
+    plan = _plan(size, int(angle) % 360)
+    if plan[0] == 'box':
+        out = _box(arr, *plan[1:])
+    else:
+        _, kernel, anchor = plan
+        out = cv2.filter2D(arr, -1, kernel, anchor=anchor, borderType=cv2.BORDER_REFLECT)
+    return Image.fromarray(out)
+
+def kernel_cache_info() -> dict:
+    info = motion_kernel.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'entries': info.currsize}
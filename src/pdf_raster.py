@@ -0,0 +1,199 @@
+import os
+import time
+import logging
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator, List, Tuple
+
+import fitz
+from PIL import Image
+
+from . import instrument
+
+log = logging.getLogger(__name__)
+
+PDF_EXTENSIONS = ('.pdf',)
+
+# Mỗi tiến trình worker mở tài liệu một lần (initializer) rồi render các trang được giao.
+_worker_doc = None
+
+@dataclass
+class PageResult:
+    page: int                 # số trang, đánh từ 1
+    output_path: str
+    render_seconds: float
+    save_seconds: float
+    width: int = 0
+    height: int = 0
+    worker_pid: int = 0
+    process_seconds: float = 0.0
+    events: list = field(default_factory=list)   # sự kiện instrument ghi trong worker (dạng dict)
+
+    @property
+    def seconds(self) -> float:
+        return self.render_seconds + self.process_seconds + self.save_seconds
+
+def is_pdf(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in PDF_EXTENSIONS
+
+def parse_page_range(spec: str | None, page_count: int) -> List[int]:
+    # "1-5,8,10-" -> [1, 2, 3, 4, 5, 8, 10, ..., page_count]; None/"" -> tất cả các trang.
+    if not spec or not spec.strip():
+        return list(range(1, page_count + 1))
+    pages = []
+    seen = set()
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = part.split('-', 1)
+                first = int(start) if start else 1
+                last = int(end) if end else page_count
+            else:
+                first = last = int(part)
+        except ValueError:
+            raise ValueError(f"Khoảng trang không hợp lệ: '{part}'")
+        if first < 1 or last > page_count or first > last:
+            raise ValueError(f"Khoảng trang '{part}' nằm ngoài tài liệu (1-{page_count})")
+        for page in range(first, last + 1):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+    if not pages:
+        raise ValueError("Không có trang nào được chọn")
+    return pages
+
+def page_output_path(input_path: str, output_folder: str, page: int, extension: str = '.jpg') -> str:
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_folder, f"{base_name}_page_{page}{extension}")
+
+def pixmap_to_image(pix) -> Image.Image:
+    # Đọc thẳng bộ đệm điểm ảnh của pixmap (RGB, không alpha): không mã hóa/giải mã JPEG trung gian.
+    return Image.frombytes('RGB', (pix.width, pix.height), pix.samples, 'raw', 'RGB', pix.stride)
+
+def iter_pages(input_path: str, dpi: int = 300, pages: str | None = None) -> Iterator[Tuple[int, Image.Image]]:
+    # Sinh lần lượt (số trang, ảnh): mỗi lần chỉ một trang nằm trong bộ nhớ.
+    with fitz.open(input_path) as document:
+        matrix = fitz.Matrix(dpi / 72, dpi / 72)
+        for page in parse_page_range(pages, len(document)):
+            yield page, pixmap_to_image(document.load_page(page - 1).get_pixmap(matrix=matrix))
+
+def _render_page(document, page: int, matrix, output_path: str, transform=None, save=None) -> PageResult:
+    start = time.perf_counter()
+    probe = instrument.begin('pdf_render', params={'page': page, 'dpi': round(matrix.a * 72)})
+    pix = document.load_page(page - 1).get_pixmap(matrix=matrix)
+    width, height = pix.width, pix.height
+    instrument.end(probe, output_size=(width, height), output_mode='RGB', allocated_bytes=pix.stride * height)
+    rendered = time.perf_counter()
+    if transform is None and save is None:
+        probe = instrument.begin('save', params={'path': output_path})
+        pix.save(output_path)
+        instrument.end(probe)
+        processed = rendered
+    else:
+        img = pixmap_to_image(pix)
+        del pix
+        if transform is not None:
+            img = transform(img)
+        processed = time.perf_counter()
+        if not (save or _save_jpeg)(img, output_path):
+            raise RuntimeError(f"không thể lưu trang {page} tại {output_path}")
+    finished = time.perf_counter()
+    return PageResult(page, output_path, rendered - start, finished - processed, width, height, os.getpid(),
+                      processed - rendered)
+
+def _save_jpeg(img: Image.Image, output_path: str) -> bool:
+    probe = instrument.begin('save', img, {'path': output_path})
+    img.save(output_path, 'JPEG')
+    instrument.end(probe)
+    return True
+
+def _init_worker(input_path: str):
+    global _worker_doc
+    _worker_doc = fitz.open(input_path)
+
+def _render_in_worker(page: int, zoom: float, output_path: str, transform=None, save=None,
+                      trace: bool = False) -> PageResult:
+    if not trace:
+        return _render_page(_worker_doc, page, fitz.Matrix(zoom, zoom), output_path, transform, save)
+    # Sự kiện ghi trong worker được gửi về tiến trình chính cùng kết quả.
+    with instrument.recording(instrument.CollectSink(), replace=True) as sink, \
+            instrument.source(f"{_worker_doc.name}#{page}"):
+        result = _render_page(_worker_doc, page, fitz.Matrix(zoom, zoom), output_path, transform, save)
+    result.events = [event.to_dict() for event in sink.events]
+    return result
+
+def _log_page(result: PageResult):
+    steps = f"render {result.render_seconds:.2f}s"
+    if result.process_seconds:
+        steps += f", xử lý {result.process_seconds:.2f}s"
+    log.info("  -> Đã tạo: %s (%.2fs: %s, ghi %.2fs)", result.output_path, result.seconds, steps, result.save_seconds)
+
+def rasterize_pdf(input_path: str, output_folder: str, dpi: int = 300, pages: str | None = None,
+                  workers: int | None = None, progress=None, transform=None, save=None,
+                  output_name: str | None = None, extension: str = '.jpg') -> List[PageResult]:
+    # transform(img) -> img và save(img, path) -> bool chạy trong worker nên phải pickle được
+    # (hàm cấp module hoặc functools.partial). Không có cả hai: pixmap được ghi thẳng ra JPG.
+    with fitz.open(input_path) as document:
+        selected = parse_page_range(pages, len(document))
+    os.makedirs(output_folder, exist_ok=True)
+    zoom = dpi / 72
+    outputs = {page: page_output_path(output_name or input_path, output_folder, page, extension)
+               for page in selected}
+    workers = max(1, min(workers or os.cpu_count() or 1, len(selected)))
+    start = time.perf_counter()
+
+    results = {}
+    next_index = 0
+
+    def collect(result: PageResult):
+        # Log theo đúng thứ tự trang dù các worker hoàn thành lệch nhau.
+        nonlocal next_index
+        instrument.replay(result.events)
+        result.events = []
+        results[result.page] = result
+        while next_index < len(selected) and selected[next_index] in results:
+            _log_page(results[selected[next_index]])
+            next_index += 1
+        if progress:
+            progress(len(results), len(selected))
+
+    if workers == 1:
+        with fitz.open(input_path) as document:
+            matrix = fitz.Matrix(zoom, zoom)
+            for page in selected:
+                with instrument.source(f"{input_path}#{page}"):
+                    result = _render_page(document, page, matrix, outputs[page], transform, save)
+                collect(result)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(input_path,))
+        try:
+            # Giao từng trang: worker nào rảnh nhận trang kế tiếp, tải giữa các worker tự cân bằng.
+            trace = instrument.enabled()
+            pending = {executor.submit(_render_in_worker, page, zoom, outputs[page], transform, save, trace)
+                       for page in selected}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda f: f.result().page):
+                    collect(future.result())
+        except BaseException:
+            # Lỗi hoặc bị hủy (JobCancelled): bỏ các trang chưa bắt đầu.
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+    ordered = [results[page] for page in selected]
+    log_timing_summary(ordered, time.perf_counter() - start, workers)
+    return ordered
+
+def log_timing_summary(results: List[PageResult], wall_seconds: float, workers: int):
+    if not results:
+        return
+    busy = sum(r.seconds for r in results)
+    slowest = max(results, key=lambda r: r.seconds)
+    log.info("Thời gian: %.2fs cho %d trang với %d worker | %.2f trang/s | "
+             "trung bình %.2fs/trang (render %.2fs) | chậm nhất trang %d (%.2fs) | mức song song x%.1f",
+             wall_seconds, len(results), workers, len(results) / wall_seconds,
+             busy / len(results), sum(r.render_seconds for r in results) / len(results),
+             slowest.page, slowest.seconds, busy / wall_seconds)
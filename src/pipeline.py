@@ -0,0 +1,367 @@
+import os
+import json
+import functools
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple
+
+from PIL import Image, ImageFilter
+
+from . import color_lut
+from . import fonts
+from . import instrument
+from . import motion_blur
+from . import transformer
+from .lru import LRUCache
+
+log = logging.getLogger(__name__)
+
+# Loại bước: quyết định bộ lập kế hoạch được phép đổi chỗ bước nào với bước nào.
+COLOR = 'color'        # phép màu theo từng điểm ảnh, gom thành một lượt LUT
+SELECT = 'select'      # chỉ giữ lại một phần điểm ảnh (crop, thu nhỏ NEAREST): bớt việc cho phép màu phía sau
+PERMUTE = 'permute'    # chỉ hoán vị điểm ảnh (lật, xoay 90°)
+SPATIAL = 'spatial'    # cần điểm ảnh lân cận hoặc nội suy (resize LANCZOS, bộ lọc, motion blur...)
+FRAME = 'frame'        # viền, bo góc, đổ bóng: thêm điểm ảnh mới
+
+CROP_RATIOS = ("1:1", "16:9", "4:3", "9:16", "3:4")
+MIRRORS = {
+    "Ngang": (Image.Transpose.FLIP_LEFT_RIGHT,),
+    "Dọc": (Image.Transpose.FLIP_TOP_BOTTOM,),
+    "Cả hai": (Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.FLIP_TOP_BOTTOM),
+}
+ROTATIONS = {
+    '90': (Image.Transpose.ROTATE_90, "  -> Đã xoay ảnh 90 độ."),
+    '180': (Image.Transpose.ROTATE_180, "  -> Đã xoay ảnh 180 độ."),
+    '270': (Image.Transpose.ROTATE_270, "  -> Đã xoay ảnh 270 độ."),
+    'Xoay ngang': (Image.Transpose.FLIP_LEFT_RIGHT, "  -> Đã lật ảnh theo chiều ngang."),
+    'Xoay dọc': (Image.Transpose.FLIP_TOP_BOTTOM, "  -> Đã lật ảnh theo chiều dọc."),
+}
+
+@dataclass
+class Step:
+    stage: str                                # tên bước báo cho progress
+    kind: str
+    run: Callable | None = None               # run(img, ctx) -> img; ctx là dict riêng của mỗi lần gọi
+    messages: Tuple[str, ...] = ()
+    color_ops: Tuple[tuple, ...] = ()         # với bước COLOR
+    transposes: Tuple[Image.Transpose, ...] = ()  # với bước PERMUTE
+    params: dict = field(default_factory=dict)     # tham số ghi vào sự kiện instrument
+
+    @property
+    def global_stats(self) -> bool:
+        # Độ tương phản dùng độ sáng trung bình của cả ảnh: bớt điểm ảnh trước đó sẽ làm đổi kết quả.
+        return any(op[0] == 'contrast' for op in self.color_ops)
+
+    def event_params(self) -> dict:
+        if self.kind == COLOR:
+            return {'ops': [list(op) for op in self.color_ops]}
+        if self.kind == PERMUTE:
+            return {'transposes': [t.name for t in self.transposes]}
+        return self.params
+
+    def describe(self) -> str:
+        if self.kind == COLOR:
+            return f"{self.stage}[{', '.join(op[0] for op in self.color_ops)}]"
+        if self.kind == PERMUTE:
+            return f"{self.stage}[{', '.join(t.name for t in self.transposes)}]"
+        return self.stage
+
+def _run_transposes(transposes, img, ctx):
+    for method in transposes:
+        img = img.transpose(method)
+    return img
+
+def _run_resize(size, img, ctx):
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+def _run_pixelate_down(block, img, ctx):
+    try:
+        small = img.resize((img.width // block, img.height // block), Image.Resampling.NEAREST)
+    except Exception as e:
+        log.warning("CẢNH BÁO: Lỗi pixel hóa: %s", e)
+        return img
+    ctx['pixelate_size'] = img.size
+    return small
+
+def _run_pixelate_up(img, ctx):
+    size = ctx.pop('pixelate_size', None)
+    return img.resize(size, Image.Resampling.NEAREST) if size else img
+
+def _run_filter(image_filter, img, ctx):
+    return img.filter(image_filter)
+
+def _probe_transposes(transposes) -> Tuple[Image.Transpose, ...]:
+    # Gộp một chuỗi lật/xoay thành (nhiều nhất) một phép: thử trên ảnh 2x3 có các giá trị khác nhau.
+    probe = Image.frombytes('L', (2, 3), bytes(range(6)))
+    target = _run_transposes(transposes, probe, None)
+    if target.tobytes() == probe.tobytes() and target.size == probe.size:
+        return ()
+    for method in Image.Transpose:
+        candidate = probe.transpose(method)
+        if candidate.size == target.size and candidate.tobytes() == target.tobytes():
+            return (method,)
+    return tuple(transposes)
+
+def _args_key(args) -> str:
+    # Khóa của một cấu hình: mọi tham số trừ đường dẫn vào/ra; file tham chiếu tính cả mtime.
+    values = {k: v for k, v in vars(args).items() if k not in transformer.PRESET_EXCLUDED_KEYS}
+    for name in ('lut_path', 'watermark_image_path'):
+        path = values.get(name)
+        if path and os.path.isfile(path):
+            values[name] = [path, os.stat(path).st_mtime_ns]
+    return json.dumps(values, sort_keys=True, default=str)
+
+class Pipeline:
+    # Cấu hình (preset/args) được kiểm tra và dịch một lần thành danh sách bước; bộ lập kế hoạch bỏ
+    # bước không làm gì, gom phép màu, dời phép màu ra sau các bước chỉ chọn/hoán vị điểm ảnh và gộp
+    # các phép lật/xoay liền nhau. Mọi phép đổi chỗ đều cho kết quả trùng từng byte với apply_transformations.
+    def __init__(self, args, steps: List[Step], warnings: List[str] | None = None):
+        self.args = args
+        self.steps = steps
+        self.warnings = warnings or []
+        # Sprite watermark chỉ phụ thuộc kích thước ảnh (trừ timestamp theo giờ hiện tại).
+        self._sprites = LRUCache(max_entries=8)
+        self._cache_sprites = not (getattr(args, 'timestamp_enabled', False)
+                                   and not getattr(args, 'timestamp_fixed', None))
+
+    @classmethod
+    def compile(cls, preset) -> 'Pipeline':
+        args = transformer.load_preset_dict(preset) if isinstance(preset, dict) else preset
+        warnings: List[str] = []
+        steps = plan(build_steps(args, warnings))
+        pipeline = cls(args, steps, warnings)
+        pipeline._prepare()
+        for warning in warnings:
+            log.warning("%s", warning)
+        return pipeline
+
+    def _prepare(self):
+        # Làm trước những gì không phụ thuộc ảnh: bảng LUT, kernel motion blur, font watermark.
+        for step in self.steps:
+            if step.kind == COLOR and not step.global_stats:
+                color_lut.prepare(step.color_ops)
+        if getattr(self.args, 'motion_blur', False):
+            size = max(1, min(int(getattr(self.args, 'motion_blur_size', 15)), motion_blur.MAX_SIZE))
+            if size >= 2:
+                motion_blur.motion_kernel(size, int(getattr(self.args, 'motion_blur_angle', 0)) % 360)
+        if self.args.watermark_text:
+            fonts.get_font(getattr(self.args, 'watermark_font', 'arial.ttf'), self.args.watermark_font_size)
+        if getattr(self.args, 'timestamp_enabled', False):
+            fonts.get_font(getattr(self.args, 'timestamp_font', 'arial.ttf'),
+                           getattr(self.args, 'timestamp_font_size', 30))
+
+    def describe(self) -> List[str]:
+        return [step.describe() for step in self.steps]
+
+    def __repr__(self) -> str:
+        return f"Pipeline({' -> '.join(self.describe()) or 'không có bước nào'})"
+
+    def _watermarks(self, size: Tuple[int, int], args=None) -> list:
+        if args is not None or not self._cache_sprites:
+            return list(transformer.watermark_sprites(args or self.args, size))
+        return self._sprites.get_or_create(size, lambda: list(transformer.watermark_sprites(self.args, size)))
+
+    def __call__(self, img: Image.Image, progress=None) -> Image.Image:
+        return self.watermark(self.run_steps(img, progress), keep=img, progress=progress)
+
+    def run_steps(self, img: Image.Image, progress=None) -> Image.Image:
+        # Mọi bước trừ watermark (renditions dùng chung phần này rồi mới thu nhỏ, đóng watermark riêng).
+        ctx: dict = {}
+        for step in self.steps:
+            if progress:
+                progress(step.stage)
+            probe = instrument.begin(step.stage, img, step.event_params()) if instrument.enabled() else None
+            if step.kind == COLOR:
+                img = color_lut.apply_color_ops(img, list(step.color_ops))
+            else:
+                img = step.run(img, ctx)
+            instrument.end(probe, img)
+            for message in step.messages:
+                log.info("%s", message)
+        return img
+
+    def watermark(self, img: Image.Image, keep: Image.Image | None = None, progress=None, args=None) -> Image.Image:
+        # Các bước watermark vẽ trực tiếp lên ảnh: nếu img là `keep` (ảnh của người gọi, còn dùng tiếp)
+        # thì vẽ lên bản sao. args: thay self.args (vd cỡ chữ đã thu nhỏ cho rendition), sprite không cache.
+        for stage, sprite, origin, message in self._watermarks(img.size, args):
+            if progress:
+                progress(stage)
+            probe = instrument.begin(stage, img, {'origin': origin, 'sprite_size': sprite.size})
+            if img is keep:
+                img = img.copy()
+            img = transformer.composite_sprite(transformer.prepare_for_overlay(img), sprite, origin)
+            instrument.end(probe, img)
+            log.info("%s", message)
+        return img
+
+def build_steps(args, warnings: List[str]) -> List[Step]:
+    # Dịch args theo đúng thứ tự của apply_transformations; tham số không có tác dụng không sinh bước.
+    steps: List[Step] = []
+
+    def color(op: tuple, message: str):
+        steps.append(Step('color', COLOR, color_ops=(op,), messages=(message,)))
+
+    crop_ratio = getattr(args, 'crop_ratio', None)
+    if crop_ratio in CROP_RATIOS:
+        steps.append(Step('crop', SELECT, lambda img, ctx: transformer.crop_to_aspect_ratio(img, crop_ratio),
+                          (f"  -> Đã crop ảnh theo tỷ lệ {crop_ratio}.",), params={'crop_ratio': crop_ratio}))
+
+    if args.resize:
+        size = transformer.parse_resize(args.resize)
+        if size is None:
+            warnings.append(f"LỖI: Định dạng resize không hợp lệ: '{args.resize}' (bỏ qua bước resize).")
+        else:
+            steps.append(Step('resize', SPATIAL, functools.partial(_run_resize, size),
+                              (f"  -> Đã resize/upscale ảnh thành {size[0]}x{size[1]}.",), params={'size': size}))
+
+    mirror = getattr(args, 'mirror', None)
+    if mirror in MIRRORS:
+        steps.append(Step('mirror', PERMUTE, messages=(f"  -> Đã mirror ảnh ({mirror}).",),
+                          transposes=MIRRORS[mirror]))
+
+    if args.brightness is not None and args.brightness != 1.0:
+        color(('brightness', args.brightness), f"  -> Đã điều chỉnh độ sáng (Factor: {args.brightness}).")
+    if args.contrast is not None and args.contrast != 1.0:
+        color(('contrast', args.contrast), f"  -> Đã điều chỉnh độ tương phản (Factor: {args.contrast}).")
+    if getattr(args, 'saturation', None) is not None and args.saturation != 1.0:
+        color(('saturation', args.saturation), f"  -> Đã điều chỉnh độ bão hòa (Factor: {args.saturation}).")
+    if getattr(args, 'temperature', None) is not None and args.temperature != 1.0:
+        color(('temperature', args.temperature), f"  -> Đã điều chỉnh nhiệt độ màu (Factor: {args.temperature}).")
+
+    if args.filter == 'Làm mờ':
+        steps.append(Step('filter', SPATIAL, functools.partial(_run_filter, ImageFilter.GaussianBlur(radius=2)),
+                          ("  -> Đã áp dụng Bộ lọc Làm mờ (Gaussian Blur).",), params={'filter': args.filter}))
+    elif args.filter == 'Làm nét':
+        steps.append(Step('filter', SPATIAL, functools.partial(_run_filter, ImageFilter.SHARPEN),
+                          ("  -> Đã áp dụng Bộ lọc Làm nét (Sharpen).",), params={'filter': args.filter}))
+
+    artistic = getattr(args, 'artistic_filter', None)
+    if artistic == 'Nâu đỏ':
+        color(('sepia',), "  -> Đã áp dụng bộ lọc Sepia.")
+    elif artistic == 'Cổ điển':
+        steps.append(Step('color', COLOR, color_ops=(('sepia',), ('contrast', 0.8), ('brightness', 0.9)),
+                          messages=("  -> Đã áp dụng hiệu ứng Vintage.",)))
+    elif artistic == 'Dập nổi':
+        steps.append(Step('artistic_filter', SPATIAL, lambda img, ctx: transformer.apply_emboss(img),
+                          ("  -> Đã áp dụng hiệu ứng Emboss.",), params={'artistic_filter': artistic}))
+    elif artistic == 'edge_detection':
+        steps.append(Step('artistic_filter', SPATIAL, lambda img, ctx: transformer.apply_edge_detection(img),
+                          ("  -> Đã áp dụng Edge Detection.",), params={'artistic_filter': artistic}))
+    elif artistic == 'Sơn dầu':
+        steps.append(Step('artistic_filter', SPATIAL, lambda img, ctx: transformer.apply_oil_painting(img),
+                          ("  -> Đã áp dụng hiệu ứng Oil Painting.",), params={'artistic_filter': artistic}))
+
+    if getattr(args, 'motion_blur', False):
+        angle = getattr(args, 'motion_blur_angle', 0)
+        size = getattr(args, 'motion_blur_size', 15)
+        message = f"  -> Đã áp dụng Motion Blur (độ dài: {size}, góc: {angle}°)."
+        if max(1, min(int(size), motion_blur.MAX_SIZE)) >= 2:
+            steps.append(Step('motion_blur', SPATIAL,
+                              lambda img, ctx: transformer.apply_motion_blur(img, size=size, angle=angle), (message,),
+                              params={'size': size, 'angle': angle}))
+
+    if args.grayscale:
+        color(('grayscale',), "  -> Đã chuyển ảnh sang đen trắng.")
+    if getattr(args, 'invert', False):
+        color(('invert',), "  -> Đã áp dụng Đảo màu (Invert).")
+    lut_path = getattr(args, 'lut_path', None)
+    if lut_path:
+        try:
+            color(color_lut.cube_op(lut_path), f"  -> Đã áp dụng LUT từ: {lut_path}")
+        except Exception as e:
+            warnings.append(f"CẢNH BÁO: Không thể đọc file LUT: {e}")
+
+    if args.pixelate_size and args.pixelate_size > 1:
+        # Tách thành thu nhỏ + phóng lại (đều NEAREST) để phép màu chen được vào giữa, chạy trên ảnh nhỏ.
+        params = {'block': args.pixelate_size}
+        steps.append(Step('pixelate', SELECT, functools.partial(_run_pixelate_down, args.pixelate_size),
+                          params=params))
+        steps.append(Step('pixelate', SPATIAL, _run_pixelate_up,
+                          (f"  -> Đã áp dụng pixel hóa (block size: {args.pixelate_size}).",), params=params))
+
+    if args.rotate in ROTATIONS:
+        method, message = ROTATIONS[args.rotate]
+        steps.append(Step('rotate', PERMUTE, messages=(message,), transposes=(method,)))
+
+    if getattr(args, 'border_width', 0) > 0:
+        border_color = getattr(args, 'border_color', '#000000')
+        steps.append(Step('border', FRAME,
+                          lambda img, ctx: transformer.add_border(img, args.border_width, border_color),
+                          (f"  -> Đã thêm viền (width: {args.border_width}, color: {border_color}).",),
+                          params={'width': args.border_width, 'color': border_color}))
+    if getattr(args, 'rounded_radius', 0) > 0:
+        steps.append(Step('rounded_corners', FRAME,
+                          lambda img, ctx: transformer.add_rounded_corners(img, args.rounded_radius),
+                          (f"  -> Đã bo góc (radius: {args.rounded_radius}).",), params={'radius': args.rounded_radius}))
+    if getattr(args, 'shadow_enabled', False):
+        offset = getattr(args, 'shadow_offset', 10)
+        blur = getattr(args, 'shadow_blur', 10)
+        shadow_color = getattr(args, 'shadow_color', '#000000')
+        steps.append(Step('shadow', FRAME,
+                          lambda img, ctx: transformer.add_shadow(img, offset, blur, shadow_color),
+                          ("  -> Đã thêm đổ bóng.",), params={'offset': offset, 'blur': blur, 'color': shadow_color}))
+    return steps
+
+def _fuse_colors(steps: List[Step]) -> List[Step]:
+    # Các phép màu liền nhau thành một lượt LUT, đúng như cách apply_transformations gom chúng.
+    fused: List[Step] = []
+    for step in steps:
+        if step.kind == COLOR and fused and fused[-1].kind == COLOR:
+            last = fused.pop()
+            step = Step('color', COLOR, color_ops=last.color_ops + step.color_ops,
+                        messages=last.messages + step.messages)
+        fused.append(step)
+    return fused
+
+def _commutes(color: Step, other: Step) -> bool:
+    if other.kind == PERMUTE:
+        return True
+    return other.kind == SELECT and not color.global_stats
+
+def _merge_transposes(steps: List[Step]) -> List[Step]:
+    merged: List[Step] = []
+    for step in steps:
+        if step.kind == PERMUTE and merged and merged[-1].kind == PERMUTE:
+            last = merged.pop()
+            step = Step(last.stage, PERMUTE, messages=last.messages + step.messages,
+                        transposes=last.transposes + step.transposes)
+        merged.append(step)
+    result = []
+    for step in merged:
+        if step.kind == PERMUTE:
+            transposes = _probe_transposes(step.transposes)
+            if not transposes:
+                # Các phép lật/xoay triệt tiêu nhau: bỏ hẳn, chỉ giữ thông báo.
+                result.append(Step(step.stage, PERMUTE, lambda img, ctx: img, step.messages))
+                continue
+            step = Step(step.stage, PERMUTE, functools.partial(_run_transposes, transposes), step.messages,
+                        transposes=transposes)
+        result.append(step)
+    return result
+
+def plan(steps: List[Step]) -> List[Step]:
+    steps = _fuse_colors(steps)
+    # Dời mỗi lượt màu ra sau các bước chỉ chọn/hoán vị điểm ảnh: kết quả không đổi, số điểm ảnh
+    # phải tính giảm (ví dụ chạy trên ảnh đã thu nhỏ của bước pixel hóa). Lượt màu không vượt qua
+    # bước SPATIAL nào nên không bao giờ dính vào lượt màu khác.
+    # Riêng resize LANCZOS: thứ tự gốc đã đặt resize trước mọi phép màu, nên khi thu nhỏ phép màu vốn
+    # chạy trên ảnh nhỏ. Đưa phép màu lên trước khi phóng to thì sai lệch lớn (phần vượt ngưỡng của
+    # LANCZOS bị cắt ở 0/255 khác nhau: trung bình 3-7 mức, tối đa trên 100) mà chỉ nhanh hơn tối đa
+    # 1.5 lần (phép màu rẻ hơn resize nhiều), nên không làm.
+    moved = True
+    while moved:
+        moved = False
+        for i in range(len(steps) - 1):
+            if steps[i].kind == COLOR and _commutes(steps[i], steps[i + 1]):
+                steps[i], steps[i + 1] = steps[i + 1], steps[i]
+                moved = True
+    return _merge_transposes(steps)
+
+# Mỗi tiến trình giữ các pipeline đã dịch: worker batch gọi lại cho từng file cùng một preset.
+_compiled = LRUCache(max_entries=16)
+
+def compiled(args) -> Pipeline:
+    return _compiled.get_or_create(_args_key(args), lambda: Pipeline.compile(args))
+
+def compiled_cache_info() -> dict:
+    return _compiled.stats()
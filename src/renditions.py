@@ -0,0 +1,147 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from PIL import Image
+
+from . import transformer
+from . import instrument
+from . import pipeline
+
+log = logging.getLogger(__name__)
+
+# Một preset có thể khai báo nhiều bản đầu ra (vd ảnh 2400 px, 1200 px WebP và thumbnail 300 px):
+#   "renditions": [{"name": "large", "width": 2400, "format": "jpg", "quality": 85},
+#                  {"name": "thumb", "width": 300, "height": 300, "watermark": false}]
+# Ảnh chỉ được giải mã và xử lý (crop, lọc, màu, khung...) một lần ở kích thước của preset. Mỗi bản
+# được thu nhỏ từ bản lớn hơn liền trước, rồi mới đóng watermark (cỡ chữ theo tỷ lệ) và mã hóa riêng.
+FORMATS = ('jpg', 'jpeg', 'png', 'webp')
+KEYS = ('name', 'width', 'height', 'format', 'quality', 'target_size_kb', 'min_ssim', 'watermark')
+
+@dataclass
+class Rendition:
+    name: str
+    width: int | None = None
+    height: int | None = None
+    format: str | None = None            # None: theo đuôi của đường dẫn đầu ra
+    quality: int | None = None           # None: dùng giá trị của preset
+    target_size_kb: float | None = None
+    min_ssim: float | None = None
+    watermark: bool = True
+
+    def fit(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        # Vừa khung width x height (thiếu một chiều thì theo tỷ lệ), giữ tỷ lệ, không phóng to.
+        width, height = size
+        scale = min(self.width / width if self.width else 1.0, self.height / height if self.height else 1.0, 1.0)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def output_path(self, output_path: str) -> str:
+        base, ext = os.path.splitext(output_path)
+        if self.format:
+            ext = '.' + self.format
+        return f"{base}_{self.name}{ext}"
+
+    def save_options(self, args) -> dict:
+        options = transformer.save_options(args)
+        if self.quality is not None:
+            options['quality'] = self.quality
+        if self.target_size_kb is not None:
+            options['target_bytes'] = int(self.target_size_kb * 1024)
+        if self.min_ssim is not None:
+            options['min_ssim'] = self.min_ssim
+        return options
+
+@dataclass
+class Output:
+    rendition: Rendition
+    path: str
+    image: Image.Image
+    save_options: dict
+
+def _positive_int(spec: dict, key: str, index: int) -> int | None:
+    value = spec.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0 or int(value) != value:
+        raise ValueError(f"Rendition #{index + 1}: '{key}' phải là số nguyên dương (đang là {value!r})")
+    return int(value)
+
+def _positive_number(spec: dict, key: str, index: int, maximum: float | None = None) -> float | None:
+    value = spec.get(key)
+    if value is None:
+        return None
+    if (isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0
+            or (maximum is not None and value > maximum)):
+        expected = f"số trong khoảng (0, {maximum:g}]" if maximum is not None else "số dương"
+        raise ValueError(f"Rendition #{index + 1}: '{key}' phải là {expected} (đang là {value!r})")
+    return float(value)
+
+def parse_renditions(specs) -> List[Rendition]:
+    # Kiểm tra khóa "renditions" của preset; lỗi được báo trước khi xử lý ảnh nào.
+    if not specs:
+        return []
+    if not isinstance(specs, list):
+        raise ValueError("'renditions' phải là danh sách các bản đầu ra")
+    renditions, names = [], set()
+    for index, spec in enumerate(specs):
+        if not isinstance(spec, dict):
+            raise ValueError(f"Rendition #{index + 1} phải là một đối tượng JSON")
+        unknown = sorted(set(spec) - set(KEYS))
+        if unknown:
+            raise ValueError(f"Rendition #{index + 1}: khóa không hỗ trợ {', '.join(unknown)}")
+        width, height = _positive_int(spec, 'width', index), _positive_int(spec, 'height', index)
+        if width is None and height is None:
+            raise ValueError(f"Rendition #{index + 1}: cần 'width' và/hoặc 'height'")
+        image_format = spec.get('format')
+        if image_format is not None:
+            image_format = str(image_format).lower().lstrip('.')
+            if image_format not in FORMATS:
+                raise ValueError(f"Rendition #{index + 1}: định dạng không hỗ trợ '{spec['format']}'")
+        quality = _positive_int(spec, 'quality', index)
+        if quality is not None and quality > 100:
+            raise ValueError(f"Rendition #{index + 1}: 'quality' phải trong khoảng 1-100")
+        target_size_kb = _positive_number(spec, 'target_size_kb', index)
+        min_ssim = _positive_number(spec, 'min_ssim', index, maximum=1)
+        name = str(spec.get('name') or (f"{width}w" if width else f"{height}h"))
+        if name in names:
+            raise ValueError(f"Rendition trùng tên: '{name}'")
+        names.add(name)
+        renditions.append(Rendition(name, width, height, image_format, quality, target_size_kb, min_ssim,
+                                    bool(spec.get('watermark', True))))
+    return renditions
+
+def render(img: Image.Image, args, progress=None) -> List[Output]:
+    # Chạy pipeline (trừ watermark) một lần, rồi tạo từng bản từ lớn đến nhỏ.
+    renditions = parse_renditions(getattr(args, 'renditions', None))
+    pipe = pipeline.compiled(args)
+    base = pipe.run_steps(img, progress)
+    master_size = base.size
+    outputs: List[Output] = []
+    current = base
+    for rendition in sorted(renditions, key=lambda r: r.fit(master_size)[0] * r.fit(master_size)[1], reverse=True):
+        size = rendition.fit(master_size)
+        if current.size != size:
+            if progress:
+                progress('rendition')
+            probe = instrument.begin('rendition', current, {'name': rendition.name, 'size': size})
+            current = current.resize(size, Image.Resampling.LANCZOS)
+            instrument.end(probe, current)
+        image = current
+        if rendition.watermark:
+            # Bản nhỏ hơn ảnh gốc: cỡ chữ watermark/timestamp thu nhỏ cùng tỷ lệ, như ảnh xem trước.
+            # Chỉ đổi các trường watermark: viền, bóng... đã nằm trong ảnh gốc trước khi thu nhỏ.
+            scaled = None if size == master_size else transformer.scale_size_args(
+                args, size[0] / master_size[0], transformer.WATERMARK_SCALED_ARGS)
+            image = pipe.watermark(current, keep=current, progress=progress, args=scaled)
+        outputs.append(Output(rendition, rendition.output_path(args.output_path), image,
+                              rendition.save_options(args)))
+        log.info("  -> Rendition '%s': %sx%s.", rendition.name, size[0], size[1])
+    return outputs
+
+def save(outputs: List[Output]) -> bool:
+    success = True
+    for output in outputs:
+        os.makedirs(os.path.dirname(output.path) or '.', exist_ok=True)
+        success = transformer.save_image(output.image, output.path, **output.save_options) and success
+    return success
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import marshal
+import hashlib
+import tempfile
+import threading
+import importlib.util
+import logging
+from functools import lru_cache
+from typing import Callable, Tuple
+
+import PIL
+
+from . import pdf_raster
+from .lru import LRUCache
+
+log = logging.getLogger(__name__)
+
+# Tăng khi thay đổi thuật toán xử lý làm kết quả khác đi: mọi khóa cũ tự động hết hiệu lực.
+CACHE_VERSION = 1
+# Các module quyết định nội dung file kết quả: mã nguồn của chúng cũng nằm trong khóa, nên sửa code
+# mà quên tăng CACHE_VERSION cũng không trả về kết quả cũ.
+TRANSFORM_MODULES = ('batch', 'color_lut', 'fonts', 'logos', 'motion_blur', 'pdf_raster', 'pipeline',
+                     'quality_search', 'renditions', 'stage_memo', 'tiled', 'transformer')
+DEFAULT_CACHE_MB = 1024
+# Không ảnh hưởng tới nội dung kết quả.
+KEY_EXCLUDED_ARGS = ('command', 'input_path', 'output_path', 'output_folder')
+# Tham số là đường dẫn file: băm nội dung file thay cho đường dẫn.
+FILE_ARGS = ('lut_path', 'watermark_image_path')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+"""
+
+# (đường dẫn, size, mtime_ns) -> sha256: file đầu vào không đổi thì không phải băm lại trong cùng tiến trình.
+_digests = LRUCache(max_entries=4096)
+
+def file_digest(path: str) -> str:
+    stat = os.stat(path)
+    def compute():
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+    return _digests.get_or_create((os.path.abspath(path), stat.st_size, stat.st_mtime_ns), compute)
+
+@lru_cache(maxsize=1)
+def code_digest() -> str:
+    h = hashlib.sha256()
+    for name in TRANSFORM_MODULES:
+        spec = importlib.util.find_spec(f"{__package__}.{name}")
+        source = spec.loader.get_source(spec.name) if spec and spec.loader else None
+        if source is not None:
+            h.update(source.encode('utf-8'))
+        elif spec and spec.loader:
+            # Bản đóng gói không kèm file .py: băm bytecode.
+            h.update(marshal.dumps(spec.loader.get_code(spec.name)))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def uncacheable_reason(args) -> str | None:
+    if pdf_raster.is_pdf(args.input_path):
+        return "đầu vào PDF tạo nhiều file kết quả"
+    if getattr(args, 'renditions', None):
+        return "preset có nhiều bản đầu ra (renditions)"
+    if getattr(args, 'timestamp_enabled', False) and not getattr(args, 'timestamp_fixed', None):
+        return "timestamp lấy theo giờ hiện tại (đặt timestamp_fixed để cache được)"
+    return None
+
+def args_digest(args, extra: dict | None = None) -> str:
+    # Dạng chuẩn của mọi tham số: khóa sắp xếp, file tham chiếu thay bằng hash nội dung,
+    # kèm định dạng đầu ra, phiên bản Pillow (bộ mã hóa khác -> byte khác) và mã nguồn phần xử lý.
+    values = {k: v for k, v in vars(args).items() if k not in KEY_EXCLUDED_ARGS}
+    for name in FILE_ARGS:
+        path = values.get(name)
+        if path and os.path.isfile(path):
+            values[name] = 'sha256:' + file_digest(path)
+    values['_output_ext'] = os.path.splitext(args.output_path)[1].lower()
+    values['_version'] = [CACHE_VERSION, PIL.__version__, code_digest()]
+    if extra:
+        values['_extra'] = extra
+    canonical = json.dumps(values, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def cache_key(args, extra: dict | None = None) -> str:
+    return hashlib.sha256(f"{file_digest(args.input_path)}:{args_digest(args, extra)}".encode()).hexdigest()
+
+def _replace_output(source: str, output_path: str, link: bool):
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    if link:
+        try:
+            os.link(source, output_path)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, output_path)
+
+class ResultCache:
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_MB << 20, link: bool = False):
+        # link=True: trả kết quả bằng hardlink thay vì sao chép (nhanh, không tốn thêm dung lượng).
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        # Nhiều tiến trình batch dùng chung một thư mục cache: SQLite lo phần khóa.
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), timeout=30,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def _object_path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, 'objects', key[:2], key + ext)
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT ext FROM entries WHERE key = ?", (key,)).fetchone()
+            path = self._object_path(key, row[0]) if row else None
+            if path and os.path.exists(path):
+                _replace_output(path, output_path, self.link)
+                self._conn.execute("UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                                   (time.time(), key))
+                self._conn.commit()
+                self.hits += 1
+                return True
+            if row:
+                # File trong cache bị xóa bên ngoài: bỏ luôn bản ghi.
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            return False
+
+    def store(self, key: str, output_path: str) -> bool:
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return False
+        ext = os.path.splitext(output_path)[1].lower()
+        path = self._object_path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên: tiến trình khác không bao giờ thấy file ghi dở.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(output_path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO entries (key, ext, size, last_used) VALUES (?, ?, ?, ?)",
+                               (key, ext, size, time.time()))
+            self._conn.commit()
+            self._evict()
+        return True
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = []
+        for key, ext, size in self._conn.execute("SELECT key, ext, size FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._object_path(key, ext))
+            except FileNotFoundError:
+                pass
+            removed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", removed)
+        self._conn.commit()
+        self.evictions += len(removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            total = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(os.path.join(self.cache_dir, 'objects'), ignore_errors=True)
+            os.makedirs(os.path.join(self.cache_dir, 'objects'), exist_ok=True)
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self.hits = self.misses = self.evictions = 0
+
+_caches: dict = {}
+
+def get_cache(cache_dir: str, max_bytes: int = DEFAULT_CACHE_MB << 20, link: bool = False) -> ResultCache:
+    # Mỗi tiến trình giữ một đối tượng cho mỗi thư mục cache (worker batch gọi lại cho từng file).
+    key = (os.path.abspath(cache_dir), max_bytes, link)
+    if key not in _caches:
+        _caches[key] = ResultCache(cache_dir, max_bytes, link)
+    return _caches[key]
+
+def result_cache_info() -> dict:
+    totals = {'hits': 0, 'misses': 0, 'evictions': 0}
+    for cache in _caches.values():
+        for name in totals:
+            totals[name] += getattr(cache, name)
+    return totals
+
+def fetch_cached(cache: ResultCache | None, args, extra: dict | None = None) -> Tuple[bool, str | None]:
+    # (đã lấy kết quả từ cache, khóa để lưu kết quả sau khi tự xử lý; None nếu không cache được).
+    if cache is None:
+        return False, None
+    reason = uncacheable_reason(args)
+    if reason:
+        log.info("  -> Không dùng cache: %s.", reason)
+        return False, None
+    key = cache_key(args, extra)
+    if cache.fetch(key, args.output_path):
+        log.info("Đã lấy kết quả từ cache: %s", args.output_path)
+        return True, key
+    if os.path.exists(args.output_path) and os.stat(args.output_path).st_nlink > 1:
+        # File đầu ra đang là hardlink vào cache: ghi đè tại chỗ sẽ làm hỏng bản trong cache.
+        os.remove(args.output_path)
+    return False, key
+
+def store_cached(cache: ResultCache | None, key: str | None, args, success: bool):
+    if cache is not None and key is not None and success and os.path.exists(args.output_path):
+        cache.store(key, args.output_path)
+
+def run_cached(cache: ResultCache | None, args, run: Callable[[], bool], extra: dict | None = None) -> bool:
+    # run() tạo args.output_path như bình thường; trúng cache thì chỉ sao chép/hardlink kết quả cũ.
+    hit, key = fetch_cached(cache, args, extra)
+    if hit:
+        return True
+    success = run()
+    store_cached(cache, key, args, success)
+    return success
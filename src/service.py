@@ -0,0 +1,409 @@
+import io
+import os
+import json
+import math
+import time
+import signal
+import zipfile
+import tempfile
+import threading
+import http.client
+import email.parser
+import email.policy
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image
+
+from . import transformer
+from . import batch
+from . import watch
+
+# Dịch vụ HTTP cục bộ cho các ứng dụng khác gọi pipeline mà không phải chạy `python -m src` (và nạp lại
+# cv2/scipy/fitz) cho từng ảnh. Các tiến trình worker được tạo và khởi động sẵn một lần; mỗi request
+# gửi bytes ảnh/PDF kèm preset JSON, nhận lại bytes kết quả.
+#   POST /transform  ảnh hoặc PDF + preset -> ảnh kết quả (nhiều file: renditions, trang PDF -> ZIP)
+#   POST /info       ảnh -> JSON của get_image_info
+#   POST /pdf        PDF -> ZIP các trang JPG (như lệnh pdf không có preset)
+#   GET  /health     JSON trạng thái: số worker, request đang chạy/đang chờ, số request bị từ chối
+# Preset: header X-Preset (JSON), hoặc multipart/form-data với phần "file" và "preset".
+# Tham số query: format (jpg/png/webp), quality, dpi, pages (vd: 1-5,8).
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Số request được chờ thêm khi mọi worker đều bận; vượt quá thì trả 503 ngay.
+DEFAULT_QUEUE_LIMIT = 16
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_BODY_MB = 200
+OUTPUT_FORMATS = ('jpg', 'png', 'webp')
+# Định dạng Pillow -> đuôi file tạm của ảnh gửi lên (quyết định định dạng đầu ra mặc định).
+_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'TIFF': '.tif', 'BMP': '.bmp', 'GIF': '.gif'}
+_CONTENT_TYPES = {'.jpg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp', '.tif': 'image/tiff',
+                  '.bmp': 'image/bmp', '.gif': 'image/gif', '.zip': 'application/zip',
+                  '.json': 'application/json; charset=utf-8'}
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+@dataclass
+class Reply:
+    status: int
+    body: bytes
+    content_type: str = _CONTENT_TYPES['.json']
+    headers: Dict[str, str] = field(default_factory=dict)
+
+def json_reply(status: int, value) -> Reply:
+    return Reply(status, json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+def error_reply(status: int, message: str) -> Reply:
+    return json_reply(status, {'error': message})
+
+def _zip(paths: List[str]) -> bytes:
+    # Ảnh đã nén sẵn: ZIP_STORED, không tốn CPU nén lại.
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            archive.write(path, os.path.basename(path))
+    return buffer.getvalue()
+
+def _file_reply(paths: List[str], seconds: float) -> Reply:
+    headers = {'X-Processing-Seconds': f"{seconds:.3f}"}
+    if len(paths) == 1:
+        with open(paths[0], 'rb') as f:
+            body = f.read()
+        extension = os.path.splitext(paths[0])[1].lower()
+        return Reply(200, body, _CONTENT_TYPES.get(extension, 'application/octet-stream'), headers)
+    headers['X-Files'] = str(len(paths))
+    return Reply(200, _zip(paths), _CONTENT_TYPES['.zip'], headers)
+
+def _input_extension(data: bytes) -> str:
+    if data[:5] == b'%PDF-':
+        return '.pdf'
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return _EXTENSIONS.get(img.format, '.png')
+    except Exception:
+        raise RequestError(415, "Dữ liệu gửi lên không phải ảnh hoặc PDF đọc được")
+
+def _apply_params(preset: dict, params: Dict[str, str]) -> dict:
+    preset = dict(preset)
+    try:
+        if 'quality' in params:
+            preset['quality'] = max(1, min(100, int(params['quality'])))
+        if 'dpi' in params:
+            preset['pdf_dpi'] = int(params['dpi'])
+    except ValueError as e:
+        raise RequestError(400, f"Tham số không hợp lệ: {e}")
+    if 'pages' in params:
+        preset['pdf_pages'] = params['pages']
+    return preset
+
+def handle(endpoint: str, data: bytes, preset: dict, params: Dict[str, str]) -> Reply:
+    # Chạy trong worker: ghi dữ liệu vào thư mục tạm riêng của request rồi gọi đúng các hàm mà
+    # batch/pdf dùng, nên kết quả giống hệt dòng lệnh (kể cả renditions, mục tiêu dung lượng/SSIM).
+    start = time.perf_counter()
+    try:
+        extension = _input_extension(data)
+        image_format = params.get('format', '').lower().lstrip('.') or None
+        if image_format and image_format not in OUTPUT_FORMATS:
+            raise RequestError(400, f"Định dạng đầu ra không hỗ trợ: {image_format}")
+        with tempfile.TemporaryDirectory(prefix='itp-service-') as work_dir:
+            input_path = os.path.join(work_dir, 'input' + extension)
+            with open(input_path, 'wb') as f:
+                f.write(data)
+            output_dir = os.path.join(work_dir, 'out')
+            os.makedirs(output_dir)
+
+            if endpoint == '/info':
+                info = transformer.get_image_info(input_path)
+                info.pop('filename', None)
+                return json_reply(422 if 'error' in info else 200, info)
+
+            if endpoint == '/pdf':
+                if extension != '.pdf':
+                    raise RequestError(415, "/pdf cần dữ liệu PDF")
+                preset = _apply_params(preset, params)
+                ok = transformer.process_pdf_to_jpg(input_path, output_dir, preset.get('pdf_dpi', 300),
+                                                    pages=preset.get('pdf_pages'), workers=1)
+                if not ok:
+                    raise RequestError(422, "Không chuyển được PDF")
+            else:
+                preset = _apply_params(preset, params)
+                output_path = batch.build_output_path(input_path, output_dir, image_format)
+                result = batch.process_file(input_path, output_path, preset)
+                if not result.success:
+                    raise RequestError(422, result.error or "Không xử lý được ảnh")
+            paths = sorted((os.path.join(output_dir, name) for name in os.listdir(output_dir)),
+                           key=_natural_key)
+            if not paths:
+                raise RequestError(422, "Không có kết quả")
+            return _file_reply(paths, time.perf_counter() - start)
+    except RequestError as e:
+        return error_reply(e.status, str(e))
+    except Exception as e:
+        return error_reply(500, f"LỖI không thể xử lý: {e}")
+
+def _natural_key(path: str):
+    # input_page_2.jpg trước input_page_10.jpg
+    name = os.path.basename(path)
+    digits = ''.join(c if c.isdigit() else ' ' for c in name).split()
+    return [int(d) for d in digits], name
+
+def parse_body(content_type: str, body: bytes, preset_header: str | None) -> Tuple[bytes, dict]:
+    # (bytes ảnh/PDF, preset) từ body thô + header X-Preset, hoặc từ multipart/form-data.
+    preset_text = preset_header
+    data = body
+    if content_type.lower().startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+        data = None
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if name in ('file', 'image'):
+                data = part.get_payload(decode=True)
+            elif name == 'preset':
+                preset_text = part.get_payload(decode=True).decode('utf-8')
+        if data is None:
+            raise RequestError(400, "Thiếu phần 'file' trong multipart/form-data")
+    if not data:
+        raise RequestError(400, "Thiếu dữ liệu ảnh")
+    preset = {}
+    if preset_text:
+        try:
+            preset = json.loads(preset_text)
+        except ValueError as e:
+            raise RequestError(400, f"Preset JSON không hợp lệ: {e}")
+        if not isinstance(preset, dict):
+            raise RequestError(400, "Preset phải là một đối tượng JSON")
+    return data, preset
+
+class TransformService:
+    # Nhận request: tối đa `workers` request chạy cùng lúc, `queue_limit` request chờ; vượt quá trả 503.
+    def __init__(self, workers: int | None = None, queue_limit: int = DEFAULT_QUEUE_LIMIT,
+                 timeout: float = DEFAULT_TIMEOUT, max_body_bytes: int = DEFAULT_MAX_BODY_MB << 20):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_limit = max(0, queue_limit)
+        self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self.served = 0
+        self.rejected = 0
+        self._pool = self._start_pool()
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=watch.warm_worker, initargs=({},))
+        # Tạo đủ worker ngay: request đầu tiên không phải chờ khởi động tiến trình.
+        for future in [pool.submit(watch.worker_ready) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def health(self) -> dict:
+        with self._lock:
+            return {'workers': self.workers, 'queue_limit': self.queue_limit,
+                    'running': min(self._admitted, self.workers),
+                    'queued': max(0, self._admitted - self.workers),
+                    'served': self.served, 'rejected': self.rejected}
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._admitted -= 1
+
+    def submit(self, endpoint: str, data: bytes, preset: dict, params: Dict[str, str]) -> Reply:
+        with self._lock:
+            if self._admitted >= self.workers + self.queue_limit:
+                self.rejected += 1
+                return Reply(503, json.dumps({'error': "Máy chủ quá tải, thử lại sau"}, ensure_ascii=False)
+                             .encode('utf-8'), headers={'Retry-After': '1'})
+            self._admitted += 1
+            pool = self._pool
+        try:
+            future = pool.submit(handle, endpoint, data, preset, params)
+        except Exception as e:
+            self._release()
+            return error_reply(500, f"LỖI không gửi được tới worker: {e}")
+        # Chỗ trong hàng đợi chỉ được trả khi worker làm xong, kể cả khi client đã hết thời gian chờ.
+        future.add_done_callback(self._release)
+        try:
+            reply = future.result(timeout=self.timeout)
+        except TimeoutError:
+            return error_reply(504, f"Quá {self.timeout:g}s chưa xử lý xong")
+        except BrokenProcessPool:
+            self._restart(pool)
+            return error_reply(500, "Worker dừng đột ngột khi xử lý request")
+        with self._lock:
+            self.served += 1
+        return reply
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        with self._lock:
+            if self._pool is not broken:
+                return
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._start_pool()
+
+    def close(self):
+        self._pool.shutdown()
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'       # giữ kết nối (keep-alive) giữa các request
+    server_version = 'ImageTransformerPro'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, reply: Reply):
+        self.send_response(reply.status)
+        self.send_header('Content-Type', reply.content_type)
+        self.send_header('Content-Length', str(len(reply.body)))
+        for name, value in reply.headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(reply.body)
+
+    def do_GET(self):
+        if urlsplit(self.path).path == '/health':
+            self._send(json_reply(200, self.server.service.health()))
+        else:
+            self._send(error_reply(404, f"Không có đường dẫn {self.path}"))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.server.service.max_body_bytes:
+            # Không đọc phần còn lại của body: đóng kết nối.
+            self.close_connection = True
+            self._send(error_reply(413, f"Dữ liệu quá lớn ({length / (1 << 20):.0f} MB)"))
+            return
+        body = self.rfile.read(length)
+        if url.path not in ('/transform', '/info', '/pdf'):
+            self._send(error_reply(404, f"Không có đường dẫn {url.path}"))
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            data, preset = parse_body(self.headers.get('Content-Type', ''), body, self.headers.get('X-Preset'))
+        except RequestError as e:
+            self._send(error_reply(e.status, str(e)))
+            return
+        self._send(self.server.service.submit(url.path, data, preset, params))
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: TransformService, verbose: bool = False):
+        super().__init__(address, _Handler)
+        self.service = service
+        self.verbose = verbose
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, workers: int | None = None,
+          queue_limit: int = DEFAULT_QUEUE_LIMIT, timeout: float = DEFAULT_TIMEOUT,
+          max_body_mb: float = DEFAULT_MAX_BODY_MB, verbose: bool = False):
+    service = TransformService(workers, queue_limit, timeout, int(max_body_mb * (1 << 20)))
+    server = ServiceServer((host, port), service, verbose)
+    print(f"Đang phục vụ tại http://{host}:{server.server_port} ({service.workers} worker, "
+          f"chờ tối đa {service.queue_limit} request), Ctrl+C để dừng...")
+
+    def interrupt(*_):
+        raise KeyboardInterrupt
+
+    # Cài rõ cho cả SIGTERM và SIGINT (tiến trình chạy nền có thể đang bỏ qua SIGINT).
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        print(f"Đã dừng: {service.served} request đã xử lý, {service.rejected} bị từ chối (503).")
+
+@dataclass
+class LoadReport:
+    latencies: List[float]          # giây, chỉ các request thành công (2xx)
+    statuses: Dict[int, int]
+    wall_seconds: float
+    errors: int = 0                 # lỗi kết nối
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values()) + self.errors
+
+    @property
+    def requests_per_second(self) -> float:
+        return len(self.latencies) / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def percentile(self, p: float) -> float:
+        # Phân vị theo thứ hạng gần nhất (không nội suy).
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+def load_test(url: str, data: bytes, preset: dict | None = None, concurrency: int = 4,
+              requests: int = 100, timeout: float = DEFAULT_TIMEOUT) -> LoadReport:
+    # `concurrency` luồng, mỗi luồng một kết nối keep-alive, gửi tổng cộng `requests` request.
+    parts = urlsplit(url)
+    target = parts.path + ('?' + parts.query if parts.query else '')
+    headers = {'Content-Type': 'application/octet-stream'}
+    if preset:
+        headers['X-Preset'] = json.dumps(preset, ensure_ascii=True)
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def client():
+        nonlocal errors
+        connection = None
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            try:
+                if connection is None:
+                    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+                began = time.perf_counter()
+                connection.request('POST', target, body=data, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - began
+                with lock:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                    if 200 <= response.status < 300:
+                        latencies.append(elapsed)
+                if response.will_close:
+                    connection.close()
+                    connection = None
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors += 1
+                if connection is not None:
+                    connection.close()
+                connection = None
+        if connection is not None:
+            connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(max(1, concurrency))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return LoadReport(latencies, statuses, time.perf_counter() - start, errors)
+
+def print_load_report(report: LoadReport):
+    codes = ', '.join(f"{status}: {count}" for status, count in sorted(report.statuses.items()))
+    print(f"{report.requests} request trong {report.wall_seconds:.2f}s | {report.requests_per_second:.1f} request/s "
+          f"thành công | mã trả về {codes or '-'}" + (f" | lỗi kết nối {report.errors}" if report.errors else ""))
+    if report.latencies:
+        print(f"Độ trễ: p50 {report.percentile(50) * 1000:.0f} ms | p99 {report.percentile(99) * 1000:.0f} ms | "
+              f"lớn nhất {max(report.latencies) * 1000:.0f} ms")
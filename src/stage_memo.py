@@ -0,0 +1,89 @@
+import os
+import threading
+from typing import Hashable, List, Sequence, Tuple
+
+from PIL import Image
+
+DEFAULT_MEMO_MB = 256
+
+def _param_value(args, name: str):
+    value = getattr(args, name, None)
+    if name.endswith('_path') and value and os.path.isfile(value):
+        # File tham chiếu (LUT...) được sửa thì các bước phía sau phải chạy lại.
+        return value, os.stat(value).st_mtime_ns
+    return value
+
+def image_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+class StageMemo:
+    # Lưu ảnh trung gian sau từng bước của apply_transformations, khóa theo nguồn + tiền tố tham số.
+    # Giới hạn theo dung lượng; khi vượt, bỏ trước mục rẻ nhất để tính lại trên mỗi byte
+    # (GreedyDual-Size: ưu tiên = đồng hồ + chi phí / dung lượng, đồng hồ tăng dần theo mục bị bỏ
+    # nên mục lâu không dùng cũng dần bị bỏ).
+    def __init__(self, max_bytes: int = DEFAULT_MEMO_MB << 20):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: dict = {}
+        self._clock = 0.0
+        self._lock = threading.Lock()
+
+    def stage_keys(self, source_key: Hashable, args, stages: Sequence[Tuple[str, Tuple[str, ...]]]) -> List[tuple]:
+        keys, prefix = [], (source_key,)
+        for name, params in stages:
+            prefix = prefix + ((name, tuple(_param_value(args, p) for p in params)),)
+            keys.append(prefix)
+        return keys
+
+    def resume(self, keys: List[tuple]) -> Tuple[int, tuple | None, float]:
+        # (số bước đã có sẵn, trạng thái sau bước đó, chi phí tính ra nó) với bước sâu nhất còn trong bộ nhớ.
+        with self._lock:
+            for depth in range(len(keys), 0, -1):
+                entry = self._entries.get(keys[depth - 1])
+                if entry is not None:
+                    entry[0] = self._clock + entry[2] / entry[3]
+                    self.hits += 1
+                    return depth, entry[1], entry[2]
+            self.misses += 1
+            return 0, None, 0.0
+
+    def put(self, key: tuple, state: tuple, cost: float) -> bool:
+        size = image_bytes(state[0])
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[3]
+            # [ưu tiên, trạng thái, chi phí tính lại (giây), dung lượng]
+            self._entries[key] = [self._clock + cost / size, state, cost, size]
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                victim = min(self._entries, key=lambda k: self._entries[k][0])
+                priority, _, _, victim_size = self._entries.pop(victim)
+                self._clock = priority
+                self.current_bytes -= victim_size
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self._clock = 0.0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
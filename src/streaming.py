@@ -0,0 +1,304 @@
+import io
+import os
+import time
+import queue
+import threading
+import contextlib
+import contextvars
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, List, Tuple
+
+from . import transformer
+from . import instrument
+from . import pipeline
+from . import renditions
+from . import result_cache
+from .batch import BatchReport, FileResult, collect_cache_stats, _last_error
+
+log = logging.getLogger(__name__)
+
+# Batch dạng dây chuyền: giải mã -> xử lý -> mã hóa chạy đồng thời trên các luồng riêng, nối bằng hàng đợi
+# có giới hạn. Pillow/numpy nhả GIL khi giải mã, mã hóa và trong phần lớn phép xử lý, nên trong lúc một ảnh
+# đang được ghi JPEG thì ảnh sau đã được đọc và xử lý; đọc/ghi đĩa chồng lên phần tính toán.
+STAGES = ('decode', 'process', 'encode')
+DEFAULT_DECODE_WORKERS = 2
+DEFAULT_ENCODE_WORKERS = 2
+# Số ảnh tối đa chờ trong mỗi hàng đợi giữa hai bước: giới hạn số ảnh đã giải mã nằm trong bộ nhớ.
+DEFAULT_QUEUE_SIZE = 4
+# Bước bận hơn mức này được coi là nút thắt của dây chuyền.
+BOTTLENECK_UTILIZATION = 0.8
+
+_DONE = object()
+
+class _Failed:
+    # Lỗi lọt qua _handle (BaseException, vd MemoryError, KeyboardInterrupt trong luồng): gửi tới luồng chính
+    # thay cho kết quả, để nó thôi chờ và ném lại lỗi.
+    __slots__ = ('error',)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    items: int = 0
+    busy_seconds: float = 0.0      # thời gian thực sự xử lý ảnh (cộng mọi worker)
+    cpu_seconds: float = 0.0
+    starved_seconds: float = 0.0   # chờ việc: hàng đợi vào rỗng, bước trước không kịp cung cấp
+    blocked_seconds: float = 0.0   # nghẽn: hàng đợi ra đầy, bước sau không kịp tiêu thụ (back-pressure)
+    queue_capacity: int = 0        # sức chứa hàng đợi vào (0: danh sách file, không giới hạn)
+    queue_peak: int = 0
+    queue_samples: int = 0
+    queue_depth_total: int = 0
+
+    def merge(self, other: 'StageStats'):
+        self.items += other.items
+        self.busy_seconds += other.busy_seconds
+        self.cpu_seconds += other.cpu_seconds
+        self.starved_seconds += other.starved_seconds
+        self.blocked_seconds += other.blocked_seconds
+        self.queue_peak = max(self.queue_peak, other.queue_peak)
+        self.queue_samples += other.queue_samples
+        self.queue_depth_total += other.queue_depth_total
+
+    def utilization(self, wall_seconds: float) -> float:
+        capacity = wall_seconds * self.workers
+        return self.busy_seconds / capacity if capacity > 0 else 0.0
+
+    @property
+    def cpu_share(self) -> float:
+        # CPU / thời gian bận: thấp nghĩa là bước chủ yếu chờ đĩa.
+        return self.cpu_seconds / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+    @property
+    def mean_queue_depth(self) -> float:
+        return self.queue_depth_total / self.queue_samples if self.queue_samples else 0.0
+
+@dataclass
+class StreamReport(BatchReport):
+    stages: List[StageStats] = field(default_factory=list)
+
+    def bottleneck(self) -> StageStats | None:
+        if not self.stages:
+            return None
+        return max(self.stages, key=lambda s: s.utilization(self.wall_seconds))
+
+class _Item:
+    __slots__ = ('input_path', 'output_path', 'args', 'img', 'outputs', 'megapixels', 'start', 'log', 'cache_key')
+
+    def __init__(self, input_path: str, output_path: str):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.args = None
+        self.img = None
+        self.outputs = None            # danh sách renditions.Output khi preset có renditions
+        self.megapixels = 0.0
+        self.start = 0.0
+        self.log = io.StringIO()
+        self.cache_key = None
+
+class StreamingBatch:
+    def __init__(self, preset: dict, decode_workers: int = DEFAULT_DECODE_WORKERS, process_workers: int | None = None,
+                 encode_workers: int = DEFAULT_ENCODE_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 verbose: bool = False, cache_options: dict | None = None):
+        self.preset = preset
+        self.workers = (max(1, decode_workers), max(1, process_workers or os.cpu_count() or 1), max(1, encode_workers))
+        self.queue_size = max(1, queue_size)
+        self.verbose = verbose
+        self.cache = result_cache.get_cache(**cache_options) if cache_options else None
+        self._handlers = (self._decode, self._process, self._encode)
+        # Mỗi luồng worker gom lỗi/cảnh báo vào log của ảnh nó đang xử lý (như process_file).
+        self._log = instrument.LogCapture()
+
+    def run(self, jobs: List[Tuple[str, str]], on_result: Callable[[FileResult], None] | None = None) -> StreamReport:
+        start = time.perf_counter()
+        # Hàng đợi vào của từng bước; bước decode lấy thẳng từ danh sách file.
+        inboxes = [queue.Queue()] + [queue.Queue(maxsize=self.queue_size) for _ in STAGES[1:]]
+        self._results: queue.Queue = queue.Queue()
+        for job in jobs:
+            inboxes[0].put(_Item(*job))
+        for _ in range(self.workers[0]):
+            inboxes[0].put(_DONE)
+
+        stats = [StageStats(name, count, queue_capacity=0 if index == 0 else self.queue_size)
+                 for index, (name, count) in enumerate(zip(STAGES, self.workers))]
+        self._remaining = list(self.workers)
+        self._lock = threading.Lock()
+        self._aborted = threading.Event()
+        results: List[FileResult] = []
+        failure = None
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(instrument.logging_to(self._log))
+            if self.verbose:
+                stack.enter_context(instrument.log_to_console())
+            if jobs:
+                # Dịch preset một lần trước khi các luồng cùng cần tới.
+                pipeline.compiled(transformer.load_preset_dict(self.preset, input_path=jobs[0][0],
+                                                               output_path=jobs[0][1]))
+            threads = []
+            for index, name in enumerate(STAGES):
+                outbox = inboxes[index + 1] if index + 1 < len(STAGES) else None
+                for n in range(self.workers[index]):
+                    # Luồng mới không thừa hưởng contextvars: chép ngữ cảnh để sự kiện instrument tới đúng sink.
+                    context = contextvars.copy_context()
+                    thread = threading.Thread(target=context.run, name=f"{name}-{n}", daemon=True,
+                                              args=(self._worker, index, inboxes[index], outbox, stats[index]))
+                    thread.start()
+                    threads.append(thread)
+            try:
+                for _ in jobs:
+                    result = self._results.get()
+                    if isinstance(result, _Failed):
+                        failure = result.error
+                        break
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+            except BaseException:
+                # vd Ctrl+C lúc đang chờ: các luồng bỏ phần việc còn lại thay vì chạy tiếp sau khi thoát.
+                self._aborted.set()
+                raise
+            for thread in threads:
+                thread.join()
+
+        if failure is not None:
+            raise failure
+        return StreamReport(results=results, wall_seconds=time.perf_counter() - start,
+                            workers=sum(self.workers), stages=stats)
+
+    def _worker(self, index: int, inbox: queue.Queue, outbox: queue.Queue | None, total: StageStats):
+        stats = StageStats(total.name, 1)
+        try:
+            self._work(self._handlers[index], inbox, outbox, stats)
+        except BaseException as e:
+            # Báo cho luồng chính rồi rút hết hàng đợi vào, để các luồng phía trước không bị chặn ở put().
+            self._abort(e)
+            while inbox.get() is not _DONE:
+                pass
+        finally:
+            with self._lock:
+                total.merge(stats)
+                self._remaining[index] -= 1
+                last = self._remaining[index] == 0
+            if last and outbox is not None:
+                for _ in range(self.workers[index + 1]):
+                    outbox.put(_DONE)
+
+    def _work(self, handler, inbox: queue.Queue, outbox: queue.Queue | None, stats: StageStats):
+        while True:
+            waited = time.perf_counter()
+            item = inbox.get()
+            stats.starved_seconds += time.perf_counter() - waited
+            if item is _DONE:
+                return
+            if self._aborted.is_set():
+                # Dây chuyền đã dừng vì lỗi: chỉ rút hàng đợi cho tới _DONE.
+                continue
+            depth = inbox.qsize()
+            stats.queue_peak = max(stats.queue_peak, depth + 1)
+            stats.queue_samples += 1
+            stats.queue_depth_total += depth
+
+            began, cpu = time.perf_counter(), time.thread_time()
+            passed = self._handle(handler, item)
+            stats.busy_seconds += time.perf_counter() - began
+            stats.cpu_seconds += time.thread_time() - cpu
+            stats.items += 1
+            if passed and outbox is not None:
+                waited = time.perf_counter()
+                outbox.put(item)
+                stats.blocked_seconds += time.perf_counter() - waited
+
+    def _abort(self, error: BaseException):
+        # Chỉ lỗi đầu tiên được gửi đi; từ đó mọi luồng bỏ qua ảnh còn lại trong hàng đợi.
+        with self._lock:
+            first = not self._aborted.is_set()
+            self._aborted.set()
+        if first:
+            self._results.put(_Failed(error))
+
+    def _handle(self, handler, item: _Item) -> bool:
+        # True: chuyển ảnh sang bước sau; False: ảnh đã xong (lỗi hoặc lấy từ cache), kết quả đã gửi đi.
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self._log.capture(item.log))
+            stack.enter_context(instrument.source(item.input_path))
+            try:
+                return handler(item)
+            except Exception as e:
+                log.error("LỖI không thể xử lý ảnh: %s", e)
+                item.img = None
+        self._finish(item, False)
+        return False
+
+    def _decode(self, item: _Item) -> bool:
+        item.start = time.perf_counter()
+        item.args = transformer.load_preset_dict(self.preset, input_path=item.input_path, output_path=item.output_path)
+        hit, item.cache_key = result_cache.fetch_cached(self.cache, item.args)
+        if hit:
+            self._finish(item, True)
+            return False
+        img, source_size = transformer.open_image_with_size(item.input_path, item.args)
+        if img is None:
+            self._finish(item, False)
+            return False
+        item.img = img
+        item.megapixels = source_size[0] * source_size[1] / 1_000_000
+        return True
+
+    def _process(self, item: _Item) -> bool:
+        if item.args.renditions:
+            item.outputs = renditions.render(item.img, item.args)
+            item.img = None
+        else:
+            item.img = pipeline.compiled(item.args)(item.img)
+        return True
+
+    def _encode(self, item: _Item) -> bool:
+        if item.outputs is not None:
+            success = renditions.save(item.outputs)
+        else:
+            os.makedirs(os.path.dirname(item.output_path) or '.', exist_ok=True)
+            success = transformer.save_image(item.img, item.output_path, **transformer.save_options(item.args))
+        item.img = None
+        result_cache.store_cached(self.cache, item.cache_key, item.args, success)
+        self._finish(item, success)
+        return False
+
+    def _finish(self, item: _Item, success: bool):
+        self._results.put(FileResult(
+            input_path=item.input_path,
+            output_path=item.output_path,
+            success=success,
+            seconds=time.perf_counter() - item.start,
+            megapixels=item.megapixels,
+            error="" if success else _last_error(item.log.getvalue()),
+            worker_pid=os.getpid(),
+            cache_stats=collect_cache_stats(),
+            outputs=[output.path for output in item.outputs or ()],
+        ))
+        item.outputs = None
+
+def run_stream(jobs: List[Tuple[str, str]], preset: dict, decode_workers: int = DEFAULT_DECODE_WORKERS,
+               process_workers: int | None = None, encode_workers: int = DEFAULT_ENCODE_WORKERS,
+               queue_size: int = DEFAULT_QUEUE_SIZE, verbose: bool = False, on_result=None,
+               cache_options: dict | None = None) -> StreamReport:
+    runner = StreamingBatch(preset, decode_workers, process_workers, encode_workers, queue_size,
+                            verbose, cache_options)
+    return runner.run(jobs, on_result)
+
+def print_stage_stats(report: StreamReport):
+    wall = report.wall_seconds
+    print("Theo bước (bận = thời gian xử lý / (thời gian chạy × số worker)):")
+    for s in report.stages:
+        queue_info = (f"hàng đợi vào {s.mean_queue_depth:.1f}/{s.queue_capacity} (đỉnh {s.queue_peak})"
+                      if s.queue_capacity else "đọc từ danh sách file")
+        print(f"  {s.name:<8} {s.workers:>2} worker | {s.items} ảnh | bận {s.utilization(wall) * 100:5.1f}% "
+              f"(CPU {s.cpu_share * 100:3.0f}%) | chờ việc {s.starved_seconds:6.2f}s | "
+              f"nghẽn đầu ra {s.blocked_seconds:6.2f}s | {queue_info}")
+    bottleneck = report.bottleneck()
+    if bottleneck and bottleneck.utilization(wall) >= BOTTLENECK_UTILIZATION:
+        print(f"Nút thắt: {bottleneck.name} (bận {bottleneck.utilization(wall) * 100:.0f}%), "
+              f"tăng số worker của bước này nếu còn CPU/đĩa rảnh.")
@@ -0,0 +1,717 @@
+import os
+import math
+import mmap
+import zlib
+import struct
+import tempfile
+import threading
+import contextlib
+import logging
+from typing import Callable, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from . import color_lut
+from . import motion_blur
+from . import transformer
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET_MB = 256
+MIN_STRIP_ROWS = 16
+# Số bản sao 4 byte/pixel của một dải cùng tồn tại khi chạy chuỗi bộ lọc (PIL, numpy, bộ đệm OpenCV).
+WORKING_COPIES = 6
+# Bước ghép cuối (viền, bo góc, đổ bóng) tính bằng float32 trên vài mảng RGBA.
+COMPOSE_BYTES_PER_PIXEL = 96
+# Ghi PNG: dải đọc ra, dải đã lọc, bản bytes và bộ đệm nén.
+PNG_BYTES_PER_PIXEL = 24
+
+# rawmode của Pillow -> (số byte mỗi pixel, thứ tự kênh R, G, B).
+RAW_MODES = {
+    'RGB': (3, (0, 1, 2)),
+    'BGR': (3, (2, 1, 0)),
+    'RGBX': (4, (0, 1, 2)),
+    'RGBA': (4, (0, 1, 2)),
+    'BGRX': (4, (2, 1, 0)),
+    'BGRA': (4, (2, 1, 0)),
+    'L': (1, (0, 0, 0)),
+}
+
+# Mode Pillow giải mã thẳng được vào file tạm -> số byte mỗi pixel trong bộ nhớ của Pillow
+# (RGB lưu 4 byte/pixel, 3 byte đầu là R, G, B).
+MAPPED_MODES = {'RGB': 4, 'RGBA': 4, 'RGBX': 4, 'L': 1, 'P': 1}
+# Chu kỳ trả trang nhớ của file tạm trong lúc Pillow giải mã.
+RELEASE_INTERVAL = 0.05
+
+def _release_pages(array: np.memmap, start: int, end: int):
+    # Bỏ các trang đã đọc/ghi khỏi không gian địa chỉ của tiến trình. Dữ liệu vẫn nằm trong
+    # page cache (mapping dùng chung), nên RSS không lớn dần theo kích thước ảnh.
+    mm = getattr(array, '_mmap', None)
+    if mm is None or not hasattr(mm, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+    delta = array.offset % mmap.ALLOCATIONGRANULARITY
+    start = (start + delta) // mmap.PAGESIZE * mmap.PAGESIZE
+    end = min(len(mm), end + delta)
+    if end > start:
+        mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+class ScratchImage:
+    def __init__(self, width: int, height: int, channels: int = 3, scratch_dir: str | None = None):
+        self.size = (width, height)
+        self.channels = channels
+        self._file = tempfile.TemporaryFile(prefix='itp-tile-', dir=scratch_dir)
+        self._file.truncate(max(1, width * height * channels))
+        self.array = np.memmap(self._file, dtype=np.uint8, mode='r+', shape=(height, width, channels))
+        self._row_bytes = width * channels
+
+    def write_rows(self, top: int, rows: np.ndarray):
+        self.array[top:top + len(rows)] = rows
+        _release_pages(self.array, top * self._row_bytes, (top + len(rows)) * self._row_bytes)
+
+    def read_rows(self, top: int, bottom: int, left: int = 0, right: int | None = None) -> np.ndarray:
+        rows = np.array(self.array[top:bottom, left:right, :3])
+        _release_pages(self.array, top * self._row_bytes, bottom * self._row_bytes)
+        return rows
+
+    def read_columns(self, left: int, right: int, chunk_bytes: int = 16 << 20) -> np.ndarray:
+        # Đọc một dải cột phải chạm vào mọi hàng: đọc từng khối hàng và trả trang ngay,
+        # nếu không kernel sẽ map gần như cả file vào RSS.
+        height = self.size[1]
+        columns = np.empty((height, right - left, 3), dtype=np.uint8)
+        step = max(1, chunk_bytes // max(1, self._row_bytes))
+        for top in range(0, height, step):
+            bottom = min(height, top + step)
+            columns[top:bottom] = self.array[top:bottom, left:right, :3]
+            _release_pages(self.array, top * self._row_bytes, bottom * self._row_bytes)
+        return columns
+
+    def release(self):
+        _release_pages(self.array, 0, self.size[1] * self._row_bytes)
+
+    def to_image(self) -> Image.Image:
+        # Ảnh PIL dùng chung bộ nhớ với file tạm (không sao chép), chỉ hỗ trợ 4 kênh.
+        return Image.frombuffer('RGBX', self.size, self.array, 'raw', 'RGBX', 0, 1)
+
+    def close(self):
+        self.array = None
+        self._file.close()
+
+class RawFileSource:
+    # Đọc thẳng pixel từ file không nén (PPM, BMP, TIFF không nén...) qua memmap, không giải mã cả ảnh.
+    def __init__(self, path: str, size: Tuple[int, int], layout: tuple):
+        offset, stride, rawmode, bottom_up = layout
+        self.size = size
+        self._bpp, self._order = RAW_MODES[rawmode]
+        self._bottom_up = bottom_up
+        self._stride = stride
+        self._file = open(path, 'rb')
+        self._map = np.memmap(self._file, dtype=np.uint8, mode='r', offset=offset, shape=(size[1], stride))
+
+    def read_rows(self, top: int, bottom: int, left: int = 0, right: int | None = None) -> np.ndarray:
+        width, height = self.size
+        right = width if right is None else right
+        if self._bottom_up:
+            first, last = height - bottom, height - top
+            rows = self._map[first:last][::-1]
+        else:
+            first, last = top, bottom
+            rows = self._map[first:last]
+        pixels = rows[:, left * self._bpp:right * self._bpp].reshape(bottom - top, right - left, self._bpp)
+        result = np.ascontiguousarray(pixels[:, :, list(self._order)])
+        _release_pages(self._map, first * self._stride, last * self._stride)
+        return result
+
+    def close(self):
+        self._map = None
+        self._file.close()
+
+def _raw_layout(im: Image.Image):
+    tiles = im.tile
+    if not tiles or any(tile[0] != 'raw' for tile in tiles):
+        return None
+    layouts = []
+    for tile in tiles:
+        args = tile[3] if isinstance(tile[3], tuple) else (tile[3],)
+        rawmode, stride, ystep = (tuple(args) + (0, 1))[:3]
+        layouts.append((tile[1], tile[2], rawmode, stride, ystep))
+
+    width, height = im.size
+    _, offset, rawmode, stride, ystep = layouts[0]
+    if rawmode not in RAW_MODES or any(layout[2] != rawmode for layout in layouts):
+        return None
+    stride = stride or width * RAW_MODES[rawmode][0]
+    if ystep == -1 and len(layouts) > 1:
+        return None
+    for extents, tile_offset, _, _, _ in layouts:
+        x0, y0, x1, y1 = extents
+        if x0 != 0 or x1 != width or tile_offset != offset + y0 * stride:
+            return None
+    if layouts[-1][0][3] != height or layouts[0][0][1] != 0:
+        return None
+    return offset, stride, rawmode, ystep == -1
+
+_pixels_lock = threading.Lock()
+_pixels_users = 0
+_pixels_limit = None
+
+@contextlib.contextmanager
+def unbounded_pixels():
+    # Chế độ tile được dùng chính cho ảnh rất lớn: tạm tắt cảnh báo "decompression bomb" khi mở file.
+    # Giới hạn là biến toàn cục của Pillow: đếm số nơi đang dùng dưới khóa để các luồng song song không
+    # khôi phục nhầm giá trị của nhau. Chỉ nên bọc Image.open (kiểm tra nằm ở đó), không bọc cả phần xử lý.
+    global _pixels_users, _pixels_limit
+    with _pixels_lock:
+        if _pixels_users == 0:
+            _pixels_limit = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _pixels_users += 1
+    try:
+        yield
+    finally:
+        with _pixels_lock:
+            _pixels_users -= 1
+            if _pixels_users == 0:
+                Image.MAX_IMAGE_PIXELS = _pixels_limit
+
+def probe_size(input_path: str) -> Tuple[int, int]:
+    # Chỉ đọc header.
+    with unbounded_pixels():
+        with Image.open(input_path) as im:
+            return im.size
+
+def open_source(input_path: str, scratch_dir: str | None = None, budget: int = DEFAULT_MEMORY_BUDGET_MB << 20):
+    with unbounded_pixels():
+        im = Image.open(input_path)
+    layout = _raw_layout(im)
+    if layout is not None:
+        size = im.size
+        im.close()
+        return RawFileSource(input_path, size, layout)
+
+    # Định dạng nén (JPEG, PNG, TIFF nén...): Pillow chỉ giải mã được cả ảnh một lần, nên cho nó
+    # giải mã thẳng vào file tạm thay vì vào bộ nhớ.
+    with im:
+        width, height = im.size
+        rows = max(MIN_STRIP_ROWS, budget // max(1, width * 4 * WORKING_COPIES))
+        channels = MAPPED_MODES.get(im.mode)
+        if channels is None:
+            if width * height * 4 > budget:
+                raise ValueError(f"Ảnh mode {im.mode} phải giải mã cả ảnh trong bộ nhớ "
+                                 f"(~{width * height * 4 >> 20} MB), vượt giới hạn {budget >> 20} MB")
+            im.load()
+            return _copy_strips(im, rows, scratch_dir)
+        decoded = ScratchImage(width, height, channels, scratch_dir)
+        target = Image.core.map_buffer(decoded.array, im.size, 'raw', 0, (im.mode, 0, 1))
+        im.im = target
+        try:
+            _load_releasing(im, decoded)
+        except BaseException:
+            decoded.close()
+            raise
+        if im.im is not target:
+            # Plugin tự tạo ảnh mới khi giải mã (vd GIF ghép khung hình): chép lại theo dải.
+            decoded.close()
+            return _copy_strips(im, rows, scratch_dir)
+        if channels == 4:
+            return decoded
+        # L / P: tra bảng sang RGB theo từng dải.
+        if im.mode == 'P':
+            palette = np.zeros((256, 3), dtype=np.uint8)
+            colors = np.array(im.getpalette('RGB') or [], dtype=np.uint8).reshape(-1, 3)[:256]
+            palette[:len(colors)] = colors
+        else:
+            palette = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+    scratch = ScratchImage(width, height, 3, scratch_dir)
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        scratch.write_rows(top, palette[decoded.read_rows(top, bottom)[..., 0]])
+    decoded.close()
+    return scratch
+
+def _load_releasing(im: Image.Image, scratch: ScratchImage):
+    # im.load() chạy trong C và nhả GIL: một luồng phụ trả dần các trang đã ghi của file tạm,
+    # nên RSS không tăng theo kích thước ảnh trong lúc giải mã.
+    done = threading.Event()
+
+    def release():
+        while not done.wait(RELEASE_INTERVAL):
+            scratch.release()
+
+    thread = threading.Thread(target=release, name='itp-release', daemon=True)
+    thread.start()
+    try:
+        im.load()
+    finally:
+        done.set()
+        thread.join()
+        scratch.release()
+
+def _copy_strips(im: Image.Image, rows: int, scratch_dir: str | None) -> ScratchImage:
+    width, height = im.size
+    scratch = ScratchImage(width, height, 3, scratch_dir)
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        scratch.write_rows(top, np.asarray(im.crop((0, top, width, bottom)).convert('RGB')))
+    return scratch
+
+class GeometryView:
+    # Crop, resize và mirror của apply_transformations, tính theo từng dải hàng của ảnh kết quả.
+    def __init__(self, source, args):
+        self.source = source
+        width, height = source.size
+        ratio = getattr(args, 'crop_ratio', None)
+        crop_width, crop_height = width, height
+        if ratio and ratio != "None":
+            crop_width, crop_height = transformer.crop_size_for_ratio((width, height), ratio)
+        left, top = (width - crop_width) // 2, (height - crop_height) // 2
+        self.box = (left, top, left + crop_width, top + crop_height)
+        self.resize = transformer.parse_resize(args.resize)
+        self.mirror = getattr(args, 'mirror', None)
+        self.size = self.resize or (crop_width, crop_height)
+
+    def pixels_per_row(self) -> float:
+        # Số pixel nguồn phải giữ trong bộ nhớ cho mỗi hàng kết quả.
+        crop_width = self.box[2] - self.box[0]
+        crop_height = self.box[3] - self.box[1]
+        if not self.resize:
+            return crop_width
+        return self.size[0] + crop_width * max(1.0, crop_height / self.size[1])
+
+    def read(self, top: int, bottom: int) -> Image.Image:
+        width, height = self.size
+        left, crop_top, right, crop_bottom = self.box
+        flip_vertical = self.mirror in ("Dọc", "Cả hai")
+        if flip_vertical:
+            top, bottom = height - bottom, height - top
+
+        if self.resize:
+            scale = (crop_bottom - crop_top) / height
+            support = 3 * max(1.0, scale) + 2
+            first = max(0, int(math.floor(top * scale - support)))
+            last = min(crop_bottom - crop_top, int(math.ceil(bottom * scale + support)))
+            strip = Image.fromarray(self.source.read_rows(crop_top + first, crop_top + last, left, right))
+            # `box` cho phép Pillow dùng cả các hàng bên ngoài hộp làm vùng đệm: resize theo dải khớp với resize cả ảnh.
+            img = strip.resize((width, bottom - top), Image.Resampling.LANCZOS,
+                               box=(0, top * scale - first, right - left, bottom * scale - first))
+        else:
+            img = Image.fromarray(self.source.read_rows(crop_top + top, crop_top + bottom, left, right))
+
+        if flip_vertical:
+            img = img.transpose(Image.FLIP_TOP_BOTTOM)
+        if self.mirror in ("Ngang", "Cả hai"):
+            img = img.transpose(Image.FLIP_LEFT_RIGHT)
+        return img
+
+class _Stats:
+    # Histogram chính xác và ảnh thu nhỏ của toàn ảnh, gom dần theo từng dải (cho bước contrast).
+    def __init__(self, width: int, height: int):
+        self.factor = max(1, int((width * height / color_lut.PROXY_PIXELS) ** 0.5))
+        self.histogram = np.zeros(768, dtype=np.int64)
+        proxy_height = -(-height // self.factor)
+        proxy_width = -(-width // self.factor)
+        self._sums = np.zeros((proxy_height, proxy_width, 3), dtype=np.float64)
+        self._counts = np.zeros(proxy_height, dtype=np.float64)
+
+    def add(self, img: Image.Image, top: int):
+        self.histogram += np.asarray(img.histogram()[:768], dtype=np.int64)
+        reduced = img.reduce((self.factor, 1)) if self.factor > 1 else img
+        rows = np.asarray(reduced, dtype=np.float64)
+        index = (top + np.arange(rows.shape[0])) // self.factor
+        np.add.at(self._sums, index, rows)
+        np.add.at(self._counts, index, 1)
+
+    def proxy(self) -> Image.Image:
+        means = self._sums / np.maximum(self._counts, 1)[:, None, None]
+        return Image.fromarray(np.clip(np.rint(means), 0, 255).astype(np.uint8))
+
+def _nearest_map(length: int, small: int, vertical: bool = False) -> np.ndarray:
+    # Để chính Pillow tính ánh xạ NEAREST (thu nhỏ rồi phóng to lại) trên một dải chỉ số.
+    shape = (length, 1) if vertical else (1, length)
+    index = Image.fromarray(np.arange(length, dtype=np.int32).reshape(shape))
+    down = (1, small) if vertical else (small, 1)
+    restored = index.resize(down, Image.Resampling.NEAREST).resize(index.size, Image.Resampling.NEAREST)
+    return np.asarray(restored).reshape(-1).astype(np.intp)
+
+def _pixelate_stage(block: int, width: int, height: int) -> Callable:
+    columns = _nearest_map(width, width // block)
+    rows = _nearest_map(height, height // block, vertical=True)
+
+    def run(img: Image.Image, top: int) -> Image.Image:
+        local = np.clip(rows[top:top + img.height] - top, 0, img.height - 1)
+        return Image.fromarray(np.asarray(img)[local][:, columns])
+    return run
+
+def _oil_halo(radius: int = 4) -> int:
+    return radius + 1
+
+def strip_stages(args, size: Tuple[int, int]) -> list:
+    # Cùng thứ tự và cùng cách gom màu như apply_transformations:
+    # ('color', ops) hoặc ('filter', tên, số hàng đệm, hàm(ảnh, hàng đầu)).
+    stages = []
+    color_ops = []
+
+    def flush():
+        if color_ops:
+            stages.append(('color', list(color_ops)))
+            color_ops.clear()
+
+    if args.brightness is not None and args.brightness != 1.0:
+        color_ops.append(('brightness', args.brightness))
+        log.info("  -> Đã điều chỉnh độ sáng (Factor: %s).", args.brightness)
+    if args.contrast is not None and args.contrast != 1.0:
+        color_ops.append(('contrast', args.contrast))
+        log.info("  -> Đã điều chỉnh độ tương phản (Factor: %s).", args.contrast)
+    if getattr(args, 'saturation', None) is not None and args.saturation != 1.0:
+        color_ops.append(('saturation', args.saturation))
+        log.info("  -> Đã điều chỉnh độ bão hòa (Factor: %s).", args.saturation)
+    if getattr(args, 'temperature', None) is not None and args.temperature != 1.0:
+        color_ops.append(('temperature', args.temperature))
+        log.info("  -> Đã điều chỉnh nhiệt độ màu (Factor: %s).", args.temperature)
+
+    if args.filter == 'Làm mờ':
+        flush()
+        stages.append(('filter', 'filter', 8, lambda img, top: img.filter(ImageFilter.GaussianBlur(radius=2))))
+        log.info("  -> Đã áp dụng Bộ lọc Làm mờ (Gaussian Blur).")
+    elif args.filter == 'Làm nét':
+        flush()
+        stages.append(('filter', 'filter', 2, lambda img, top: img.filter(ImageFilter.SHARPEN)))
+        log.info("  -> Đã áp dụng Bộ lọc Làm nét (Sharpen).")
+
+    artistic = getattr(args, 'artistic_filter', None)
+    if artistic == 'Nâu đỏ':
+        color_ops.append(('sepia',))
+        log.info("  -> Đã áp dụng bộ lọc Sepia.")
+    elif artistic == 'Dập nổi':
+        flush()
+        stages.append(('filter', 'artistic_filter', 2, lambda img, top: transformer.apply_emboss(img)))
+        log.info("  -> Đã áp dụng hiệu ứng Emboss.")
+    elif artistic == 'edge_detection':
+        flush()
+        stages.append(('filter', 'artistic_filter', 2, lambda img, top: transformer.apply_edge_detection(img)))
+        log.info("  -> Đã áp dụng Edge Detection.")
+    elif artistic == 'Cổ điển':
+        color_ops.extend([('sepia',), ('contrast', 0.8), ('brightness', 0.9)])
+        log.info("  -> Đã áp dụng hiệu ứng Vintage.")
+    elif artistic == 'Sơn dầu':
+        flush()
+        stages.append(('filter', 'artistic_filter', _oil_halo(), lambda img, top: transformer.apply_oil_painting(img)))
+        log.info("  -> Đã áp dụng hiệu ứng Oil Painting.")
+
+    if getattr(args, 'motion_blur', False):
+        flush()
+        angle = getattr(args, 'motion_blur_angle', 0)
+        length = getattr(args, 'motion_blur_size', 15)
+        stages.append(('filter', 'motion_blur', motion_blur.halo(length),
+                       lambda img, top: motion_blur.apply_motion_blur(img, length, angle)))
+        log.info("  -> Đã áp dụng Motion Blur (độ dài: %s, góc: %s°).", length, angle)
+
+    if args.grayscale:
+        color_ops.append(('grayscale',))
+        log.info("  -> Đã chuyển ảnh sang đen trắng.")
+    if getattr(args, 'invert', False):
+        color_ops.append(('invert',))
+        log.info("  -> Đã áp dụng Đảo màu (Invert).")
+    lut_path = getattr(args, 'lut_path', None)
+    if lut_path:
+        try:
+            color_ops.append(color_lut.cube_op(lut_path))
+            log.info("  -> Đã áp dụng LUT từ: %s", lut_path)
+        except Exception as e:
+            log.warning("CẢNH BÁO: Không thể đọc file LUT: %s", e)
+    flush()
+
+    block = args.pixelate_size
+    if block and block > 0:
+        width, height = size
+        if width // block > 0 and height // block > 0:
+            stages.append(('filter', 'pixelate', block, _pixelate_stage(block, width, height)))
+            log.info("  -> Đã áp dụng pixel hóa (block size: %s).", block)
+        else:
+            log.warning("CẢNH BÁO: Lỗi pixel hóa: khối %spx lớn hơn ảnh.", block)
+    return stages
+
+def split_passes(stages: list) -> List[list]:
+    # Độ tương phản cần độ sáng trung bình của cả ảnh tại đúng bước đó: nếu trước nó đã có
+    # bộ lọc lân cận trong cùng lượt, phải ghi kết quả ra file tạm và bắt đầu lượt mới.
+    passes: List[list] = [[]]
+    for stage in stages:
+        needs_mean = stage[0] == 'color' and any(op[0] == 'contrast' for op in stage[1])
+        if needs_mean and any(s[0] == 'filter' for s in passes[-1]):
+            passes.append([])
+        passes[-1].append(stage)
+    return passes
+
+def _needs_stats(stages: list) -> bool:
+    return bool(stages) and stages[0][0] == 'color' and any(op[0] == 'contrast' for op in stages[0][1])
+
+def _strip_rows(pixels_per_row: float, halo: int, budget: int, bytes_per_pixel: int = 4 * WORKING_COPIES) -> int:
+    rows = int(budget // max(1.0, pixels_per_row * bytes_per_pixel)) - 2 * halo
+    return max(MIN_STRIP_ROWS, rows)
+
+def _collect_stats(read: Callable, size: Tuple[int, int], rows: int) -> _Stats:
+    stats = _Stats(*size)
+    for top in range(0, size[1], rows):
+        stats.add(read(top, min(size[1], top + rows)), top)
+    return stats
+
+def _run_pass(read: Callable, size: Tuple[int, int], stages: list, stats: _Stats | None,
+              rows: int, collect_stats: bool, scratch_dir: str | None, progress=None) -> Tuple[ScratchImage, _Stats | None]:
+    width, height = size
+    halo = sum(stage[2] for stage in stages if stage[0] == 'filter')
+    compiled = []
+    for stage in stages:
+        if stage[0] == 'color':
+            proxy = stats.proxy() if stats else None
+            histogram = stats.histogram if stats else None
+            compiled.append(('color', color_lut.resolve_ops(proxy, stage[1], histogram=histogram)))
+        else:
+            compiled.append(stage)
+
+    output = ScratchImage(width, height, 3, scratch_dir)
+    next_stats = _Stats(width, height) if collect_stats else None
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        first, last = max(0, top - halo), min(height, bottom + halo)
+        img = read(first, last)
+        for stage in compiled:
+            if stage[0] == 'color':
+                img = color_lut.apply_resolved_ops(img, stage[1])
+            else:
+                img = stage[3](img, first)
+        img = img.crop((0, top - first, width, bottom - first))
+        if next_stats:
+            next_stats.add(img, top)
+        output.write_rows(top, np.asarray(img))
+        if progress:
+            progress(bottom, height)
+    return output, next_stats
+
+def _rotated_rows(middle: ScratchImage, rotate, top: int, bottom: int) -> np.ndarray:
+    width, height = middle.size
+    if rotate == '90':
+        return np.rot90(middle.read_columns(width - bottom, width - top))
+    if rotate == '270':
+        return np.rot90(middle.read_columns(top, bottom), -1)
+    if rotate == '180':
+        return middle.read_rows(height - bottom, height - top)[::-1, ::-1]
+    if rotate == 'Xoay ngang':
+        return middle.read_rows(top, bottom)[:, ::-1]
+    if rotate == 'Xoay dọc':
+        return middle.read_rows(height - bottom, height - top)[::-1]
+    return middle.read_rows(top, bottom)
+
+def _blur_profile(length: int, start: int, span: int, radius: float, vertical: bool = False) -> np.ndarray:
+    # Làm mờ một hình chữ nhật là phép tách được: bóng = tích của hai profile 1D.
+    line = Image.new('L', (1, length) if vertical else (length, 1), 0)
+    line.paste(255, (0, start, 1, start + span) if vertical else (start, 0, start + span, 1))
+    line = line.filter(ImageFilter.GaussianBlur(radius))
+    return np.asarray(line, dtype=np.float32).reshape(-1) / 255.0
+
+def _compose(middle: ScratchImage, args, budget: int, scratch_dir: str | None, progress=None) -> ScratchImage:
+    # Xoay/lật, viền, bo góc, đổ bóng và watermark trên canvas cuối, theo từng dải hàng.
+    rotate = args.rotate
+    middle_width, middle_height = middle.size
+    if rotate in ('90', '270'):
+        inner_width, inner_height = middle_height, middle_width
+    else:
+        inner_width, inner_height = middle_width, middle_height
+    if rotate:
+        log.info("  -> Đã xoay/lật ảnh (%s).", rotate)
+
+    border = max(0, getattr(args, 'border_width', 0) or 0)
+    border_color = transformer.hex_to_rgb(getattr(args, 'border_color', '#000000'))
+    if border:
+        log.info("  -> Đã thêm viền (width: %s, color: %s).", border, getattr(args, 'border_color', '#000000'))
+    image_width, image_height = inner_width + 2 * border, inner_height + 2 * border
+
+    radius = max(0, getattr(args, 'rounded_radius', 0) or 0)
+    if radius:
+        log.info("  -> Đã bo góc (radius: %s).", radius)
+
+    shadow = getattr(args, 'shadow_enabled', False)
+    offset = getattr(args, 'shadow_offset', 10) if shadow else 0
+    canvas_width, canvas_height = image_width + 2 * offset, image_height + 2 * offset
+    if shadow:
+        shadow_rgb = np.array(transformer.hex_to_rgb(getattr(args, 'shadow_color', '#000000')), dtype=np.float32)
+        blur = getattr(args, 'shadow_blur', 10)
+        profile_x = _blur_profile(canvas_width, offset, image_width, blur)
+        profile_y = _blur_profile(canvas_height, offset, image_height, blur, vertical=True)
+        log.info("  -> Đã thêm đổ bóng.")
+
+    sprites = []
+    for stage, sprite, origin, message in transformer.watermark_sprites(args, (canvas_width, canvas_height)):
+        sprites.append((sprite, origin))
+        log.info("%s", message)
+
+    output = ScratchImage(canvas_width, canvas_height, 4, scratch_dir)
+    rows = _strip_rows(canvas_width, 0, budget, COMPOSE_BYTES_PER_PIXEL)
+    for top in range(0, canvas_height, rows):
+        bottom = min(canvas_height, top + rows)
+        count = bottom - top
+        if shadow:
+            coverage = profile_y[top:bottom, None] * profile_x[None, :]
+            rgb = 255.0 + (shadow_rgb - 255.0) * coverage[:, :, None]
+            alpha = 128.0 * coverage
+        else:
+            rgb = np.full((count, canvas_width, 3), 255.0, dtype=np.float32)
+            alpha = np.zeros((count, canvas_width), dtype=np.float32)
+
+        image_top, image_bottom = top, min(bottom, image_height)
+        if image_bottom > image_top:
+            block = np.empty((image_bottom - image_top, image_width, 3), dtype=np.uint8)
+            block[:] = border_color
+            inner_top, inner_bottom = max(image_top, border), min(image_bottom, border + inner_height)
+            if inner_bottom > inner_top:
+                block[inner_top - image_top:inner_bottom - image_top, border:border + inner_width] = \
+                    _rotated_rows(middle, rotate, inner_top - border, inner_bottom - border)
+
+            if radius:
+                mask = Image.new('L', (image_width, image_bottom - image_top), 0)
+                ImageDraw.Draw(mask).rounded_rectangle([(0, -image_top), (image_width, image_height - image_top)],
+                                                       radius=radius, fill=255)
+                weight = np.asarray(mask, dtype=np.float32)[:, :, None] / 255.0
+            else:
+                weight = np.ones((image_bottom - image_top, image_width, 1), dtype=np.float32)
+            region = (slice(0, image_bottom - image_top), slice(0, image_width))
+            rgb[region] = block * weight + rgb[region] * (1 - weight)
+            alpha[region] = 255.0 * weight[:, :, 0] + alpha[region] * (1 - weight[:, :, 0])
+
+        # Làm phẳng lên nền trắng như save_image, rồi ghép watermark.
+        coverage = alpha[:, :, None] / 255.0
+        flat = np.clip(np.rint(rgb * coverage + 255.0 * (1 - coverage)), 0, 255).astype(np.uint8)
+        strip = Image.fromarray(flat)
+        for sprite, (x, y) in sprites:
+            if y < bottom and y + sprite.height > top:
+                transformer.composite_sprite(strip, sprite, (x, y - top))
+        rgbx = np.empty((count, canvas_width, 4), dtype=np.uint8)
+        rgbx[:, :, :3] = np.asarray(strip)
+        rgbx[:, :, 3] = 255
+        output.write_rows(top, rgbx)
+        if progress:
+            progress(bottom, canvas_height)
+    return output
+
+def _png_chunk(f, kind: bytes, data: bytes):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+def write_png(canvas: ScratchImage, output_path: str, rows: int, level: int = 6):
+    # PNG ghi theo dòng (bộ lọc "Up"), không cần giữ cả ảnh trong bộ nhớ.
+    width, height = canvas.size
+    compressor = zlib.compressobj(level)
+    previous = np.zeros(width * 3, dtype=np.uint8)
+    with open(output_path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        for top in range(0, height, rows):
+            bottom = min(height, top + rows)
+            strip = canvas.read_rows(top, bottom).reshape(bottom - top, width * 3)
+            filtered = np.empty((bottom - top, width * 3 + 1), dtype=np.uint8)
+            filtered[:, 0] = 2
+            filtered[0, 1:] = strip[0] - previous
+            filtered[1:, 1:] = strip[1:] - strip[:-1]
+            previous = strip[-1].copy()
+            data = compressor.compress(filtered.tobytes())
+            if data:
+                _png_chunk(f, b'IDAT', data)
+        _png_chunk(f, b'IDAT', compressor.flush())
+        _png_chunk(f, b'IEND', b'')
+
+class _ReleasingWriter:
+    # Không có fileno(): Pillow phải đi qua write() theo từng khối, và mỗi lần ghi ta trả lại
+    # các trang của canvas mà bộ mã hóa JPEG đã đọc (mapping dùng chung nên đọc lại vẫn an toàn).
+    def __init__(self, f, canvas: ScratchImage):
+        self._f = f
+        self._canvas = canvas
+
+    def write(self, data) -> int:
+        self._canvas.release()
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+def save_canvas(canvas: ScratchImage, output_path: str, quality: int, budget: int) -> bool:
+    try:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        ext = os.path.splitext(output_path)[1].lower()
+        if ext in ['.jpg', '.jpeg']:
+            with open(output_path, 'wb') as f:
+                canvas.to_image().save(_ReleasingWriter(f, canvas), 'JPEG', quality=quality)
+        elif ext == '.png':
+            write_png(canvas, output_path, _strip_rows(canvas.size[0], 0, budget, PNG_BYTES_PER_PIXEL))
+        else:
+            # Các định dạng còn lại không ghi được theo dải: cần một bản RGB đầy đủ lúc lưu.
+            transformer.save_image(canvas.to_image().convert('RGB'), output_path, quality=quality)
+            return True
+        log.info("Đã lưu thành công tại: %s", output_path)
+        return True
+    except Exception as e:
+        log.error("LỖI khi lưu file ảnh: %s", e)
+        return False
+
+def transform_tiled(args, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB, scratch_dir: str | None = None,
+                    progress=None) -> bool:
+    budget = int(memory_budget_mb * 1024 * 1024)
+    scratch: list = []
+
+    def report(stage: str):
+        if progress:
+            progress(stage)
+
+    try:
+        report('open')
+        try:
+            source = open_source(args.input_path, scratch_dir, budget)
+        except FileNotFoundError:
+            log.error("LỖI: Không tìm thấy file tại đường dẫn: %s", args.input_path)
+            return False
+        scratch.append(source)
+
+        geometry = GeometryView(source, args)
+        if getattr(args, 'crop_ratio', None) and args.crop_ratio != "None":
+            log.info("  -> Đã crop ảnh theo tỷ lệ %s.", args.crop_ratio)
+        if geometry.resize:
+            log.info("  -> Đã resize/upscale ảnh thành %sx%s.", geometry.size[0], geometry.size[1])
+        elif args.resize:
+            log.error("LỖI: Định dạng resize không hợp lệ. %s", args.resize)
+        if getattr(args, 'mirror', None) and args.mirror != "None":
+            log.info("  -> Đã mirror ảnh (%s).", args.mirror)
+
+        size = geometry.size
+        passes = split_passes(strip_stages(args, size))
+        read, pixels_per_row = geometry.read, geometry.pixels_per_row()
+        stats = None
+        if _needs_stats(passes[0]):
+            report('stats')
+            stats = _collect_stats(read, size, _strip_rows(pixels_per_row, 0, budget))
+
+        middle = None
+        for index, stages in enumerate(passes):
+            report(f'pass {index + 1}/{len(passes)}')
+            halo = sum(stage[2] for stage in stages if stage[0] == 'filter')
+            rows = _strip_rows(pixels_per_row, halo, budget)
+            collect = index + 1 < len(passes) and _needs_stats(passes[index + 1])
+            middle, stats = _run_pass(read, size, stages, stats, rows, collect, scratch_dir)
+            # Lượt sau chỉ đọc kết quả lượt này: đóng file tạm trước đó để không chiếm thêm đĩa.
+            scratch.pop().close()
+            scratch.append(middle)
+            read, pixels_per_row = (lambda a, b, m=middle: Image.fromarray(m.read_rows(a, b))), size[0]
+
+        report('compose')
+        canvas = _compose(middle, args, budget, scratch_dir)
+        scratch.pop().close()
+        scratch.append(canvas)
+        report('save')
+        if getattr(args, 'target_size_kb', None) or getattr(args, 'min_ssim', None):
+            log.info("  -> Chế độ tile ghi file theo dải: bỏ qua mục tiêu dung lượng/SSIM, dùng quality của preset.")
+        return save_canvas(canvas, args.output_path, args.quality, budget)
+    except Exception as e:
+        log.error("LỖI không thể xử lý ảnh: %s", e)
+        return False
+    finally:
+        for item in reversed(scratch):
+            item.close()
@@ -1,71 +1,116 @@
 import os
+import math
+import json
+import functools
+import logging
+import time
 import numpy as np
 from PIL import Image, ImageChops, ImageEnhance, ImageFilter, ImageDraw, ImageFont, ImageOps
-import fitz
 from typing import List, Tuple
+from argparse import Namespace
 from datetime import datetime
 import pytz
 import cv2
-from scipy import ndimage
+from . import color_lut
+from . import fonts
+from . import instrument
+from . import logos
+from . import motion_blur
+from . import pdf_raster
+from . import quality_search
+from . import result_cache
+from . import stage_memo
 
-def open_image(input_path: str) -> Image.Image | None:
+log = logging.getLogger(__name__)
+
+# JPEG giải mã được thẳng ở 1/2, 1/4, 1/8 kích thước (thu nhỏ trong miền DCT). Giữ ảnh giải mã lớn
+# ít nhất gấp đôi kích thước thực dùng để bước LANCZOS còn lại cho chất lượng như khi giải mã đầy đủ.
+DRAFT_REDUCING_GAP = 2.0
+
+def open_image(input_path: str, args=None, preview_size: Tuple[int, int] | None = None) -> Image.Image | None:
+    return open_image_with_size(input_path, args, preview_size)[0]
+
+def open_image_with_size(input_path: str, args=None,
+                         preview_size: Tuple[int, int] | None = None) -> Tuple[Image.Image | None, Tuple[int, int] | None]:
+    # Trả thêm kích thước gốc: khi có args, JPEG có thể được giải mã nhỏ hơn (xem draft_for_output).
     try:
-        img = Image.open(input_path).convert('RGB')
-        return img
+        probe = instrument.begin('open', params={'path': input_path})
+        img = Image.open(input_path)
+        source_size = img.size
+        if args is not None:
+            draft_for_output(img, args, preview_size)
+        if probe:
+            probe.params.update(format=img.format, source_size=source_size)
+        img = img.convert('RGB')
+        instrument.end(probe, img)
+        return img, source_size
     except FileNotFoundError:
-        print(f"LỖI: Không tìm thấy file tại đường dẫn: {input_path}")
-        return None
+        log.error("LỖI: Không tìm thấy file tại đường dẫn: %s", input_path)
+        return None, None
     except Exception as e:
-        print(f"LỖI khi mở file ảnh {input_path}: {e}")
-        return None
+        log.error("LỖI khi mở file ảnh %s: %s", input_path, e)
+        return None, None
 
-def save_image(img: Image.Image, output_path: str, quality: int = 90) -> bool:
+def draft_for_output(img: Image.Image, args, preview_size: Tuple[int, int] | None = None) -> bool:
+    if img.format != 'JPEG':
+        return False
+    scale = decode_scale(img.size, args, preview_size) * DRAFT_REDUCING_GAP
+    if scale >= 1.0:
+        return False
+    width, height = img.size
+    img.draft('RGB', (max(1, math.ceil(width * scale)), max(1, math.ceil(height * scale))))
+    if img.size == (width, height):
+        return False
+    log.info("  -> Giải mã JPEG ở %sx%s thay vì %sx%s.", img.width, img.height, width, height)
+    return True
+
+def save_image(img: Image.Image, output_path: str, quality: int = 90, target_bytes: int | None = None,
+               min_ssim: float | None = None) -> bool:
+    # target_bytes / min_ssim (JPEG, WebP): tìm quality <= `quality` cho file không quá target_bytes
+    # và/hoặc SSIM so với ảnh trước khi mã hóa không dưới min_ssim (xem quality_search).
     try:
+        probe = instrument.begin('save', img, {'path': output_path, 'quality': quality})
         if img.mode == 'RGBA':
-            print("  -> Chuyển đổi ảnh RGBA sang RGB để lưu...")
+            log.info("  -> Chuyển đổi ảnh RGBA sang RGB để lưu...")
             background = Image.new('RGB', img.size, (255, 255, 255))
             background.paste(img, mask=img.split()[3]) 
             img = background
 
         ext = os.path.splitext(output_path)[1].lower()
+        image_format = quality_search.FORMATS.get(ext)
         
-        if ext in ['.jpg', '.jpeg']:
-            img.save(output_path, 'JPEG', quality=quality)
-        elif ext == '.webp':
-            img.save(output_path, 'WEBP', quality=quality)
+        if image_format and (target_bytes or min_ssim):
+            data, choice = quality_search.choose_quality(img, image_format, quality, target_bytes, min_ssim)
+            with open(output_path, 'wb') as f:
+                f.write(data)
+            (log.info if choice.met else log.warning)("%s", choice.describe())
+            if probe:
+                probe.params.update(choice.to_params())
+        elif image_format:
+            img.save(output_path, image_format, quality=quality)
         else:
+            if target_bytes or min_ssim:
+                log.info("  -> Bỏ qua mục tiêu dung lượng/SSIM: định dạng %s không có tham số quality.", ext or '(không rõ)')
             img.save(output_path)
             
-        print(f"Đã lưu thành công tại: {output_path}")
+        if probe:
+            probe.params.setdefault('bytes', os.path.getsize(output_path))
+        instrument.end(probe)
+        log.info("Đã lưu thành công tại: %s", output_path)
         return True
     except Exception as e:
-        print(f"LỖI khi lưu file ảnh: {e}")
+        log.error("LỖI khi lưu file ảnh: %s", e)
         return False
 
-def process_pdf_to_jpg(input_path: str, output_folder: str, dpi: int = 300) -> bool:
+def process_pdf_to_jpg(input_path: str, output_folder: str, dpi: int = 300, progress=None,
+                       pages: str | None = None, workers: int | None = None) -> bool:
     try:
-        pdf_document = fitz.open(input_path)
-        
-        if not os.path.exists(output_folder):
-            os.makedirs(output_folder)
-            
-        zoom = dpi / 72
-        matrix = fitz.Matrix(zoom, zoom)
-
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            pix = page.get_pixmap(matrix=matrix)
-            
-            base_name = os.path.splitext(os.path.basename(input_path))[0]
-            output_file = os.path.join(output_folder, f"{base_name}_page_{page_num+1}.jpg")
-            
-            pix.save(output_file)
-            print(f"  -> Đã tạo: {output_file}")
-            
-        print(f"Đã chuyển đổi PDF ({len(pdf_document)} trang) sang JPG thành công.")
+        results = pdf_raster.rasterize_pdf(input_path, output_folder, dpi, pages=pages, workers=workers,
+                                           progress=progress)
+        log.info("Đã chuyển đổi PDF (%s trang) sang JPG thành công.", len(results))
         return True
     except Exception as e:
-        print(f"LỖI khi xử lý PDF: {e}")
+        log.error("LỖI khi xử lý PDF: %s", e)
         return False
 
 def hex_to_rgb(hex_color: str) -> tuple:
@@ -74,14 +119,35 @@ def hex_to_rgb(hex_color: str) -> tuple:
         return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
     return (255, 255, 255)
 
+# Ma trận sepia cho Image.convert: mỗi hàng (hệ số R, G, B, hằng số). Pillow cộng 0.5 rồi cắt phần lẻ,
+# hằng số -0.5 giữ cách làm tròn xuống như phép nhân ma trận numpy trước đây.
+SEPIA_MATRIX = (0.393, 0.769, 0.189, -0.5,
+                0.349, 0.686, 0.168, -0.5,
+                0.272, 0.534, 0.131, -0.5)
+# Số hàng mỗi dải khi áp bảng màu tại chỗ: bộ nhớ phụ chỉ bằng một dải, không phải cả ảnh.
+STRIP_ROWS = 256
+
 def apply_sepia(img: Image.Image) -> Image.Image:
-    img_array = np.array(img)
-    sepia_filter = np.array([[0.393, 0.769, 0.189],
-                             [0.349, 0.686, 0.168],
-                             [0.272, 0.534, 0.131]])
-    sepia_img = img_array @ sepia_filter.T
-    sepia_img = np.clip(sepia_img, 0, 255).astype(np.uint8)
-    return Image.fromarray(sepia_img)
+    # Tính trong C từng điểm ảnh, ghi thẳng vào ảnh kết quả: không có mảng float trung gian.
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return img.convert('RGB', SEPIA_MATRIX)
+
+def _point_in_strips(img: Image.Image, table: list) -> Image.Image:
+    # Áp bảng tra cứu lên `img` (ảnh do chính hàm gọi tạo ra) theo từng dải hàng, ghi đè tại chỗ.
+    for top in range(0, img.height, STRIP_ROWS):
+        box = (0, top, img.width, min(img.height, top + STRIP_ROWS))
+        img.paste(img.crop(box).point(table), box[:2])
+    return img
+
+def _mean_luma(img: Image.Image) -> int:
+    # Như ImageEnhance.Contrast (độ sáng trung bình của ảnh L), nhưng cộng histogram theo dải.
+    histogram = [0] * 256
+    for top in range(0, img.height, STRIP_ROWS):
+        strip = img.crop((0, top, img.width, min(img.height, top + STRIP_ROWS))).convert('L')
+        histogram = [a + b for a, b in zip(histogram, strip.histogram())]
+    count = sum(histogram)
+    return int(sum(i * n for i, n in enumerate(histogram)) / count + 0.5) if count else 0
 
 def apply_emboss(img: Image.Image) -> Image.Image:
     return img.filter(ImageFilter.EMBOSS)
@@ -90,12 +156,14 @@ def apply_edge_detection(img: Image.Image) -> Image.Image:
     return img.filter(ImageFilter.FIND_EDGES)
 
 def apply_vintage(img: Image.Image) -> Image.Image:
+    # Contrast(0.8) rồi Brightness(0.9) đều là phép trộn theo từng điểm ảnh khi đã biết độ sáng trung bình:
+    # chạy đúng hai phép trộn đó trên một dải 0..255 để có bảng tra cứu, rồi áp bảng tại chỗ.
     img = apply_sepia(img)
-    enhancer = ImageEnhance.Contrast(img)
-    img = enhancer.enhance(0.8)
-    enhancer = ImageEnhance.Brightness(img)
-    img = enhancer.enhance(0.9)
-    return img
+    mean = _mean_luma(img)
+    ramp = Image.merge('RGB', [Image.frombytes('L', (256, 1), bytes(range(256)))] * 3)
+    ramp = Image.blend(Image.new('RGB', ramp.size, (mean, mean, mean)), ramp, 0.8)
+    ramp = Image.blend(Image.new('RGB', ramp.size, 0), ramp, 0.9)
+    return _point_in_strips(img, list(ramp.tobytes()[0::3]) * 3)
 
 def apply_oil_painting(img: Image.Image, radius: int = 4) -> Image.Image:
     try:
@@ -111,27 +179,25 @@ def adjust_saturation(img: Image.Image, factor: float) -> Image.Image:
     enhancer = ImageEnhance.Color(img)
     return enhancer.enhance(factor)
 
+def _scale_table(factor: float) -> list:
+    # Giá trị 0..255 nhân hệ số theo float32 rồi cắt xuống, đúng như phép tính trên mảng float32 trước đây.
+    return np.clip(np.arange(256, dtype=np.float32) * np.float32(factor), 0, 255).astype(np.uint8).tolist()
+
 def adjust_temperature(img: Image.Image, factor: float) -> Image.Image:
-    img_array = np.array(img).astype(np.float32)
-    if factor > 1.0:  
-        img_array[:, :, 0] = np.clip(img_array[:, :, 0] * factor, 0, 255)
-        img_array[:, :, 1] = np.clip(img_array[:, :, 1] * (1 + (factor - 1) * 0.5), 0, 255)
-    else: 
-        img_array[:, :, 2] = np.clip(img_array[:, :, 2] * (2 - factor), 0, 255)
-    return Image.fromarray(img_array.astype(np.uint8))
+    # Mỗi kênh chỉ phụ thuộc chính nó: một bảng tra cứu 8 bit cho mỗi kênh, không cần bản sao float32.
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGB')
+    identity = list(range(256))
+    if factor > 1.0:
+        channels = [_scale_table(factor), _scale_table(1 + (factor - 1) * 0.5), identity]
+    else:
+        channels = [identity, identity, _scale_table(2 - factor)]
+    if img.mode == 'RGBA':
+        channels.append(identity)
+    return img.point([value for table in channels for value in table])
 
 def apply_motion_blur(img: Image.Image, size: int = 15, angle: int = 0) -> Image.Image:
-    img_array = np.array(img)
-    
-    kernel = np.zeros((size, size))
-    kernel[int((size - 1) / 2), :] = np.ones(size)
-    kernel = kernel / size
-    kernel = ndimage.rotate(kernel, angle, reshape=False)
-    blurred = np.zeros_like(img_array)
-    for i in range(3):
-        blurred[:, :, i] = ndimage.convolve(img_array[:, :, i], kernel)
-    
-    return Image.fromarray(blurred.astype(np.uint8))
+    return motion_blur.apply_motion_blur(img, size=size, angle=angle)
 
 def add_border(img: Image.Image, border_width: int, border_color: str) -> Image.Image:
     color = hex_to_rgb(border_color)
@@ -195,34 +261,69 @@ def mirror_image(img: Image.Image, direction: str) -> Image.Image:
         return img.transpose(Image.FLIP_TOP_BOTTOM)
     return img
 
+def prepare_for_overlay(img: Image.Image) -> Image.Image:
+    # Chỉ giữ RGBA khi ảnh thật sự có độ trong suốt; ảnh thường ở lại RGB.
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+    return img.convert('RGBA' if has_alpha else 'RGB')
+
+def composite_sprite(img: Image.Image, sprite: Image.Image, origin: Tuple[int, int]) -> Image.Image:
+    # Ghép sprite RGBA vào đúng vùng nó phủ lên, sửa trực tiếp trên `img`.
+    left, top = origin
+    box = (max(0, left), max(0, top),
+           min(img.width, left + sprite.width), min(img.height, top + sprite.height))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return img
+    if box != (left, top, left + sprite.width, top + sprite.height):
+        sprite = sprite.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+    if img.mode == 'RGBA':
+        img.paste(Image.alpha_composite(img.crop(box), sprite), box[:2])
+    else:
+        img.paste(sprite, box[:2], mask=sprite)
+    return img
+
+def _text_sprite_box(x: int, y: int, text_bbox: tuple, rotation: int = 0,
+                     center: Tuple[int, int] | None = None, margin: int = 3) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    # Lề `margin` chứa đủ viền (±1) và bóng (+2); khi xoay, lấy hình vuông bao trọn đường tròn quanh tâm xoay.
+    left, top = x + text_bbox[0] - margin, y + text_bbox[1] - margin
+    right, bottom = x + text_bbox[2] + margin, y + text_bbox[3] + margin
+    if rotation:
+        cx, cy = center
+        r = math.ceil(max(math.hypot(px - cx, py - cy) for px in (left, right) for py in (top, bottom)))
+        left, top, right, bottom = cx - r, cy - r, cx + r, cy + r
+    return (left, top), (right - left, bottom - top)
+
+def _measure_text(text: str, font, font_size: int) -> tuple:
+    draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+    try:
+        return draw.textbbox((0, 0), text, font=font)
+    except AttributeError:
+        return (0, 0, int(draw.textlength(text, font=font)), font_size)
+
 def create_text_watermark(img: Image.Image, text: str, opacity: float, position: str, 
                          font_size: int, font_name: str = "arial.ttf", 
                          text_color_hex: str = "#FFFFFF", rotation: int = 0,
                          shadow: bool = False, outline: bool = False) -> Image.Image:
-    img_rgba = img.convert("RGBA") if img.mode != 'RGBA' else img.copy() 
-    text_layer = Image.new('RGBA', img.size, (255, 255, 255, 0))
-    draw = ImageDraw.Draw(text_layer)
-    
-    try:
-        font = ImageFont.truetype(font_name, size=font_size)
-    except IOError:
-        try:
-            font = ImageFont.truetype("arial.ttf", size=font_size)
-        except IOError:
-            font = ImageFont.load_default()
+    img = prepare_for_overlay(img)
+    sprite, origin = text_watermark_sprite(img.size, text, opacity, position, font_size, font_name,
+                                           text_color_hex, rotation, shadow, outline)
+    return composite_sprite(img, sprite, origin)
+
+def text_watermark_sprite(size: Tuple[int, int], text: str, opacity: float, position: str,
+                          font_size: int, font_name: str = "arial.ttf",
+                          text_color_hex: str = "#FFFFFF", rotation: int = 0,
+                          shadow: bool = False, outline: bool = False) -> Tuple[Image.Image, Tuple[int, int]]:
+    font = fonts.get_font(font_name, font_size)
     
     rgb_color = hex_to_rgb(text_color_hex)
     text_color = (*rgb_color, int(opacity * 255))
     
-    try:
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-    except AttributeError:
-        text_width = int(draw.textlength(text, font=font))
-        text_height = font_size
+    text_bbox = _measure_text(text, font, font_size)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
     
-    img_width, img_height = img_rgba.size
+    img_width, img_height = size
     padding = 10
     
     if position == 'tl':
@@ -238,45 +339,60 @@ def create_text_watermark(img: Image.Image, text: str, opacity: float, position:
     else:
         x, y = padding, padding
     
+    center = (x + text_width // 2, y + text_height // 2)
+    origin, sprite_size = _text_sprite_box(x, y, text_bbox, rotation, center)
+    text_layer = Image.new('RGBA', sprite_size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(text_layer)
+    tx, ty = x - origin[0], y - origin[1]
+    
     if shadow:
         shadow_color = (0, 0, 0, int(opacity * 128))
-        draw.text((x + 2, y + 2), text, font=font, fill=shadow_color)
+        draw.text((tx + 2, ty + 2), text, font=font, fill=shadow_color)
     
     if outline:
         outline_color = (0, 0, 0, int(opacity * 255))
         for adj_x in [-1, 0, 1]:
             for adj_y in [-1, 0, 1]:
                 if adj_x != 0 or adj_y != 0:
-                    draw.text((x + adj_x, y + adj_y), text, font=font, fill=outline_color)
-    draw.text((x, y), text, font=font, fill=text_color)
+                    draw.text((tx + adj_x, ty + adj_y), text, font=font, fill=outline_color)
+    draw.text((tx, ty), text, font=font, fill=text_color)
     
     if rotation != 0:
-        text_layer = text_layer.rotate(rotation, expand=False, center=(x + text_width // 2, y + text_height // 2))
-    img_rgba = Image.alpha_composite(img_rgba, text_layer)
-    return img_rgba
+        text_layer = text_layer.rotate(rotation, expand=False, center=(center[0] - origin[0], center[1] - origin[1]))
+    return text_layer, origin
+
+def timestamp_moment(timezone: str, at: str | datetime | None = None) -> Tuple[datetime, str]:
+    # at: thời điểm cố định (ISO, giờ theo múi giờ đã chọn) thay cho datetime.now; cho kết quả lặp lại được.
+    if isinstance(at, str):
+        at = datetime.fromisoformat(at)
+    try:
+        tz = pytz.timezone(timezone)
+        if at is None:
+            now = datetime.now(tz)
+        elif at.tzinfo is None:
+            now = tz.localize(at)
+        else:
+            now = at.astimezone(tz)
+        return now, now.strftime('%Z')
+    except Exception:
+        return (at or datetime.now()), "LOCAL"
 
 def create_timestamp_watermark(img: Image.Image, opacity: float, position: str, 
                               font_size: int, font_name: str = "arial.ttf", 
                               text_color_hex: str = "#FFFFFF",
-                              timezone: str = "Asia/Ho_Chi_Minh") -> Image.Image:
-    img_rgba = img.convert("RGBA") if img.mode != 'RGBA' else img.copy() 
-    draw = ImageDraw.Draw(img_rgba)
-    
-    try:
-        font = ImageFont.truetype(font_name, size=font_size)
-    except IOError:
-        try:
-            font = ImageFont.truetype("arial.ttf", size=font_size)
-        except IOError:
-            font = ImageFont.load_default()
-    
-    try:
-        tz = pytz.timezone(timezone)
-        now = datetime.now(tz)
-        tz_abbr = now.strftime('%Z')
-    except:
-        now = datetime.now()
-        tz_abbr = "LOCAL"
+                              timezone: str = "Asia/Ho_Chi_Minh", at: str | datetime | None = None) -> Image.Image:
+    img = prepare_for_overlay(img)
+    sprite, origin = timestamp_watermark_sprite(img.size, opacity, position, font_size, font_name,
+                                                text_color_hex, timezone, at)
+    return composite_sprite(img, sprite, origin)
+
+def timestamp_watermark_sprite(size: Tuple[int, int], opacity: float, position: str,
+                               font_size: int, font_name: str = "arial.ttf",
+                               text_color_hex: str = "#FFFFFF",
+                               timezone: str = "Asia/Ho_Chi_Minh",
+                               at: str | datetime | None = None) -> Tuple[Image.Image, Tuple[int, int]]:
+    font = fonts.get_font(font_name, font_size)
+    now, tz_abbr = timestamp_moment(timezone, at)
     
     date_str = now.strftime('%d/%m/%Y')
     time_str = now.strftime('%H:%M:%S')
@@ -284,15 +400,11 @@ def create_timestamp_watermark(img: Image.Image, opacity: float, position: str,
     
     rgb_color = hex_to_rgb(text_color_hex)
     text_color = (*rgb_color, int(opacity * 255))
-    img_width, img_height = img_rgba.size
+    img_width, img_height = size
     
-    try:
-        text_bbox = draw.textbbox((0, 0), timestamp_text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-    except AttributeError:
-        text_width = int(draw.textlength(timestamp_text, font=font))
-        text_height = font_size
+    text_bbox = _measure_text(timestamp_text, font, font_size)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
     
     padding = 10
     
@@ -309,243 +421,544 @@ def create_timestamp_watermark(img: Image.Image, opacity: float, position: str,
     else:
         x, y = padding, padding
     
-    draw.text((x, y), timestamp_text, font=font, fill=text_color)
-    return img_rgba
+    origin, sprite_size = _text_sprite_box(x, y, text_bbox)
+    text_layer = Image.new('RGBA', sprite_size, (255, 255, 255, 0))
+    ImageDraw.Draw(text_layer).text((x - origin[0], y - origin[1]), timestamp_text, font=font, fill=text_color)
+    return text_layer, origin
+
+def logo_watermark_sprite(size: Tuple[int, int], logo_path: str, size_percent: float, opacity: float,
+                          position: str) -> Tuple[Image.Image, Tuple[int, int]]:
+    img_width, img_height = size
+    target_width = None
+    if size_percent and size_percent > 0:
+        target_width = int(img_width * (size_percent / 100))
+
+    watermark_img = logos.get_logo(logo_path, target_width, opacity)
+    wm_width, wm_height = watermark_img.size
+    padding = 10
+    x, y = 0, 0
+    
+    if position == 'tl':
+        x = padding
+        y = padding
+    elif position == 'tr':
+        x = img_width - wm_width - padding
+        y = padding
+    elif position == 'bl':
+        x = padding
+        y = img_height - wm_height - padding
+    elif position == 'br':
+        x = img_width - wm_width - padding
+        y = img_height - wm_height - padding
+    elif position == 'c':
+        x = (img_width - wm_width) // 2
+        y = (img_height - wm_height) // 2
+    return watermark_img, (x, y)
+
+def watermark_sprites(args, size: Tuple[int, int]):
+    # Sinh lần lượt (stage, sprite, vị trí, thông báo) cho chữ, logo và timestamp theo đúng thứ tự ghép.
+    if args.watermark_text and args.watermark_text != "":
+        sprite, origin = text_watermark_sprite(
+            size,
+            args.watermark_text,
+            args.watermark_opacity,
+            args.watermark_position,
+            args.watermark_font_size,
+            getattr(args, 'watermark_font', 'arial.ttf'),
+            text_color_hex=getattr(args, 'watermark_text_color', '#FFFFFF'),
+            rotation=getattr(args, 'watermark_rotation', 0),
+            shadow=getattr(args, 'watermark_shadow', False),
+            outline=getattr(args, 'watermark_outline', False)
+        )
+        yield 'text_watermark', sprite, origin, f"  -> Đã thêm chữ Watermark: '{args.watermark_text}' tại vị trí {args.watermark_position.upper()}."
+    
+    if args.watermark_image_path and os.path.exists(args.watermark_image_path):
+        try:
+            sprite, origin = logo_watermark_sprite(size, args.watermark_image_path, args.watermark_image_size,
+                                                   args.watermark_opacity, args.watermark_position)
+        except Exception as e:
+            log.warning("CẢNH BÁO: Không thể thêm ảnh Watermark: %s", e)
+        else:
+            message = f"  -> Đã thêm ảnh Watermark từ: {args.watermark_image_path} tại vị trí {args.watermark_position.upper()}."
+            if args.watermark_image_size and args.watermark_image_size > 0:
+                message = (f"  -> Đổi kích cỡ ảnh Watermark thành {sprite.width}x{sprite.height} "
+                           f"({args.watermark_image_size}% chiều rộng).\n" + message)
+            yield 'image_watermark', sprite, origin, message
+    
+    if hasattr(args, 'timestamp_enabled') and args.timestamp_enabled:
+        position = getattr(args, 'timestamp_position', 'br')
+        sprite, origin = timestamp_watermark_sprite(
+            size,
+            getattr(args, 'timestamp_opacity', 0.7),
+            position,
+            getattr(args, 'timestamp_font_size', 30),
+            getattr(args, 'timestamp_font', 'arial.ttf'),
+            text_color_hex=getattr(args, 'timestamp_text_color', '#FFFFFF'),
+            timezone=getattr(args, 'timestamp_timezone', 'Asia/Ho_Chi_Minh'),
+            at=getattr(args, 'timestamp_fixed', None)
+        )
+        yield 'timestamp', sprite, origin, f"  -> Đã thêm Timestamp tại vị trí {position.upper()}."
+
+def _report(progress, stage: str):
+    if progress:
+        progress(stage)
 
-def apply_transformations(img: Image.Image, args) -> Image.Image:
+# Mỗi bước nhận và trả (ảnh, các phép màu đang chờ): các bước màu theo từng điểm ảnh được gom lại
+# và áp dụng cùng lúc (color_lut) ngay trước bước cần đến điểm ảnh thật. Không bước nào sửa ảnh đầu vào tại chỗ.
+def _stage_geometry(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if hasattr(args, 'crop_ratio') and args.crop_ratio and args.crop_ratio != "None":
+        _report(progress, 'crop')
         img = crop_to_aspect_ratio(img, args.crop_ratio)
-        print(f"  -> Đã crop ảnh theo tỷ lệ {args.crop_ratio}.")
+        log.info("  -> Đã crop ảnh theo tỷ lệ %s.", args.crop_ratio)
     
     if args.resize:
+        _report(progress, 'resize')
         try:
             width, height = map(int, args.resize.lower().split('x'))
             img = img.resize((width, height), Image.Resampling.LANCZOS)
-            print(f"  -> Đã resize/upscale ảnh thành {width}x{height}.")
+            log.info("  -> Đã resize/upscale ảnh thành %sx%s.", width, height)
         except Exception as e:
-            print(f"LỖI: Định dạng resize không hợp lệ. {e}")
+            log.error("LỖI: Định dạng resize không hợp lệ. %s", e)
     
     if hasattr(args, 'mirror') and args.mirror and args.mirror != "None":
         img = mirror_image(img, args.mirror)
-        print(f"  -> Đã mirror ảnh ({args.mirror}).")
-    
+        log.info("  -> Đã mirror ảnh (%s).", args.mirror)
+    return img, color_ops
+
+def _stage_filter(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if args.brightness is not None and args.brightness != 1.0:
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(args.brightness)
-        print(f"  -> Đã điều chỉnh độ sáng (Factor: {args.brightness}).")
+        color_ops.append(('brightness', args.brightness))
+        log.info("  -> Đã điều chỉnh độ sáng (Factor: %s).", args.brightness)
 
     if args.contrast is not None and args.contrast != 1.0:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(args.contrast)
-        print(f"  -> Đã điều chỉnh độ tương phản (Factor: {args.contrast}).")
+        color_ops.append(('contrast', args.contrast))
+        log.info("  -> Đã điều chỉnh độ tương phản (Factor: %s).", args.contrast)
     
     if hasattr(args, 'saturation') and args.saturation is not None and args.saturation != 1.0:
-        img = adjust_saturation(img, args.saturation)
-        print(f"  -> Đã điều chỉnh độ bão hòa (Factor: {args.saturation}).")
+        color_ops.append(('saturation', args.saturation))
+        log.info("  -> Đã điều chỉnh độ bão hòa (Factor: %s).", args.saturation)
     
     if hasattr(args, 'temperature') and args.temperature is not None and args.temperature != 1.0:
-        img = adjust_temperature(img, args.temperature)
-        print(f"  -> Đã điều chỉnh nhiệt độ màu (Factor: {args.temperature}).")
+        color_ops.append(('temperature', args.temperature))
+        log.info("  -> Đã điều chỉnh nhiệt độ màu (Factor: %s).", args.temperature)
 
     if args.filter == 'Làm mờ':
+        _report(progress, 'filter')
+        img = color_lut.apply_color_ops(img, color_ops)
+        color_ops = []
         img = img.filter(ImageFilter.GaussianBlur(radius=2))
-        print("  -> Đã áp dụng Bộ lọc Làm mờ (Gaussian Blur).")
+        log.info("  -> Đã áp dụng Bộ lọc Làm mờ (Gaussian Blur).")
     elif args.filter == 'Làm nét':
+        _report(progress, 'filter')
+        img = color_lut.apply_color_ops(img, color_ops)
+        color_ops = []
         img = img.filter(ImageFilter.SHARPEN)
-        print("  -> Đã áp dụng Bộ lọc Làm nét (Sharpen).")
-    
+        log.info("  -> Đã áp dụng Bộ lọc Làm nét (Sharpen).")
+    return img, color_ops
+
+def _stage_artistic_filter(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if hasattr(args, 'artistic_filter') and args.artistic_filter and args.artistic_filter != "Không":
+        _report(progress, 'artistic_filter')
         if args.artistic_filter == 'Nâu đỏ':
-            img = apply_sepia(img)
-            print("  -> Đã áp dụng bộ lọc Sepia.")
+            color_ops.append(('sepia',))
+            log.info("  -> Đã áp dụng bộ lọc Sepia.")
         elif args.artistic_filter == 'Dập nổi':
+            img = color_lut.apply_color_ops(img, color_ops)
+            color_ops = []
             img = apply_emboss(img)
-            print("  -> Đã áp dụng hiệu ứng Emboss.")
+            log.info("  -> Đã áp dụng hiệu ứng Emboss.")
         elif args.artistic_filter == 'edge_detection':
+            img = color_lut.apply_color_ops(img, color_ops)
+            color_ops = []
             img = apply_edge_detection(img)
-            print("  -> Đã áp dụng Edge Detection.")
+            log.info("  -> Đã áp dụng Edge Detection.")
         elif args.artistic_filter == 'Cổ điển':
-            img = apply_vintage(img)
-            print("  -> Đã áp dụng hiệu ứng Vintage.")
+            color_ops.extend([('sepia',), ('contrast', 0.8), ('brightness', 0.9)])
+            log.info("  -> Đã áp dụng hiệu ứng Vintage.")
         elif args.artistic_filter == 'Sơn dầu':
+            img = color_lut.apply_color_ops(img, color_ops)
+            color_ops = []
             img = apply_oil_painting(img)
-            print("  -> Đã áp dụng hiệu ứng Oil Painting.")
-    
+            log.info("  -> Đã áp dụng hiệu ứng Oil Painting.")
+    return img, color_ops
+
+def _stage_motion_blur(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if hasattr(args, 'motion_blur') and args.motion_blur:
+        _report(progress, 'motion_blur')
+        img = color_lut.apply_color_ops(img, color_ops)
+        color_ops = []
         angle = getattr(args, 'motion_blur_angle', 0)
-        img = apply_motion_blur(img, size=15, angle=angle)
-        print(f"  -> Đã áp dụng Motion Blur (góc: {angle}°).")
+        size = getattr(args, 'motion_blur_size', 15)
+        img = apply_motion_blur(img, size=size, angle=angle)
+        log.info("  -> Đã áp dụng Motion Blur (độ dài: %s, góc: %s°).", size, angle)
+    return img, color_ops
 
+def _stage_color(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if args.grayscale:
-        img = img.convert('L').convert('RGB')
-        print("  -> Đã chuyển ảnh sang đen trắng.")
+        color_ops.append(('grayscale',))
+        log.info("  -> Đã chuyển ảnh sang đen trắng.")
 
     if hasattr(args, 'invert') and args.invert:
-        img = ImageChops.invert(img)
-        print("  -> Đã áp dụng Đảo màu (Invert).")
+        color_ops.append(('invert',))
+        log.info("  -> Đã áp dụng Đảo màu (Invert).")
+
+    lut_path = getattr(args, 'lut_path', None)
+    if lut_path:
+        try:
+            color_ops.append(color_lut.cube_op(lut_path))
+            log.info("  -> Đã áp dụng LUT từ: %s", lut_path)
+        except Exception as e:
+            log.warning("CẢNH BÁO: Không thể đọc file LUT: %s", e)
+
+    if color_ops:
+        _report(progress, 'color')
+    return color_lut.apply_color_ops(img, color_ops), []
 
+def _stage_pixelate(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if args.pixelate_size and args.pixelate_size > 0:
+        _report(progress, 'pixelate')
         try:
             size = img.size
             small_size = (size[0] // args.pixelate_size, size[1] // args.pixelate_size)
             img = img.resize(small_size, Image.Resampling.NEAREST)
             img = img.resize(size, Image.Resampling.NEAREST)
-            print(f"  -> Đã áp dụng pixel hóa (block size: {args.pixelate_size}).")
+            log.info("  -> Đã áp dụng pixel hóa (block size: %s).", args.pixelate_size)
         except Exception as e:
-            print(f"CẢNH BÁO: Lỗi pixel hóa: {e}")
+            log.warning("CẢNH BÁO: Lỗi pixel hóa: %s", e)
+    return img, color_ops
 
+def _stage_rotate(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if args.rotate:
+        _report(progress, 'rotate')
         if args.rotate == '90':
             img = img.transpose(Image.ROTATE_90)
-            print("  -> Đã xoay ảnh 90 độ.")
+            log.info("  -> Đã xoay ảnh 90 độ.")
         elif args.rotate == '180':
             img = img.transpose(Image.ROTATE_180)
-            print("  -> Đã xoay ảnh 180 độ.")
+            log.info("  -> Đã xoay ảnh 180 độ.")
         elif args.rotate == '270':
             img = img.transpose(Image.ROTATE_270)
-            print("  -> Đã xoay ảnh 270 độ.")
+            log.info("  -> Đã xoay ảnh 270 độ.")
         elif args.rotate == 'Xoay ngang':
             img = img.transpose(Image.FLIP_LEFT_RIGHT)
-            print("  -> Đã lật ảnh theo chiều ngang.")
+            log.info("  -> Đã lật ảnh theo chiều ngang.")
         elif args.rotate == 'Xoay dọc':
             img = img.transpose(Image.FLIP_TOP_BOTTOM)
-            print("  -> Đã lật ảnh theo chiều dọc.")
-    
+            log.info("  -> Đã lật ảnh theo chiều dọc.")
+    return img, color_ops
+
+def _stage_frame(img: Image.Image, color_ops: list, args, progress) -> Tuple[Image.Image, list]:
     if hasattr(args, 'border_width') and args.border_width > 0:
+        _report(progress, 'border')
         border_color = getattr(args, 'border_color', '#000000')
         img = add_border(img, args.border_width, border_color)
-        print(f"  -> Đã thêm viền (width: {args.border_width}, color: {border_color}).")
+        log.info("  -> Đã thêm viền (width: %s, color: %s).", args.border_width, border_color)
     
     if hasattr(args, 'rounded_radius') and args.rounded_radius > 0:
+        _report(progress, 'rounded_corners')
         img = add_rounded_corners(img, args.rounded_radius)
-        print(f"  -> Đã bo góc (radius: {args.rounded_radius}).")
+        log.info("  -> Đã bo góc (radius: %s).", args.rounded_radius)
     
     if hasattr(args, 'shadow_enabled') and args.shadow_enabled:
+        _report(progress, 'shadow')
         offset = getattr(args, 'shadow_offset', 10)
         blur = getattr(args, 'shadow_blur', 10)
         color = getattr(args, 'shadow_color', '#000000')
         img = add_shadow(img, offset, blur, color)
-        print(f"  -> Đã thêm đổ bóng.")
-    
-    if args.watermark_text and args.watermark_text != "":
-        font_name = getattr(args, 'watermark_font', 'arial.ttf')
-        text_color = getattr(args, 'watermark_text_color', '#FFFFFF')
-        rotation = getattr(args, 'watermark_rotation', 0)
-        shadow = getattr(args, 'watermark_shadow', False)
-        outline = getattr(args, 'watermark_outline', False)
-        
-        img = create_text_watermark(
-            img, 
-            args.watermark_text, 
-            args.watermark_opacity, 
-            args.watermark_position, 
-            args.watermark_font_size,
-            font_name,
-            text_color_hex=text_color,
-            rotation=rotation,
-            shadow=shadow,
-            outline=outline
-        )
-        print(f"  -> Đã thêm chữ Watermark: '{args.watermark_text}' tại vị trí {args.watermark_position.upper()}.")
-    
-    if args.watermark_image_path and os.path.exists(args.watermark_image_path):
-        try:
-            watermark_img = Image.open(args.watermark_image_path).convert("RGBA")
-            
-            if img.mode != 'RGBA':
-                 img = img.convert("RGBA")
+        log.info("  -> Đã thêm đổ bóng.")
+    return img, color_ops
 
-            img_width, img_height = img.size
-            wm_width, wm_height = watermark_img.size
-            
-            if args.watermark_image_size and args.watermark_image_size > 0:
-                new_width = int(img_width * (args.watermark_image_size / 100))
-                
-                if wm_width > 0:
-                    w_percent = (new_width / float(wm_width))
-                    new_height = int((float(wm_height) * float(w_percent)))
-                    watermark_img = watermark_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    wm_width, wm_height = watermark_img.size
-                    print(f"  -> Đổi kích cỡ ảnh Watermark thành {wm_width}x{wm_height} ({args.watermark_image_size}% chiều rộng).")
-            
-            if args.watermark_opacity < 1.0:
-                 alpha = watermark_img.getchannel('A')
-                 alpha = ImageEnhance.Brightness(alpha).enhance(args.watermark_opacity)
-                 watermark_img.putalpha(alpha)
-
-            position = args.watermark_position
-            padding = 10
-            x, y = 0, 0
-            
-            if position == 'tl':
-                x = padding
-                y = padding
-            elif position == 'tr':
-                x = img_width - wm_width - padding
-                y = padding
-            elif position == 'bl':
-                x = padding
-                y = img_height - wm_height - padding
-            elif position == 'br':
-                x = img_width - wm_width - padding
-                y = img_height - wm_height - padding
-            elif position == 'c':
-                x = (img_width - wm_width) // 2
-                y = (img_height - wm_height) // 2
-
-            img.paste(watermark_img, (x, y), mask=watermark_img) 
-            print(f"  -> Đã thêm ảnh Watermark từ: {args.watermark_image_path} tại vị trí {position.upper()}.")
-            
-        except Exception as e:
-            print(f"CẢNH BÁO: Không thể thêm ảnh Watermark: {e}")
-    
-    if hasattr(args, 'timestamp_enabled') and args.timestamp_enabled:
-        font_name = getattr(args, 'timestamp_font', 'arial.ttf')
-        text_color = getattr(args, 'timestamp_text_color', '#FFFFFF')
-        font_size = getattr(args, 'timestamp_font_size', 30)
-        opacity = getattr(args, 'timestamp_opacity', 0.7)
-        position = getattr(args, 'timestamp_position', 'br')
-        timezone = getattr(args, 'timestamp_timezone', 'Asia/Ho_Chi_Minh')
-        
-        img = create_timestamp_watermark(
-            img,
-            opacity,
-            position,
-            font_size,
-            font_name,
-            text_color_hex=text_color,
-            timezone=timezone
-        )
-        print(f"  -> Đã thêm Timestamp tại vị trí {position.upper()}.")
+# (tên bước, các tham số quyết định kết quả của bước, hàm): thứ tự chính là thứ tự xử lý.
+# Khóa lưu tạm của một bước gồm tham số của nó và của mọi bước trước nó.
+PIPELINE_STAGES = (
+    ('geometry', ('crop_ratio', 'resize', 'mirror'), _stage_geometry),
+    ('filter', ('brightness', 'contrast', 'saturation', 'temperature', 'filter'), _stage_filter),
+    ('artistic_filter', ('artistic_filter',), _stage_artistic_filter),
+    ('motion_blur', ('motion_blur', 'motion_blur_angle', 'motion_blur_size'), _stage_motion_blur),
+    ('color', ('grayscale', 'invert', 'lut_path'), _stage_color),
+    ('pixelate', ('pixelate_size',), _stage_pixelate),
+    ('rotate', ('rotate',), _stage_rotate),
+    ('frame', ('border_width', 'border_color', 'rounded_radius',
+               'shadow_enabled', 'shadow_offset', 'shadow_blur', 'shadow_color'), _stage_frame),
+)
+
+def apply_transformations(img: Image.Image, args, progress=None, memo: stage_memo.StageMemo | None = None,
+                          source_key=None) -> Image.Image:
+    return render_stages(lambda: img, args, progress, memo, source_key)
+
+def render_stages(load, args, progress=None, memo: stage_memo.StageMemo | None = None, source_key=None):
+    # load() chỉ được gọi khi không có bước nào lưu sẵn trong memo (source_key định danh ảnh nguồn).
+    keys = None
+    if memo is not None and source_key is not None:
+        keys = memo.stage_keys(source_key, args, [(name, params) for name, params, _ in PIPELINE_STAGES])
+    start, state, base_cost = memo.resume(keys) if keys else (0, None, 0.0)
+    started = time.perf_counter()
+    if state is None:
+        img = load()
+        if img is None:
+            return None
+        state = (img, [])
+        base_cost = time.perf_counter() - started
+    else:
+        img, pending = state
+        state = (img, list(pending))
+        log.info("  -> Dùng lại kết quả đã lưu tới bước '%s'.", PIPELINE_STAGES[start - 1][0])
+    # Ảnh đang được người gọi hoặc memo giữ thì không được vẽ đè lên.
+    shared = state[0]
+
+    for index in range(start, len(PIPELINE_STAGES)):
+        name, params, stage = PIPELINE_STAGES[index]
+        before = state
+        probe = instrument.begin(name, state[0], {p: getattr(args, p, None) for p in params}) if instrument.enabled() else None
+        state = stage(state[0], list(state[1]), args, progress)
+        changed = state[0] is not before[0] or state[1] != before[1]
+        if changed:
+            instrument.end(probe, state[0])
+        if keys and changed:
+            if memo.put(keys[index], (state[0], tuple(state[1])), base_cost + time.perf_counter() - started):
+                shared = state[0]
+    img = state[0]
+
+    # Các bước watermark vẽ trực tiếp lên ảnh, nên không được đụng vào ảnh gốc của người gọi.
+    for stage, sprite, origin, message in watermark_sprites(args, img.size):
+        _report(progress, stage)
+        probe = instrument.begin(stage, img, {'origin': origin, 'sprite_size': sprite.size})
+        if img is shared:
+            img = img.copy()
+        img = composite_sprite(prepare_for_overlay(img), sprite, origin)
+        instrument.end(probe, img)
+        log.info("%s", message)
     
     return img
 
-def get_processed_image(args) -> Image.Image | None:
+def collect_color_ops(args) -> list:
+    ops = []
+    if args.brightness is not None and args.brightness != 1.0:
+        ops.append(('brightness', args.brightness))
+    if args.contrast is not None and args.contrast != 1.0:
+        ops.append(('contrast', args.contrast))
+    if getattr(args, 'saturation', None) is not None and args.saturation != 1.0:
+        ops.append(('saturation', args.saturation))
+    if getattr(args, 'temperature', None) is not None and args.temperature != 1.0:
+        ops.append(('temperature', args.temperature))
+    artistic = getattr(args, 'artistic_filter', None)
+    if artistic == 'Nâu đỏ':
+        ops.append(('sepia',))
+    elif artistic == 'Cổ điển':
+        ops.extend([('sepia',), ('contrast', 0.8), ('brightness', 0.9)])
+    if args.grayscale:
+        ops.append(('grayscale',))
+    if getattr(args, 'invert', False):
+        ops.append(('invert',))
+    return ops
+
+def export_color_lut(args, cube_path: str, reference: Image.Image | None = None,
+                     size: int = color_lut.LUT_SIZE) -> bool:
+    # Độ tương phản phụ thuộc độ sáng trung bình: không có ảnh mẫu thì dùng ảnh xám trung tính.
+    if reference is None:
+        reference = Image.new('RGB', (1, 1), (128, 128, 128))
+    try:
+        ops = color_lut.resolve_ops(reference, collect_color_ops(args))
+        lut = color_lut.compile_lut(ops, size)
+    except Exception as e:
+        log.error("LỖI khi biên dịch LUT: %s", e)
+        return False
+    return color_lut.save_cube(lut, cube_path)
+
+PREVIEW_SCALED_ARGS = ('border_width', 'rounded_radius', 'shadow_offset', 'shadow_blur',
+                       'watermark_font_size', 'timestamp_font_size', 'pixelate_size', 'motion_blur_size')
+# Kích thước tính bằng pixel mà watermark_sprites đọc (cỡ ảnh logo là % chiều rộng, không cần đổi).
+WATERMARK_SCALED_ARGS = ('watermark_font_size', 'timestamp_font_size')
+
+def parse_resize(value) -> Tuple[int, int] | None:
+    if not value:
+        return None
+    try:
+        width, height = map(int, str(value).lower().split('x'))
+        return (width, height) if width > 0 and height > 0 else None
+    except ValueError:
+        return None
+
+def crop_size_for_ratio(size: Tuple[int, int], ratio: str) -> Tuple[int, int]:
+    ratios = {"1:1": 1.0, "16:9": 16/9, "4:3": 4/3, "9:16": 9/16, "3:4": 3/4}
+    width, height = size
+    if ratio not in ratios:
+        return width, height
+    if width / height > ratios[ratio]:
+        return int(height * ratios[ratio]), height
+    return width, int(width / ratios[ratio])
+
+def estimate_output_size(size: Tuple[int, int], args) -> Tuple[int, int]:
+    width, height = parse_resize(args.resize) or crop_size_for_ratio(size, getattr(args, 'crop_ratio', None))
+    if args.rotate in ('90', '270'):
+        width, height = height, width
+    extra = 2 * max(0, getattr(args, 'border_width', 0) or 0)
+    if getattr(args, 'shadow_enabled', False):
+        extra += 2 * max(0, getattr(args, 'shadow_offset', 10) or 0)
+    return width + extra, height + extra
+
+def scale_size_args(args, scale: float, names: Tuple[str, ...] = PREVIEW_SCALED_ARGS) -> Namespace:
+    scaled = Namespace(**vars(args))
+    for name in names:
+        value = getattr(args, name, None)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+            setattr(scaled, name, max(1, int(round(value * scale))))
+    return scaled
+
+def _preview_scales(size: Tuple[int, int], args, preview_size: Tuple[int, int]):
+    # (tỷ lệ đầu ra, tỷ lệ ảnh nguồn, kích thước resize mới hoặc None)
+    out_width, out_height = estimate_output_size(size, args)
+    scale = min(1.0, preview_size[0] / out_width, preview_size[1] / out_height)
+    if scale >= 1.0:
+        return 1.0, 1.0, None
+    resize = parse_resize(args.resize)
+    if not resize:
+        return scale, scale, None
+    target = (max(1, round(resize[0] * scale)), max(1, round(resize[1] * scale)))
+    crop_width, crop_height = crop_size_for_ratio(size, getattr(args, 'crop_ratio', None))
+    return scale, min(1.0, max(target[0] / crop_width, target[1] / crop_height)), target
+
+def decode_scale(size: Tuple[int, int], args, preview_size: Tuple[int, int] | None = None) -> float:
+    # Tỷ lệ nhỏ nhất của ảnh nguồn mà kết quả vẫn không đổi: mọi bước trước resize đều không phụ thuộc
+    # độ phân giải, mọi bước sau resize tính theo kích thước đầu ra.
+    if preview_size:
+        return _preview_scales(size, args, preview_size)[1]
+    resize = parse_resize(args.resize)
+    if not resize:
+        return 1.0
+    crop_width, crop_height = crop_size_for_ratio(size, getattr(args, 'crop_ratio', None))
+    return min(1.0, max(resize[0] / crop_width, resize[1] / crop_height))
+
+def preview_plan(source_size: Tuple[int, int], args,
+                 preview_size: Tuple[int, int]) -> Tuple[Tuple[int, int], Namespace, float]:
+    # (kích thước ảnh proxy, tham số đã thu nhỏ theo proxy, tỷ lệ đầu ra): chỉ cần kích thước ảnh gốc.
+    scale, source_scale, target = _preview_scales(source_size, args, preview_size)
+    if scale >= 1.0:
+        return source_size, args, 1.0
+
+    if target:
+        # Sau bước resize mọi tham số đều tính theo kích thước đầu ra, nên thu nhỏ cùng tỷ lệ.
+        args = scale_size_args(args, scale)
+        args.resize = f"{target[0]}x{target[1]}"
+
+    proxy_size = (max(1, round(source_size[0] * source_scale)), max(1, round(source_size[1] * source_scale)))
+    if not target:
+        args = scale_size_args(args, proxy_size[0] / source_size[0])
+    return proxy_size, args, scale
+
+def make_preview_proxy(img: Image.Image, args, preview_size: Tuple[int, int],
+                       source_size: Tuple[int, int] | None = None) -> Tuple[Image.Image, Namespace]:
+    # source_size: kích thước gốc khi img đã được giải mã thu nhỏ (JPEG draft).
+    source_size = source_size or img.size
+    proxy_size, args, scale = preview_plan(source_size, args, preview_size)
+    if proxy_size == img.size:
+        if scale < 1.0:
+            log.info("  -> Xem trước trên ảnh proxy %sx%s (tỷ lệ %.2f).", img.width, img.height, scale)
+        return img, args
+
+    proxy = img.resize(proxy_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    log.info("  -> Xem trước trên ảnh proxy %sx%s (tỷ lệ %.2f).", proxy.width, proxy.height, scale)
+    return proxy, args
+
+def open_pdf_page(args) -> Image.Image | None:
+    # Trang đầu tiên được chọn, dựng thẳng từ pixmap trong bộ nhớ.
+    try:
+        for _, img in pdf_raster.iter_pages(args.input_path, args.pdf_dpi, args.pdf_pages):
+            return img
+    except Exception as e:
+        log.error("LỖI khi mở file PDF %s: %s", args.input_path, e)
+    return None
+
+def pdf_output_extension(output_path: str) -> str:
+    ext = os.path.splitext(output_path)[1].lower()
+    return '.jpg' if ext in ('', '.pdf') else ext
+
+def save_options(args) -> dict:
+    # Tham số lưu file của một preset/args (thiết lập cũ không có mục tiêu dung lượng/SSIM).
+    target_kb = getattr(args, 'target_size_kb', None)
+    return {'quality': args.quality,
+            'target_bytes': int(target_kb * 1024) if target_kb else None,
+            'min_ssim': getattr(args, 'min_ssim', None) or None}
+
+def transform_pdf(args, progress=None, workers: int | None = None) -> bool:
+    # Mỗi trang PDF đi thẳng qua apply_transformations/save_image, không qua file JPG trung gian.
+    # Đầu ra: <tên file đầu ra>_page_<n><đuôi> trong thư mục của output_path.
+    try:
+        _report(progress, 'open')
+        results = pdf_raster.rasterize_pdf(
+            args.input_path, os.path.dirname(args.output_path) or '.', args.pdf_dpi, pages=args.pdf_pages,
+            workers=workers,
+            progress=lambda done, total: _report(progress, f"PDF {done}/{total}"),
+            transform=functools.partial(apply_transformations, args=args),
+            save=functools.partial(save_image, **save_options(args)),
+            output_name=args.output_path, extension=pdf_output_extension(args.output_path))
+        log.info("Đã xử lý PDF (%s trang) thành công.", len(results))
+        return True
+    except Exception as e:
+        log.error("LỖI khi xử lý PDF: %s", e)
+        return False
+
+def get_processed_image(args, preview_size: Tuple[int, int] | None = None, progress=None,
+                        memo: stage_memo.StageMemo | None = None) -> Image.Image | None:
+    # memo: giữ ảnh trung gian giữa các lần xem trước; chỉnh watermark không phải mở/resize/lọc lại ảnh.
     if args.command == 'pdf2jpg':
-        print("LỖI: Không thể xem trước file PDF.")
+        log.error("LỖI: Không thể xem trước file PDF.")
         return None
     
-    img = open_image(args.input_path)
+    if memo is not None and not pdf_raster.is_pdf(args.input_path):
+        try:
+            stat = os.stat(args.input_path)
+            with Image.open(args.input_path) as header:
+                source_size = header.size
+        except Exception as e:
+            log.error("LỖI khi mở file ảnh %s: %s", args.input_path, e)
+            return None
+        proxy_size, stage_args = (preview_plan(source_size, args, preview_size)[:2] if preview_size
+                                  else (source_size, args))
+        source_key = (os.path.abspath(args.input_path), stat.st_size, stat.st_mtime_ns, proxy_size)
+
+        def load():
+            img, size = open_image_with_size(args.input_path, args, preview_size)
+            if img is not None and preview_size:
+                img, _ = make_preview_proxy(img, args, preview_size, size)
+            return img
+        return render_stages(load, stage_args, progress, memo, source_key)
+
+    if pdf_raster.is_pdf(args.input_path):
+        img = open_pdf_page(with_pdf_defaults(args))
+        source_size = img.size if img else None
+    else:
+        img, source_size = open_image_with_size(args.input_path, args, preview_size)
     if not img:
         return None
     
-    img = apply_transformations(img, args)
+    if preview_size:
+        img, args = make_preview_proxy(img, args, preview_size, source_size)
+    
+    img = apply_transformations(img, args, progress)
     
     return img
 
-def transform_image(args) -> bool:
+def transform_image(args, progress=None, cache: result_cache.ResultCache | None = None) -> bool:
     if args.command == 'pdf2jpg':
-        return process_pdf_to_jpg(args.input_path, args.output_folder, args.dpi)
+        return process_pdf_to_jpg(args.input_path, args.output_folder, args.dpi,
+                                  pages=getattr(args, 'pages', None), workers=getattr(args, 'workers', None))
+    if pdf_raster.is_pdf(args.input_path):
+        return transform_pdf(with_pdf_defaults(args), progress)
 
-    try:
-        img = open_image(args.input_path)
+    def run() -> bool:
+        _report(progress, 'open')
+        img = open_image(args.input_path, args)
         if not img:
             return False
-        img = apply_transformations(img, args)
-        return save_image(img, args.output_path, quality=args.quality)
-        
+        img = apply_transformations(img, args, progress)
+        _report(progress, 'save')
+        return save_image(img, args.output_path, **save_options(args))
+
+    try:
+        return result_cache.run_cached(cache, args, run)
     except Exception as e:
-        print(f"LỖI không thể xử lý ảnh: {e}")
+        log.error("LỖI không thể xử lý ảnh: %s", e)
         return False
 
 def get_image_info(img_path: str) -> dict:
@@ -575,3 +988,94 @@ def get_image_info(img_path: str) -> dict:
         return {'error': str(e)}
 
 
+
+
+DEFAULT_PRESET = {
+    'command': 'process',
+    'resize': None,
+    'quality': 90,
+    'target_size_kb': None,
+    'min_ssim': None,
+    'renditions': None,
+    'brightness': 1.0,
+    'contrast': 1.0,
+    'saturation': 1.0,
+    'temperature': 1.0,
+    'lut_path': "",
+    'artistic_filter': "Không",
+    'filter': None,
+    'motion_blur': False,
+    'motion_blur_angle': 0,
+    'motion_blur_size': 15,
+    'grayscale': False,
+    'invert': False,
+    'pixelate_size': None,
+    'crop_ratio': "Không",
+    'rotate': None,
+    'mirror': "Không",
+    'border_width': 0,
+    'border_color': "#000000",
+    'rounded_radius': 0,
+    'shadow_enabled': False,
+    'shadow_offset': 10,
+    'shadow_blur': 10,
+    'shadow_color': "#000000",
+    'watermark_text': "",
+    'watermark_font_size': 40,
+    'watermark_opacity': 0.5,
+    'watermark_position': 'br',
+    'watermark_font': 'arial.ttf',
+    'watermark_text_color': "#FFFFFF",
+    'watermark_rotation': 0,
+    'watermark_shadow': False,
+    'watermark_outline': False,
+    'watermark_image_path': "",
+    'watermark_image_size': 15,
+    'timestamp_enabled': False,
+    'timestamp_font_size': 30,
+    'timestamp_position': 'bl',
+    'timestamp_text_color': "#FFFFFF",
+    'timestamp_timezone': 'Asia/Ho_Chi_Minh',
+    'timestamp_font': 'arial.ttf',
+    'timestamp_opacity': 0.7,
+    'timestamp_fixed': None,
+    'pdf_dpi': 300,
+    'pdf_pages': None,
+}
+
+PRESET_EXCLUDED_KEYS = ('input_path', 'output_path', 'output_folder')
+
+def save_preset(args, preset_path: str) -> bool:
+    try:
+        preset = {k: v for k, v in vars(args).items() if k not in PRESET_EXCLUDED_KEYS}
+        with open(preset_path, 'w', encoding='utf-8') as f:
+            json.dump(preset, f, ensure_ascii=False, indent=2)
+        log.info("Đã lưu preset tại: %s", preset_path)
+        return True
+    except Exception as e:
+        log.error("LỖI khi lưu preset: %s", e)
+        return False
+
+def read_preset(preset_path: str) -> dict:
+    with open(preset_path, 'r', encoding='utf-8') as f:
+        preset = json.load(f)
+    if not isinstance(preset, dict):
+        raise ValueError(f"Preset không hợp lệ: {preset_path}")
+    return preset
+
+def with_pdf_defaults(args) -> Namespace:
+    # Thiết lập cũ/giao diện không có các khóa PDF: bổ sung giá trị mặc định.
+    args = Namespace(**vars(args))
+    for key in ('pdf_dpi', 'pdf_pages'):
+        if getattr(args, key, None) is None:
+            setattr(args, key, DEFAULT_PRESET[key])
+    return args
+
+def load_preset_dict(preset: dict, **overrides) -> Namespace:
+    values = dict(DEFAULT_PRESET)
+    values.update({k: v for k, v in preset.items() if k not in PRESET_EXCLUDED_KEYS})
+    values.update(overrides)
+    return Namespace(**values)
+
+def load_preset(preset_path: str, **overrides) -> Namespace:
+    return load_preset_dict(read_preset(preset_path), **overrides)
@@ -0,0 +1,55 @@
+import math
+from typing import List, Tuple
+
+from PIL import Image
+
+class ImagePyramid:
+    def __init__(self, img: Image.Image, min_size: int = 64):
+        self.levels: List[Image.Image] = [img]
+        while min(self.levels[-1].size) // 2 >= min_size:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.levels[0].size
+
+    def level_for_zoom(self, zoom: float) -> Tuple[Image.Image, float]:
+        # Chọn tầng nhỏ nhất vẫn còn đủ chi tiết cho mức zoom hiện tại.
+        base_width = self.levels[0].width
+        for level in reversed(self.levels):
+            scale = level.width / base_width
+            if scale >= zoom:
+                return level, scale
+        return self.levels[0], 1.0
+
+    def render(self, zoom: float, offset: Tuple[float, float], canvas_size: Tuple[int, int],
+               resample=Image.Resampling.LANCZOS) -> Tuple[Image.Image | None, Tuple[int, int]]:
+        width, height = self.size
+        offset_x, offset_y = offset
+        canvas_width, canvas_height = canvas_size
+
+        left = max(0, math.floor(offset_x))
+        top = max(0, math.floor(offset_y))
+        right = min(canvas_width, math.ceil(offset_x + width * zoom))
+        bottom = min(canvas_height, math.ceil(offset_y + height * zoom))
+        if right <= left or bottom <= top:
+            return None, (0, 0)
+
+        level, scale = self.level_for_zoom(zoom)
+        factor = scale / zoom
+        box = (
+            max(0.0, (left - offset_x) * factor),
+            max(0.0, (top - offset_y) * factor),
+            min(float(level.width), (right - offset_x) * factor),
+            min(float(level.height), (bottom - offset_y) * factor),
+        )
+        return level.resize((right - left, bottom - top), resample, box=box), (left, top)
+
+def centered_offset(image_size: Tuple[int, int], zoom: float, canvas_size: Tuple[int, int]) -> Tuple[float, float]:
+    return ((canvas_size[0] - image_size[0] * zoom) / 2, (canvas_size[1] - image_size[1] * zoom) / 2)
+
+def zoom_about(offset: Tuple[float, float], old_zoom: float, new_zoom: float,
+               anchor: Tuple[float, float]) -> Tuple[float, float]:
+    # Giữ nguyên điểm ảnh nằm dưới `anchor` (tọa độ canvas) khi đổi mức zoom.
+    ratio = new_zoom / old_zoom
+    return (anchor[0] - (anchor[0] - offset[0]) * ratio, anchor[1] - (anchor[1] - offset[1]) * ratio)
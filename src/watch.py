@@ -0,0 +1,425 @@
+import os
+import sys
+import time
+import errno
+import signal
+import select
+import shutil
+import struct
+import ctypes
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, List, Set, Tuple
+
+from . import transformer
+from . import batch
+from . import instrument
+from . import pipeline
+
+# Chế độ thư mục nóng: chạy liên tục, xử lý ngay file mới được thả vào thư mục theo dõi.
+# Linux dùng inotify (qua libc, không cần thư viện ngoài); nơi khác, hoặc thư mục mạng (SMB/NFS:
+# inotify không thấy file do máy khác ghi), quét định kỳ. File chỉ được xử lý khi kích thước và mtime
+# đứng yên đủ lâu, rồi chuyển vào thư mục done/ hoặc failed/.
+WATCH_EXTENSIONS = batch.IMAGE_EXTENSIONS + ('.pdf',)
+# Đuôi file tạm của các trình sao chép/tải: chờ tới khi được đổi tên thành tên thật.
+TEMP_SUFFIXES = ('.tmp', '.part', '.partial', '.crdownload', '.filepart', '.download')
+DEFAULT_SETTLE_SECONDS = 0.3
+DEFAULT_POLL_INTERVAL = 0.5
+# File rỗng thường là file đang được tạo: chỉ coi là xong khi rỗng quá lâu.
+EMPTY_FILE_SECONDS = 10.0
+TICK_SECONDS = 0.05
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct('iIII')
+
+def is_candidate(path: str) -> bool:
+    name = os.path.basename(path)
+    if name.startswith(('.', '~')) or name.lower().endswith(TEMP_SUFFIXES):
+        return False
+    return os.path.splitext(name)[1].lower() in WATCH_EXTENSIONS
+
+def _is_excluded(path: str, excluded: Iterable[str]) -> bool:
+    path = os.path.abspath(path)
+    return any(path == e or path.startswith(e + os.sep) for e in excluded)
+
+def _walk(root: str, recursive: bool, excluded: Iterable[str]) -> Tuple[List[str], List[str]]:
+    # (các thư mục, các file ứng viên) dưới root, bỏ qua thư mục done/failed/đầu ra.
+    directories, files = [], []
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        if _is_excluded(directory, excluded):
+            continue
+        directories.append(directory)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            stack.append(entry.path)
+                    elif entry.is_file() and is_candidate(entry.path):
+                        files.append(entry.path)
+        except OSError as e:
+            print(f"CẢNH BÁO: Không đọc được thư mục {directory}: {e}")
+    return directories, files
+
+class PollWatcher:
+    kind = 'quét định kỳ'
+
+    def __init__(self, roots: List[str], recursive: bool, excluded: List[str],
+                 interval: float = DEFAULT_POLL_INTERVAL):
+        self.roots = roots
+        self.recursive = recursive
+        self.excluded = excluded
+        self.interval = interval
+        self._snapshot: Dict[str, tuple] = {}
+        self._next_scan = 0.0
+
+    def changes(self, timeout: float) -> Set[str]:
+        # File mới hoặc đã đổi (kích thước, mtime) kể từ lần quét trước; lần đầu trả mọi file có sẵn.
+        wait = self._next_scan - time.monotonic()
+        if wait > 0:
+            time.sleep(min(timeout, wait))
+            if time.monotonic() < self._next_scan:
+                return set()
+        self._next_scan = time.monotonic() + self.interval
+        snapshot, changed = {}, set()
+        for root in self.roots:
+            for path in _walk(root, self.recursive, self.excluded)[1]:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                signature = snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+                if self._snapshot.get(path) != signature:
+                    changed.add(path)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+class InotifyWatcher:
+    kind = 'inotify'
+
+    def __init__(self, roots: List[str], recursive: bool, excluded: List[str]):
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify không có trên hệ điều hành này")
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 thất bại")
+        self.roots = roots
+        self.recursive = recursive
+        self.excluded = excluded
+        self._directories: Dict[int, str] = {}
+        # File có sẵn (và file xuất hiện trước khi kịp theo dõi thư mục con mới) trả ở lần gọi kế tiếp.
+        self._backlog: Set[str] = set()
+        for root in roots:
+            self._add_tree(root)
+
+    def _add_tree(self, root: str):
+        directories, files = _walk(root, self.recursive, self.excluded)
+        for directory in directories:
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                # Thường là vượt fs.inotify.max_user_watches.
+                print(f"CẢNH BÁO: Không theo dõi được {directory}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._directories[wd] = directory
+        self._backlog.update(files)
+
+    def _read(self) -> bytes:
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def changes(self, timeout: float) -> Set[str]:
+        found, self._backlog = self._backlog, set()
+        ready, _, _ = select.select([self._fd], [], [], 0 if found else timeout)
+        if not ready:
+            return found
+        data = self._read()
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Hàng đợi sự kiện của kernel bị tràn: quét lại toàn bộ.
+                for root in self.roots:
+                    found.update(_walk(root, self.recursive, self.excluded)[1])
+                continue
+            directory = self._directories.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._directories[wd]
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if self.recursive and mask & (IN_CREATE | IN_MOVED_TO) and not _is_excluded(path, self.excluded):
+                    self._add_tree(path)
+                continue
+            if is_candidate(path):
+                found.add(path)
+        found |= self._backlog
+        self._backlog = set()
+        return found
+
+    def close(self):
+        os.close(self._fd)
+
+def open_watcher(roots: List[str], recursive: bool, excluded: List[str], poll: bool = False,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL):
+    if not poll:
+        try:
+            return InotifyWatcher(roots, recursive, excluded)
+        except OSError as e:
+            if sys.platform.startswith('linux'):
+                print(f"CẢNH BÁO: Không dùng được inotify ({e}), chuyển sang quét định kỳ.")
+    return PollWatcher(roots, recursive, excluded, poll_interval)
+
+class SettleTracker:
+    # Chỉ trả file khi kích thước và mtime không đổi trong `settle` giây (file đã chép xong).
+    def __init__(self, settle: float = DEFAULT_SETTLE_SECONDS):
+        self.settle = settle
+        self._pending: Dict[str, list] = {}   # đường dẫn -> [(size, mtime), lần đổi cuối, lần thấy đầu tiên]
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def touch(self, path: str, now: float):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        signature = (stat.st_size, stat.st_mtime_ns)
+        entry = self._pending.get(path)
+        if entry is None:
+            self._pending[path] = [signature, now, now]
+        elif entry[0] != signature:
+            entry[0], entry[1] = signature, now
+
+    def ready(self, now: float) -> List[Tuple[str, float]]:
+        # [(đường dẫn, thời điểm thấy lần đầu)] của các file đã đứng yên.
+        settled = []
+        for path, entry in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature != entry[0]:
+                entry[0], entry[1] = signature, now
+                continue
+            quiet = now - entry[1]
+            if quiet >= self.settle and (stat.st_size > 0 or quiet >= EMPTY_FILE_SECONDS):
+                settled.append((path, entry[2]))
+                del self._pending[path]
+        return settled
+
+def warm_worker(preset: dict):
+    # Chạy một lần khi tạo mỗi worker: module nặng (cv2, scipy, fitz) đã nạp theo transformer,
+    # preset được dịch sẵn (bảng LUT, kernel, font) trước khi file đầu tiên tới.
+    # Ctrl+C gửi tới cả nhóm tiến trình: chỉ tiến trình chính xử lý, để file đang làm dở vẫn xong.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Cảnh báo của preset (nếu có) được báo lại theo từng file qua process_file, không báo lúc khởi động.
+    pipeline.compiled(transformer.load_preset_dict(preset))
+
+def worker_ready() -> int:
+    return os.getpid()
+
+def move_to(path: str, root: str, target_dir: str) -> str:
+    # Giữ đường dẫn tương đối so với thư mục theo dõi; trùng tên thì thêm hậu tố thời gian.
+    destination = os.path.join(target_dir, os.path.relpath(path, root))
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.exists(destination):
+        base, ext = os.path.splitext(destination)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        destination = f"{base}_{stamp}{ext}"
+        counter = 1
+        while os.path.exists(destination):
+            destination = f"{base}_{stamp}_{counter}{ext}"
+            counter += 1
+    shutil.move(path, destination)
+    return destination
+
+class HotFolder:
+    def __init__(self, roots: List[str], output_dir: str, preset: dict, workers: int | None = None,
+                 output_format: str | None = None, done_dir: str | None = None, failed_dir: str | None = None,
+                 recursive: bool = False, settle: float = DEFAULT_SETTLE_SECONDS, poll: bool = False,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, on_result=None):
+        self.roots = [os.path.abspath(r) for r in roots]
+        self.output_dir = output_dir
+        self.preset = preset
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.output_format = output_format
+        # Mặc định done/ và failed/ nằm trong từng thư mục theo dõi.
+        self.done_dir = done_dir
+        self.failed_dir = failed_dir
+        self.recursive = recursive
+        self.on_result = on_result
+        excluded = [os.path.abspath(output_dir)]
+        for root in self.roots:
+            excluded += [os.path.abspath(self._target(root, done_dir, 'done')),
+                         os.path.abspath(self._target(root, failed_dir, 'failed'))]
+        self.watcher = open_watcher(self.roots, recursive, excluded, poll, poll_interval)
+        self.tracker = SettleTracker(settle)
+        self.results: List[batch.FileResult] = []
+        self.latencies: List[float] = []
+        # future -> (file, thư mục theo dõi, lúc thấy file, pool đã nhận file, chạy riêng một mình?)
+        self._futures: Dict[Future, Tuple[str, str, float, ProcessPoolExecutor, bool]] = {}
+        self._in_flight: Set[str] = set()
+        # File đã sẵn sàng nhưng chưa gửi đi, và file đang chạy lúc worker chết (chờ chạy lại riêng lẻ).
+        self._queued: deque = deque()
+        self._suspects: deque = deque()
+        self._running = False
+        self._pool = self._start_pool()
+
+    @staticmethod
+    def _target(root: str, configured: str | None, default_name: str) -> str:
+        return configured if configured else os.path.join(root, default_name)
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker, initargs=(self.preset,))
+        # Tạo đủ worker ngay (pool chỉ tạo tiến trình khi có việc): file đầu tiên không phải chờ khởi động.
+        for future in [pool.submit(worker_ready) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def _root_of(self, path: str) -> str:
+        matches = [r for r in self.roots if path == r or path.startswith(r + os.sep)]
+        return max(matches, key=len) if matches else os.path.dirname(path)
+
+    def _enqueue(self, path: str, first_seen: float):
+        self._in_flight.add(path)
+        self._queued.append((path, self._root_of(path), first_seen))
+
+    def _submit(self, path: str, root: str, first_seen: float, solo: bool = False):
+        output_path = batch.build_output_path(path, self.output_dir, self.output_format, root)
+        future = self._pool.submit(batch.process_file, path, output_path, self.preset, False, None, None,
+                                   instrument.enabled())
+        self._futures[future] = (path, root, first_seen, self._pool, solo)
+
+    def _dispatch(self):
+        # Khi worker chết, mọi file đang chạy đều báo BrokenProcessPool dù chỉ một file gây ra. Các file đó
+        # được chạy lại từng file một, không có file nào khác chạy cùng: pool chết lần nữa thì chính file đó
+        # là nguyên nhân. File mới chờ tới khi hết file nghi vấn.
+        if self._suspects:
+            if not self._futures:
+                self._submit(*self._suspects.popleft(), solo=True)
+            return
+        while self._queued:
+            self._submit(*self._queued.popleft())
+
+    @property
+    def _busy(self) -> bool:
+        return bool(self._futures or self._queued or self._suspects)
+
+    def _collect(self, timeout: float = 0.0):
+        done = [f for f in self._futures if f.done()]
+        if not done and timeout and self._futures:
+            time.sleep(timeout)
+            done = [f for f in self._futures if f.done()]
+        broken = False
+        for future in done:
+            path, root, first_seen, pool, solo = self._futures.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # Pool cũ (đã dựng lại) thì không dựng lại lần nữa.
+                broken = broken or pool is self._pool
+                if not solo:
+                    self._suspects.append((path, root, first_seen))
+                    continue
+                result = batch.FileResult(path, "", False, 0.0, error="worker dừng đột ngột khi xử lý file")
+            except Exception as e:
+                result = batch.FileResult(path, "", False, 0.0, error=str(e))
+            self._in_flight.discard(path)
+            self._finish(result, root, first_seen)
+        if broken:
+            # Dựng lại pool để các file sau (và các file nghi vấn) vẫn được xử lý.
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._start_pool()
+
+    def _finish(self, result: batch.FileResult, root: str, first_seen: float):
+        instrument.replay(result.events)
+        result.events = []
+        try:
+            if result.success:
+                move_to(result.input_path, root, self._target(root, self.done_dir, 'done'))
+            else:
+                destination = move_to(result.input_path, root, self._target(root, self.failed_dir, 'failed'))
+                with open(destination + '.error.txt', 'w', encoding='utf-8') as f:
+                    f.write((result.error or 'không rõ nguyên nhân') + '\n')
+        except OSError as e:
+            print(f"CẢNH BÁO: Không chuyển được {result.input_path}: {e}")
+        result.seconds = time.monotonic() - first_seen
+        self.latencies.append(result.seconds)
+        self.results.append(result)
+        if self.on_result:
+            self.on_result(result)
+
+    def run(self, once: bool = False):
+        # once=True: xử lý các file đang có (kể cả đang chép dở) rồi dừng, thay cho quét bằng cron.
+        self._running = True
+        first = True
+        while self._running:
+            now = time.monotonic()
+            for path in self.watcher.changes(0 if first else TICK_SECONDS):
+                if path not in self._in_flight:
+                    self.tracker.touch(path, now)
+            first = False
+            for path, first_seen in self.tracker.ready(time.monotonic()):
+                self._enqueue(path, first_seen)
+            self._dispatch()
+            self._collect()
+            if once and not self.tracker and not self._busy:
+                break
+        while self._busy:
+            self._dispatch()
+            self._collect(TICK_SECONDS)
+
+    def stop(self):
+        # Dừng nhận file mới; file đang xử lý vẫn được làm xong trong run().
+        self._running = False
+
+    def close(self):
+        self.watcher.close()
+        self._pool.shutdown()
+
+def print_watch_summary(hot: HotFolder):
+    failed = sum(1 for r in hot.results if not r.success)
+    print(f"Đã xử lý {len(hot.results)} file ({failed} lỗi).")
+    if hot.latencies:
+        ordered = sorted(hot.latencies)
+        median = ordered[len(ordered) // 2]
+        print(f"Độ trễ từ lúc thả file tới khi có kết quả: trung vị {median:.2f}s, lớn nhất {ordered[-1]:.2f}s")
@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+
+def sample_array(width: int = 320, height: int = 213, seed: int = 1) -> np.ndarray:
+    # Gradient + nhiễu: đủ chi tiết để bộ mã hóa và các bộ lọc cho kết quả khác nhau theo tham số.
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 255, width)[None, :, None]
+    return np.clip(ramp + rng.normal(0, 40, (height, width, 3)), 0, 255).astype(np.uint8)
+
+
+@pytest.fixture
+def sample_image() -> Image.Image:
+    return Image.fromarray(sample_array())
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageChops, ImageEnhance
+
+from src import color_lut
+from conftest import sample_array
+
+
+def reference_sepia(img):
+    return Image.fromarray(np.clip(np.asarray(img) @ color_lut.SEPIA_MATRIX.T, 0, 255).astype(np.uint8))
+
+
+def reference_temperature(img, factor):
+    a = np.asarray(img).astype(np.float32)
+    if factor > 1.0:
+        a[:, :, 0] = np.clip(a[:, :, 0] * factor, 0, 255)
+        a[:, :, 1] = np.clip(a[:, :, 1] * (1 + (factor - 1) * 0.5), 0, 255)
+    else:
+        a[:, :, 2] = np.clip(a[:, :, 2] * (2 - factor), 0, 255)
+    return Image.fromarray(a.astype(np.uint8))
+
+
+def reference_chain(img, ops):
+    # Từng bước riêng lẻ như trước khi gộp phép màu (mỗi bước ghi ra ảnh uint8).
+    for op in ops:
+        name = op[0]
+        if name == 'brightness':
+            img = ImageEnhance.Brightness(img).enhance(op[1])
+        elif name == 'contrast':
+            img = ImageEnhance.Contrast(img).enhance(op[1])
+        elif name == 'saturation':
+            img = ImageEnhance.Color(img).enhance(op[1])
+        elif name == 'temperature':
+            img = reference_temperature(img, op[1])
+        elif name == 'sepia':
+            img = reference_sepia(img)
+        elif name == 'grayscale':
+            img = img.convert('L').convert('RGB')
+        elif name == 'invert':
+            img = ImageChops.invert(img)
+    return img
+
+
+CHAINS = [
+    [('brightness', 1.5), ('contrast', 1.5), ('saturation', 2.0)],
+    [('saturation', 3.0)],
+    [('saturation', 2.0), ('contrast', 1.5)],
+    [('temperature', 1.5), ('saturation', 1.7)],
+    [('brightness', 1.2), ('contrast', 1.3), ('saturation', 0.5), ('temperature', 1.2), ('grayscale',), ('invert',)],
+    [('sepia',), ('contrast', 0.8), ('brightness', 0.9)],
+    [('brightness', 0.8), ('saturation', 1.5), ('sepia',), ('contrast', 0.8), ('brightness', 0.9), ('invert',)],
+    [('contrast', 1.5), ('saturation', 2.0), ('temperature', 0.8), ('sepia',), ('grayscale',)],
+    [('brightness', 1.3), ('temperature', 0.7), ('invert',), ('contrast', 1.4)],
+]
+
+
+@pytest.mark.parametrize('ops', CHAINS, ids=lambda ops: '-'.join(op[0] for op in ops))
+def test_matches_per_step_chain(ops):
+    img = Image.fromarray(sample_array(256, 256))
+    expected = np.asarray(reference_chain(img, ops), dtype=np.int16)
+    actual = np.asarray(color_lut.apply_color_ops(img, list(ops)), dtype=np.int16)
+    assert np.abs(expected - actual).max() <= 1
+
+
+def test_keeps_alpha_channel():
+    img = Image.fromarray(sample_array(64, 64)).convert('RGBA')
+    img.putalpha(Image.linear_gradient('L').resize((64, 64)))
+    out = color_lut.apply_color_ops(img, [('saturation', 2.0), ('sepia',), ('grayscale',), ('brightness', 1.2)])
+    assert out.mode == 'RGBA'
+    assert out.getchannel('A').tobytes() == img.getchannel('A').tobytes()
+
+
+def write_cube(path, size=2, domain=None):
+    lines = [f"LUT_3D_SIZE {size}"]
+    if domain:
+        lines += [f"DOMAIN_MIN {domain[0]} {domain[0]} {domain[0]}", f"DOMAIN_MAX {domain[1]} {domain[1]} {domain[1]}"]
+    axis = np.linspace(0.0, 1.0, size)
+    for b in axis:
+        for g in axis:
+            for r in axis:
+                lines.append(f"{r:.6f} {g:.6f} {b:.6f}")
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_identity_cube_keeps_pixels(tmp_path):
+    img = Image.fromarray(sample_array(64, 64))
+    out = color_lut.apply_color_ops(img, [color_lut.cube_op(write_cube(tmp_path / 'id.cube', 17))])
+    assert np.abs(np.asarray(out, dtype=np.int16) - np.asarray(img, dtype=np.int16)).max() <= 1
+
+
+def test_rejects_non_default_cube_domain(tmp_path):
+    with pytest.raises(ValueError):
+        color_lut.read_cube(write_cube(tmp_path / 'hdr.cube', domain=(0.0, 2.0)))
+    assert color_lut.read_cube(write_cube(tmp_path / 'ok.cube', domain=('0.0', '1.0')))[0] == 2
@@ -0,0 +1,37 @@
+import os
+
+from PIL import Image
+
+from src import image_index
+
+
+def save(path, size):
+    Image.new('RGB', size, (10, 20, 30)).save(path)
+
+
+def test_rescan_reports_only_changes(tmp_path):
+    photos = tmp_path / 'photos'
+    (photos / 'sub').mkdir(parents=True)
+    save(photos / 'a.jpg', (40, 30))
+    save(photos / 'b.png', (20, 20))
+    save(photos / 'sub' / 'c.jpg', (10, 50))
+    (photos / 'notes.txt').write_text('không phải ảnh')
+
+    with image_index.ImageIndex(str(tmp_path / 'index.sqlite')) as index:
+        first = index.scan(str(photos), workers=2)
+        assert (first.added, first.updated, first.unchanged, first.removed) == (3, 0, 0, 0)
+
+        save(photos / 'a.jpg', (80, 60))
+        os.utime(photos / 'a.jpg', ns=(1, 1))
+        os.remove(photos / 'b.png')
+        save(photos / 'sub' / 'd.jpg', (5, 5))
+        second = index.scan(str(photos), workers=2)
+        assert (second.added, second.updated, second.unchanged, second.removed) == (1, 1, 1, 1)
+
+        records = {os.path.basename(r.path): r for r in index.query()}
+        assert sorted(records) == ['a.jpg', 'c.jpg', 'd.jpg']
+        assert (records['a.jpg'].width, records['a.jpg'].height) == (80, 60)
+        assert [os.path.basename(r.path) for r in index.query(min_width=10, format='jpeg')] == ['a.jpg', 'c.jpg']
+
+        third = index.scan(str(photos), workers=2)
+        assert (third.added, third.updated, third.unchanged, third.removed) == (0, 0, 3, 0)
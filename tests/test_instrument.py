@@ -0,0 +1,50 @@
+import io
+import threading
+
+from src import batch, instrument, pipeline, transformer
+
+
+PRESET = {'brightness': 1.2, 'contrast': 1.1, 'mirror': 'Ngang', 'border_width': 4}
+
+
+def test_library_is_silent_by_default(capsys, sample_image):
+    transformer.apply_transformations(sample_image, transformer.load_preset_dict(PRESET))
+    pipeline.Pipeline.compile(PRESET)(sample_image)
+    assert capsys.readouterr().out == ""
+
+
+def test_log_to_console_prints_steps(capsys, sample_image):
+    with instrument.log_to_console():
+        transformer.apply_transformations(sample_image, transformer.load_preset_dict(PRESET))
+    out = capsys.readouterr().out
+    assert "Đã điều chỉnh độ sáng (Factor: 1.2)." in out
+    assert "Đã thêm viền" in out
+    # Ra khỏi khối with thì im lặng trở lại.
+    transformer.apply_transformations(sample_image, transformer.load_preset_dict(PRESET))
+    assert capsys.readouterr().out == ""
+
+
+def test_process_file_reports_last_error_without_printing(tmp_path, capsys):
+    result = batch.process_file(str(tmp_path / 'missing.jpg'), str(tmp_path / 'out.jpg'), PRESET)
+    assert not result.success
+    assert result.error.startswith("LỖI: Không tìm thấy file")
+    assert capsys.readouterr().out == ""
+
+
+def test_log_capture_keeps_threads_apart():
+    capture = instrument.LogCapture()
+    buffers = [io.StringIO() for _ in range(4)]
+    barrier = threading.Barrier(len(buffers))
+
+    def work(n):
+        with capture.capture(buffers[n]):
+            barrier.wait()
+            transformer.log.warning("CẢNH BÁO: luồng %d", n)
+
+    with instrument.logging_to(capture):
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(len(buffers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert [b.getvalue() for b in buffers] == [f"CẢNH BÁO: luồng {n}\n" for n in range(len(buffers))]
@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from src import motion_blur
+from conftest import sample_array
+
+
+def reference_blur(arr: np.ndarray, size: int, angle: int) -> np.ndarray:
+    # Tích chập 2D đầy đủ với kernel gốc, không đường tắt nào.
+    kernel = motion_blur.motion_kernel(size, angle)
+    anchor = size - 1 - size // 2
+    return cv2.filter2D(arr, -1, np.ascontiguousarray(kernel[::-1, ::-1], dtype=np.float32),
+                        anchor=(anchor, anchor), borderType=cv2.BORDER_REFLECT)
+
+
+@pytest.mark.parametrize('size', [7, 8, 15, 16, 61, 64])
+@pytest.mark.parametrize('angle', [0, 30, 45, 90, 180, 270])
+def test_matches_full_convolution(size, angle):
+    arr = sample_array(160, 120)
+    actual = np.asarray(motion_blur.apply_motion_blur(Image.fromarray(arr), size, angle), dtype=np.int16)
+    assert np.abs(actual - reference_blur(arr, size, angle)).max() <= 1
+
+
+@pytest.mark.parametrize('size', [8, 15, 16, 61])
+@pytest.mark.parametrize('angle', [0, 90, 180, 270])
+def test_axis_aligned_blurs_use_box_filter(size, angle):
+    assert motion_blur._plan(size, angle)[0] == 'box'
+
+
+def test_size_one_is_identity():
+    img = Image.fromarray(sample_array(32, 32))
+    assert motion_blur.apply_motion_blur(img, 1, 45) is img
@@ -0,0 +1,47 @@
+import random
+
+import pytest
+from PIL import Image
+
+from src import pipeline, transformer
+from conftest import sample_array
+
+VARIANTS = dict(
+    crop_ratio=[None, '1:1', '16:9'], resize=[None, '200x150', '500x300'], mirror=[None, 'Ngang', 'Cả hai'],
+    brightness=[1.0, 1.3], contrast=[1.0, 1.4], saturation=[1.0, 0.5], temperature=[1.0, 1.2],
+    filter=['Không', 'Làm mờ', 'Làm nét'], artistic_filter=['Không', 'Nâu đỏ', 'Cổ điển', 'Dập nổi'],
+    motion_blur=[False, True], grayscale=[False, True], invert=[False, True], pixelate_size=[0, 6],
+    rotate=[None, '90', 'Xoay ngang', '180'], border_width=[0, 5], rounded_radius=[0, 10],
+    shadow_enabled=[False, True], watermark_text=['', 'Hello'], timestamp_enabled=[False, True])
+
+
+def random_presets(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        preset = {key: rng.choice(values) for key, values in VARIANTS.items()}
+        preset['timestamp_fixed'] = '2024-01-01 10:00'
+        yield preset, rng.choice(['RGB', 'L', 'RGBA'])
+
+
+@pytest.mark.parametrize('preset, mode', list(random_presets(40)))
+def test_pipeline_matches_apply_transformations(preset, mode):
+    img = Image.fromarray(sample_array()).convert(mode)
+    expected = transformer.apply_transformations(img, transformer.load_preset_dict(preset))
+    pipe = pipeline.Pipeline.compile(preset)
+    first, second = pipe(img), pipe(img)
+    assert (first.mode, first.size) == (expected.mode, expected.size)
+    assert first.tobytes() == expected.tobytes()
+    # Pipeline dùng lại được và không sửa ảnh đầu vào.
+    assert second.tobytes() == first.tobytes()
+
+
+def test_planner_drops_noop_steps():
+    pipe = pipeline.Pipeline.compile({'brightness': 1.0, 'contrast': 1.0, 'pixelate_size': 0})
+    assert pipe.describe() == []
+
+
+def test_colour_passes_move_past_permutes_but_not_resize():
+    pipe = pipeline.Pipeline.compile({'resize': '50x40', 'brightness': 1.2, 'mirror': 'Ngang',
+                                      'pixelate_size': 4, 'rotate': '90'})
+    assert pipe.describe() == ['resize', 'mirror[FLIP_LEFT_RIGHT]', 'pixelate', 'color[brightness]',
+                               'pixelate', 'rotate[ROTATE_90]']
@@ -0,0 +1,45 @@
+import io
+
+import numpy as np
+import pytest
+
+from src import quality_search
+
+
+@pytest.mark.parametrize('max_quality', [3, 5, 40, 90])
+def test_never_exceeds_preset_quality(sample_image, max_quality):
+    _, choice = quality_search.choose_quality(sample_image, 'JPEG', max_quality=max_quality,
+                                              target_bytes=10 ** 7, min_ssim=0.5)
+    assert 1 <= choice.quality <= max_quality
+
+
+@pytest.mark.parametrize('format', ['JPEG', 'WEBP'])
+def test_target_bytes_picks_largest_fitting_quality(sample_image, format):
+    sizes = {}
+    for quality in range(quality_search.MIN_QUALITY, 91):
+        buffer = io.BytesIO()
+        sample_image.save(buffer, format, quality=quality)
+        sizes[quality] = buffer.tell()
+    target = (sizes[30] + sizes[60]) // 2
+    data, choice = quality_search.choose_quality(sample_image, format, max_quality=90, target_bytes=target)
+    assert choice.met and len(data) == choice.size == sizes[choice.quality] <= target
+    # Ranh giới tìm được: quality kế tiếp đã vượt dung lượng cho phép.
+    assert sizes[choice.quality + 1] > target
+
+
+def test_unreachable_target_reports_not_met(sample_image):
+    _, choice = quality_search.choose_quality(sample_image, 'JPEG', max_quality=90, target_bytes=100)
+    assert not choice.met
+    assert choice.quality == quality_search.MIN_QUALITY
+
+
+def test_min_ssim_picks_smallest_matching_quality(sample_image):
+    _, choice = quality_search.choose_quality(sample_image, 'JPEG', max_quality=95, min_ssim=0.9)
+    assert choice.met and choice.ssim >= 0.9
+    search = quality_search.QualitySearch(sample_image, 'JPEG')
+    assert search.score(choice.quality - 1) < 0.9
+
+
+def test_ssim_of_identical_images_is_one(sample_image):
+    luma = np.asarray(sample_image.convert('L'))
+    assert quality_search.ssim(luma, luma) == pytest.approx(1.0)
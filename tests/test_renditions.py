@@ -0,0 +1,70 @@
+import pytest
+
+from src import pipeline, renditions, transformer
+
+
+def render_args(tmp_path, specs, **preset):
+    preset['renditions'] = specs
+    return transformer.load_preset_dict(preset, output_path=str(tmp_path / 'photo.jpg'))
+
+
+def test_renders_largest_first_without_upscaling(tmp_path, sample_image):
+    specs = [{'name': 'thumb', 'width': 80}, {'name': 'huge', 'width': 5000},
+             {'name': 'mid', 'height': 100, 'format': 'webp'}]
+    outputs = renditions.render(sample_image, render_args(tmp_path, specs))
+    assert [o.rendition.name for o in outputs] == ['huge', 'mid', 'thumb']
+    assert [o.image.size for o in outputs] == [(320, 213), (150, 100), (80, 53)]
+    assert [o.path for o in outputs] == [str(tmp_path / 'photo_huge.jpg'), str(tmp_path / 'photo_mid.webp'),
+                                         str(tmp_path / 'photo_thumb.jpg')]
+
+
+
+def test_smaller_renditions_scale_only_watermark_fields(tmp_path, sample_image, monkeypatch):
+    seen = []
+    original = pipeline.Pipeline.watermark
+
+    def watermark(self, img, keep=None, progress=None, args=None):
+        seen.append(args)
+        return original(self, img, keep, progress, args)
+
+    monkeypatch.setattr(pipeline.Pipeline, 'watermark', watermark)
+    args = render_args(tmp_path, [{'name': 'full', 'width': 400}, {'name': 'half', 'width': 166}],
+                       watermark_text='x', watermark_font_size=40, timestamp_enabled=True,
+                       timestamp_font_size=20, timestamp_fixed='2024-01-02 03:04', border_width=6,
+                       rounded_radius=12, shadow_enabled=True, shadow_offset=8, shadow_blur=10)
+    outputs = renditions.render(sample_image, args)
+    full, half = seen
+    assert full is None
+    # Viền, bo góc, bóng đã có trong ảnh gốc trước khi thu nhỏ: chỉ cỡ chữ watermark/timestamp đổi.
+    assert {k for k, v in vars(half).items() if v != getattr(args, k)} == {'watermark_font_size',
+                                                                          'timestamp_font_size'}
+    scale = outputs[1].image.width / outputs[0].image.width
+    assert (half.watermark_font_size, half.timestamp_font_size) == (round(40 * scale), round(20 * scale))
+
+def test_save_options_override_preset(tmp_path):
+    rendition = renditions.parse_renditions([{'width': 10, 'quality': 70, 'target_size_kb': 2.5,
+                                              'min_ssim': 0.95}])[0]
+    options = rendition.save_options(render_args(tmp_path, None, quality=90))
+    assert options == {'quality': 70, 'target_bytes': 2560, 'min_ssim': 0.95}
+    assert rendition.name == '10w'
+
+
+@pytest.mark.parametrize('specs', [
+    {'width': 10},
+    [{'name': 'a'}],
+    [{'width': 0}],
+    [{'width': 10.5}],
+    [{'width': True}],
+    [{'width': '10'}],
+    [{'width': 10, 'quality': 101}],
+    [{'width': 10, 'format': 'gif'}],
+    [{'width': 10, 'target_size_kb': 0}],
+    [{'width': 10, 'target_size_kb': '50'}],
+    [{'width': 10, 'min_ssim': 1.5}],
+    [{'width': 10, 'min_ssim': float('nan')}],
+    [{'width': 10, 'colour': 'red'}],
+    [{'name': 'a', 'width': 10}, {'name': 'a', 'height': 10}],
+])
+def test_rejects_invalid_specs(specs):
+    with pytest.raises(ValueError):
+        renditions.parse_renditions(specs)
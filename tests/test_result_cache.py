@@ -0,0 +1,73 @@
+import importlib.util
+import os
+
+from src import result_cache, transformer
+
+
+def write(path, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_fetch_hits_after_store(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'))
+    output = write(tmp_path / 'out.jpg', b'x' * 100)
+    assert not cache.fetch('a' * 64, str(tmp_path / 'copy.jpg'))
+    assert cache.store('a' * 64, str(output))
+    assert cache.fetch('a' * 64, str(tmp_path / 'copy.jpg'))
+    assert (tmp_path / 'copy.jpg').read_bytes() == b'x' * 100
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (1, 1, 1)
+    cache.close()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'), max_bytes=250)
+    for key in ('a', 'b'):
+        cache.store(key * 64, str(write(tmp_path / f'{key}.jpg', b'x' * 100)))
+    # Dùng lại 'a' để 'b' thành bản lâu nhất chưa dùng.
+    assert cache.fetch('a' * 64, str(tmp_path / 'copy.jpg'))
+    cache.store('c' * 64, str(write(tmp_path / 'c.jpg', b'x' * 100)))
+    assert cache.stats()['evictions'] == 1
+    assert cache.fetch('a' * 64, str(tmp_path / 'copy.jpg'))
+    assert not cache.fetch('b' * 64, str(tmp_path / 'copy.jpg'))
+    assert cache.fetch('c' * 64, str(tmp_path / 'copy.jpg'))
+    assert cache.stats()['bytes'] <= 250
+    cache.close()
+
+
+def test_skips_results_larger_than_cache(tmp_path):
+    cache = result_cache.ResultCache(str(tmp_path / 'cache'), max_bytes=50)
+    assert not cache.store('a' * 64, str(write(tmp_path / 'a.jpg', b'x' * 100)))
+    cache.close()
+
+
+def args_for(source, output_path, brightness=1.2):
+    return transformer.load_preset_dict({'brightness': brightness}, input_path=str(source),
+                                        output_path=str(output_path))
+
+
+def test_key_follows_input_and_settings(tmp_path):
+    source = write(tmp_path / 'in.jpg', b'input')
+    key = result_cache.cache_key(args_for(source, tmp_path / 'o.jpg'))
+    # Đường dẫn đầu ra không thuộc khóa, đuôi file thì có.
+    assert result_cache.cache_key(args_for(source, tmp_path / 'other' / 'x.jpg')) == key
+    assert result_cache.cache_key(args_for(source, tmp_path / 'o.png')) != key
+    assert result_cache.cache_key(args_for(source, tmp_path / 'o.jpg', brightness=1.3)) != key
+    write(source, b'changed')
+    os.utime(source, (1, 1))
+    assert result_cache.cache_key(args_for(source, tmp_path / 'o.jpg')) != key
+
+
+def test_key_follows_transform_source(tmp_path, monkeypatch):
+    source = write(tmp_path / 'in.jpg', b'input')
+    key = result_cache.cache_key(args_for(source, tmp_path / 'o.jpg'))
+    monkeypatch.setattr(result_cache, 'code_digest', lambda: 'edited')
+    assert result_cache.cache_key(args_for(source, tmp_path / 'o.jpg')) != key
+
+
+def test_code_digest_covers_every_module():
+    for name in result_cache.TRANSFORM_MODULES:
+        assert importlib.util.find_spec(f'src.{name}') is not None
+    assert len(result_cache.code_digest()) == 64
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+from PIL import Image
+
+from conftest import sample_array
+from src import streaming
+
+
+PRESET = {'brightness': 1.2, 'border_width': 3}
+
+
+def make_jobs(tmp_path, count):
+    jobs = []
+    for n in range(count):
+        source = tmp_path / f'in_{n}.jpg'
+        Image.fromarray(sample_array(120, 80, seed=n)).save(source)
+        jobs.append((str(source), str(tmp_path / 'out' / f'out_{n}.jpg')))
+    return jobs
+
+
+def run_with_timeout(run, timeout: float = 30.0) -> dict:
+    # Dây chuyền bị treo thì test báo lỗi thay vì treo theo.
+    outcome = {}
+
+    def target():
+        try:
+            outcome['report'] = run()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "run_stream không kết thúc"
+    return outcome
+
+
+def test_stream_processes_every_job(tmp_path):
+    jobs = make_jobs(tmp_path, 6)
+    report = streaming.run_stream(jobs, PRESET, decode_workers=2, process_workers=1, encode_workers=2, queue_size=1)
+    assert sorted(r.input_path for r in report.results) == sorted(path for path, _ in jobs)
+    assert all(r.success for r in report.results)
+    assert [s.items for s in report.stages] == [6, 6, 6]
+
+
+@pytest.mark.parametrize('stage', ['_decode', '_process', '_encode'])
+def test_base_exception_in_stage_reaches_caller(tmp_path, monkeypatch, stage):
+    jobs = make_jobs(tmp_path, 8)
+    original = getattr(streaming.StreamingBatch, stage)
+    calls = []
+
+    def failing(self, item):
+        calls.append(item.input_path)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return original(self, item)
+
+    monkeypatch.setattr(streaming.StreamingBatch, stage, failing)
+    outcome = run_with_timeout(lambda: streaming.run_stream(jobs, PRESET, decode_workers=1, process_workers=1,
+                                                            encode_workers=1, queue_size=1))
+    assert isinstance(outcome.get('error'), KeyboardInterrupt)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src import tiled, transformer
+from conftest import sample_array
+
+PRESETS = {
+    'geometry-color': {'crop_ratio': '16:9', 'resize': '250x140', 'mirror': 'Cả hai', 'brightness': 1.2,
+                       'saturation': 1.5, 'artistic_filter': 'Nâu đỏ', 'pixelate_size': 4},
+    'filter-then-contrast': {'filter': 'Làm mờ', 'contrast': 1.4, 'invert': True},
+    'motion-blur': {'motion_blur': True, 'motion_blur_size': 16, 'motion_blur_angle': 30, 'grayscale': True},
+    'frame-watermark': {'border_width': 6, 'rounded_radius': 12, 'shadow_enabled': True,
+                        'watermark_text': 'Tile', 'timestamp_enabled': True, 'timestamp_fixed': '2024-01-01 10:00'},
+}
+
+SOURCES = {
+    'jpg': lambda img: (img, {'quality': 95}),
+    'png': lambda img: (img, {}),
+    'palette.png': lambda img: (img.convert('P'), {}),
+    'gray.png': lambda img: (img.convert('L'), {}),
+    'bmp': lambda img: (img, {}),
+}
+
+
+def process(source, output, preset, tiled_mode):
+    args = transformer.load_preset_dict(preset, input_path=str(source), output_path=str(output))
+    ok = tiled.transform_tiled(args, memory_budget_mb=0.05) if tiled_mode else transformer.transform_image(args)
+    assert ok
+    return np.asarray(Image.open(output), dtype=np.int16)
+
+
+@pytest.mark.parametrize('source_format', sorted(SOURCES))
+@pytest.mark.parametrize('preset', sorted(PRESETS))
+def test_tiled_matches_in_memory(tmp_path, source_format, preset):
+    img, options = SOURCES[source_format](Image.fromarray(sample_array(300, 200)))
+    source = tmp_path / f'source.{source_format}'
+    img.save(source, **options)
+    expected = process(source, tmp_path / 'memory.png', PRESETS[preset], False)
+    actual = process(source, tmp_path / 'tiled.png', PRESETS[preset], True)
+    assert actual.shape == expected.shape
+    assert np.abs(actual - expected).max() <= 1
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'L', 'P'])
+def test_open_source_decodes_to_rgb(tmp_path, mode):
+    img = Image.fromarray(sample_array(120, 90)).convert(mode)
+    img.save(tmp_path / 'source.png')
+    source = tiled.open_source(str(tmp_path / 'source.png'), budget=1 << 16)
+    try:
+        assert np.array_equal(source.read_rows(0, 90), np.asarray(img.convert('RGB')))
+    finally:
+        source.close()
+
+
+def test_unbounded_pixels_restores_limit_when_nested():
+    limit = Image.MAX_IMAGE_PIXELS
+    with tiled.unbounded_pixels():
+        with tiled.unbounded_pixels():
+            assert Image.MAX_IMAGE_PIXELS is None
+        assert Image.MAX_IMAGE_PIXELS is None
+    assert Image.MAX_IMAGE_PIXELS == limit
@@ -0,0 +1,101 @@
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from src import batch, watch
+
+
+class FakePool:
+    # Thay ProcessPoolExecutor: test tự quyết định kết quả của từng file.
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, path, *args):
+        future = Future()
+        self.submitted.append((path, future))
+        return future
+
+    def names(self):
+        return [os.path.basename(path) for path, _ in self.submitted]
+
+    def shutdown(self, **kwargs):
+        pass
+
+
+def make_hot_folder(tmp_path, monkeypatch, names):
+    pools = []
+
+    def start_pool(self):
+        pools.append(FakePool())
+        return pools[-1]
+
+    monkeypatch.setattr(watch.HotFolder, '_start_pool', start_pool)
+    root = tmp_path / 'in'
+    root.mkdir()
+    hot = watch.HotFolder([str(root)], str(tmp_path / 'out'), {}, workers=4, poll=True)
+    for name in names:
+        (root / name).write_bytes(b'x')
+        hot._enqueue(str(root / name), 0.0)
+    return hot, root, pools
+
+
+def succeed(pool, index):
+    path, future = pool.submitted[index]
+    future.set_result(batch.FileResult(path, "", True, 0.0))
+
+
+def crash(pool):
+    for _, future in pool.submitted:
+        if not future.done():
+            future.set_exception(BrokenProcessPool())
+
+
+def test_only_the_file_that_kills_the_worker_fails(tmp_path, monkeypatch):
+    hot, root, pools = make_hot_folder(tmp_path, monkeypatch, ['a.jpg', 'b.jpg', 'c.jpg'])
+    hot._dispatch()
+    assert pools[0].names() == ['a.jpg', 'b.jpg', 'c.jpg']
+
+    # Một worker chết: cả ba file cùng báo BrokenProcessPool, chưa file nào bị đưa vào failed/.
+    crash(pools[0])
+    hot._collect()
+    assert len(pools) == 2 and not hot.results
+
+    # Chạy lại từng file một trong pool mới; file tới sau phải chờ.
+    (root / 'd.jpg').write_bytes(b'x')
+    hot._enqueue(str(root / 'd.jpg'), 0.0)
+    hot._dispatch()
+    assert pools[1].names() == ['a.jpg']
+    succeed(pools[1], 0)
+    hot._collect()
+    hot._dispatch()
+    assert pools[1].names() == ['a.jpg', 'b.jpg']
+    crash(pools[1])
+    hot._collect()
+    assert len(pools) == 3
+    hot._dispatch()
+    succeed(pools[2], 0)
+    hot._collect()
+    hot._dispatch()
+    assert pools[2].names() == ['c.jpg', 'd.jpg']
+    succeed(pools[2], 1)
+    hot._collect()
+
+    outcome = {os.path.basename(r.input_path): r.success for r in hot.results}
+    assert outcome == {'a.jpg': True, 'b.jpg': False, 'c.jpg': True, 'd.jpg': True}
+    assert sorted(os.listdir(root / 'done')) == ['a.jpg', 'c.jpg', 'd.jpg']
+    assert sorted(os.listdir(root / 'failed')) == ['b.jpg', 'b.jpg.error.txt']
+    assert not hot._busy
+    hot.watcher.close()
+
+
+def test_late_failures_from_a_replaced_pool_do_not_restart_it_again(tmp_path, monkeypatch):
+    hot, root, pools = make_hot_folder(tmp_path, monkeypatch, ['a.jpg', 'b.jpg'])
+    hot._dispatch()
+    # Chỉ thấy một future hỏng ở lần thu kết quả đầu; future kia báo lỗi sau khi pool đã được dựng lại.
+    pools[0].submitted[0][1].set_exception(BrokenProcessPool())
+    hot._collect()
+    pools[0].submitted[1][1].set_exception(BrokenProcessPool())
+    hot._collect()
+    assert len(pools) == 2
+    assert len(hot._suspects) == 2 and not hot.results
+    hot.watcher.close()